@@ -0,0 +1,441 @@
+#!usr/bin/env python3
+# Evaluate many tetromino placements at once by stacking the candidate playfields into a single numpy array
+
+import functools
+
+import numpy as np
+
+from . import kernel
+from .features import BASE_FEATURES, FEATURES, FeatureContext, measure_features
+from .playfield import Playfield
+from .tetromino import DISTINCT_ROTATIONS, PLACEMENTS
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# Every tetromino is made of this many blocks
+NUM_BLOCKS = 4
+
+# Structure of a single evaluated placement. placement is an index into the PLACEMENT_* arrays below, or -1 for an
+# outcome where no tetromino was placed (i.e. an empty hold was swapped in). Every registered feature has a field,
+# but features other than features.BASE_FEATURES are only measured when requested, and are 0 otherwise.
+FEATURE_DTYPE = np.dtype(
+    [
+        ("base", np.int32),
+        ("placement", np.int16),
+        ("hold_swap", np.bool_),
+        ("rotations", np.uint8),
+        ("col", np.uint8),
+        ("row", np.int16),
+        ("rows_cleared", np.uint8),
+        ("gaps", np.uint16),
+        ("gap_depth", np.uint16),
+        ("wells", np.uint8),
+    ]
+    + [
+        (feature.field, feature.dtype)
+        for feature in FEATURES.values()
+        if feature.name not in BASE_FEATURES
+    ]
+)
+
+# Base features that are measured from the resulting boards, rather than set directly from the placement
+BOARD_FEATURES = ("gaps", "gap depth", "wells")
+
+# Flatten the placement table into arrays so that placements can be looked up for a whole batch at once
+PLACEMENT_KEYS = list(PLACEMENTS.keys())
+PLACEMENT_IDS = {key: index for index, key in enumerate(PLACEMENT_KEYS)}
+PLACEMENT_HEIGHTS = np.array([PLACEMENTS[key].height for key in PLACEMENT_KEYS])
+PLACEMENT_WIDTHS = np.array([PLACEMENTS[key].width for key in PLACEMENT_KEYS])
+PLACEMENT_ROTATIONS = np.array([key[1] for key in PLACEMENT_KEYS], dtype=np.uint8)
+# Elevations are padded up to the maximum tetromino width. Padded columns are masked by PLACEMENT_COL_VALID.
+PLACEMENT_ELEVATIONS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+PLACEMENT_COL_VALID = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.bool_)
+# Row, column and value of each block relative to the top left of the tetromino grid
+PLACEMENT_BLOCK_ROWS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+PLACEMENT_BLOCK_COLS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+PLACEMENT_BLOCK_VALUES = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.uint8)
+# Number of blocks of the tetromino in the same row as each block
+PLACEMENT_BLOCK_ROW_COUNTS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+# Rows of the top and bottom block in each column of the tetromino grid. The blocks of a column are always contiguous.
+PLACEMENT_COL_TOPS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+PLACEMENT_COL_BOTTOMS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+# Occupancy mask of each row of the tetromino grid, padded with empty rows
+PLACEMENT_ROW_MASKS = np.zeros((len(PLACEMENT_KEYS), NUM_BLOCKS), dtype=np.int64)
+for _index, _key in enumerate(PLACEMENT_KEYS):
+    _placement = PLACEMENTS[_key]
+    PLACEMENT_ROW_MASKS[_index, : _placement.height] = [
+        occupancy for occupancy, _ in _placement.masks
+    ]
+    PLACEMENT_ELEVATIONS[_index, : _placement.width] = _placement.elevations
+    PLACEMENT_COL_VALID[_index, : _placement.width] = True
+    _block_rows, _block_cols = np.nonzero(_placement.grid)
+    PLACEMENT_BLOCK_ROWS[_index] = _block_rows
+    PLACEMENT_BLOCK_COLS[_index] = _block_cols
+    PLACEMENT_BLOCK_VALUES[_index] = _placement.grid[_block_rows, _block_cols]
+    PLACEMENT_BLOCK_ROW_COUNTS[_index] = np.bincount(_block_rows)[_block_rows]
+    for _col in range(_placement.width):
+        _col_rows = _block_rows[_block_cols == _col]
+        PLACEMENT_COL_TOPS[_index, _col] = _col_rows.min()
+        PLACEMENT_COL_BOTTOMS[_index, _col] = _col_rows.max()
+
+
+# Bit of each column in a row occupancy mask, and the number of horizontal changes between filled and empty blocks in
+# a row with each occupancy mask, with the walls counted as filled, as in FeatureContext.row_transitions
+ROW_BITS = 1 << np.arange(WIDTH, dtype=np.int64)
+_row_blocks = np.pad(
+    (np.arange(1 << WIDTH)[:, None] & ROW_BITS) != 0,
+    ((0, 0), (1, 1)),
+    constant_values=True,
+)
+ROW_TRANSITIONS = np.count_nonzero(_row_blocks[:, 1:] != _row_blocks[:, :-1], axis=1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_candidates(shape):
+    """
+    Return arrays of placement indices and columns for every distinct placement of the shape, ordered by rotations
+    then column. The arrays are cached, so they are read-only.
+    """
+    placement_ids = []
+    cols = []
+    for rotations in DISTINCT_ROTATIONS[shape]:
+        placement = PLACEMENTS[(shape, rotations)]
+        placement_ids += [PLACEMENT_IDS[(shape, rotations)]] * len(placement.columns)
+        cols += list(placement.columns)
+    placement_ids = np.array(placement_ids, dtype=np.int64)
+    cols = np.array(cols, dtype=np.int64)
+    placement_ids.setflags(write=False)
+    cols.setflags(write=False)
+    return placement_ids, cols
+
+
+def get_empty_features(hold_swap):
+    """
+    Return a FEATURE_DTYPE array containing only an outcome where no tetromino is placed, e.g. because an empty hold
+    was swapped in.
+    """
+    features = np.zeros(1, dtype=FEATURE_DTYPE)
+    features["placement"] = -1
+    features["hold_swap"] = hold_swap
+    features["row"] = HEIGHT
+    return features
+
+
+def get_column_tops(boards):
+    """
+    Return array containing the row of the top filled block of each column of each board, or the height of the
+    board for empty columns.
+    """
+    filled = boards != 0
+    return np.where(filled.any(axis=1), filled.argmax(axis=1), HEIGHT)
+
+
+def get_drop_rows(tops, bases, placement_ids, cols):
+    """
+    Return the row of the top block of each tetromino when dropped with its left side aligned with the column, using
+    the column tops of the base boards.
+    """
+    grid_cols = cols[:, None] + np.arange(NUM_BLOCKS)
+    valid = PLACEMENT_COL_VALID[placement_ids]
+    col_tops = tops[bases[:, None], np.where(valid, grid_cols, 0)]
+    col_drop_rows = (
+        col_tops
+        - PLACEMENT_HEIGHTS[placement_ids][:, None]
+        + PLACEMENT_ELEVATIONS[placement_ids]
+    )
+    # The highest of the per-column drop rows is the final drop row
+    return np.where(valid, col_drop_rows, HEIGHT).min(axis=1)
+
+
+def clear_filled_rows(boards):
+    """
+    Remove filled rows from every board in place, in the same way as Playfield. Return the number of rows cleared
+    from each board.
+    """
+    filled = boards != 0
+    full_rows = filled.all(axis=2)
+    kept_rows = ~full_rows & filled.any(axis=2)
+    # Only boards with a filled row, or an empty row underneath a kept row, need to be compacted
+    compact = np.nonzero(
+        full_rows.any(axis=1) | (kept_rows[:, :-1] & ~kept_rows[:, 1:]).any(axis=1)
+    )[0]
+    if compact.size:
+        kept = kept_rows[compact]
+        # A stable sort moves the kept rows to the bottom without changing their order
+        order = np.argsort(kept, axis=1, kind="stable")
+        compacted = np.take_along_axis(boards[compact], order[:, :, None], axis=1)
+        compacted[np.arange(HEIGHT) < (HEIGHT - kept.sum(axis=1))[:, None]] = 0
+        boards[compact] = compacted
+    return full_rows.sum(axis=1)
+
+
+def get_board_features(boards):
+    """
+    Return the gap count, gap depth and well count of every board, matching the Playfield metric methods.
+    """
+    values = measure_features(FeatureContext(boards, None, None, None), BOARD_FEATURES)
+    return values["gaps"], values["gap depth"], values["wells"]
+
+
+def get_extra_features(feature_names):
+    """Return the names of the features that are measured in addition to the base features"""
+    return tuple(name for name in feature_names if name not in BASE_FEATURES)
+
+
+def place_tetrominoes(grids, bases, placement_ids, cols, count_eroded=True, rows=None):
+    """
+    Drop and lock a tetromino onto a copy of a base board for every candidate, and clear filled rows, with numpy.
+    Candidates are described as in evaluate_placements. Return the drop rows (or the given rows), the resulting
+    boards, and the number of rows cleared and of tetromino blocks cleared (or None unless count_eroded is true).
+    """
+    if rows is None:
+        rows = get_drop_rows(get_column_tops(grids), bases, placement_ids, cols)
+
+    # Lock every tetromino into its own copy of the base board. As with Playfield, negative rows wrap around.
+    boards = grids[bases]
+    boards[
+        np.arange(len(bases))[:, None],
+        rows[:, None] + PLACEMENT_BLOCK_ROWS[placement_ids],
+        cols[:, None] + PLACEMENT_BLOCK_COLS[placement_ids],
+    ] = PLACEMENT_BLOCK_VALUES[placement_ids]
+
+    eroded_blocks = None
+    if count_eroded:
+        # Count the blocks of each tetromino that are in a filled row, before the rows are cleared
+        full_rows = (boards != 0).all(axis=2)
+        eroded_blocks = full_rows[
+            np.arange(len(bases))[:, None],
+            (rows[:, None] + PLACEMENT_BLOCK_ROWS[placement_ids]) % HEIGHT,
+        ].sum(axis=1)
+
+    rows_cleared = clear_filled_rows(boards)
+    return rows, boards, rows_cleared, eroded_blocks
+
+
+def measure_features_from_stats(grids, bases, placement_ids, cols, rows, feature_names):
+    """
+    Measure the named features for every candidate without locking its tetromino, by adjusting the statistics of its
+    base board, e.g. the column tops, where the tetromino lands. Candidates are described as in evaluate_placements,
+    and rows are their drop rows, see get_drop_rows. The values are only exact for candidates that clear no rows and
+    are locked inside the playfield, on a base board without full rows or empty rows below a filled row, so that the
+    board isn't compacted. Return the dictionary of values, and the mask of candidates where they are exact.
+    """
+    grids = np.asarray(grids, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH)
+    base_context = FeatureContext(grids, None, None, None)
+    filled = base_context.filled
+    row_counts = np.count_nonzero(filled, axis=2)
+    occupied_rows = row_counts > 0
+    # Base boards with a full row, or an empty row below a filled row, are compacted by any placement
+    compacted = (row_counts == WIDTH).any(axis=1) | (
+        occupied_rows[:, :-1] & ~occupied_rows[:, 1:]
+    ).any(axis=1)
+    block_rows = rows[:, None] + PLACEMENT_BLOCK_ROWS[placement_ids]
+    # A row is filled if its blocks and the tetromino's blocks in it fill the width of the playfield
+    fills_row = (
+        row_counts[bases[:, None], block_rows % HEIGHT]
+        + PLACEMENT_BLOCK_ROW_COUNTS[placement_ids]
+        == WIDTH
+    )
+    exact = (block_rows.min(axis=1) >= 0) & ~fills_row.any(axis=1) & ~compacted[bases]
+
+    # Each row of the tetromino replaces the transitions of the row it lands in
+    row_masks = filled.astype(np.int64) @ ROW_BITS
+    row_transitions = base_context.row_transitions[bases]
+    candidates, tetr_rows = np.nonzero(PLACEMENT_ROW_MASKS[placement_ids])
+    grid_rows = (rows[candidates] + tetr_rows) % HEIGHT
+    row_transitions[candidates, grid_rows] = ROW_TRANSITIONS[
+        row_masks[bases[candidates], grid_rows]
+        | (
+            PLACEMENT_ROW_MASKS[placement_ids[candidates], tetr_rows]
+            << cols[candidates]
+        )
+    ]
+
+    column_tops = base_context.column_tops[bases]
+    column_gaps = base_context.column_gaps[bases]
+    lowest_gaps = base_context.lowest_gaps[bases]
+    column_transitions = base_context.column_transitions[bases]
+    candidates, tetr_cols = np.nonzero(PLACEMENT_COL_VALID[placement_ids])
+    grid_cols = cols[candidates] + tetr_cols
+    candidate_ids = placement_ids[candidates]
+    candidate_rows = rows[candidates]
+    tops = candidate_rows + PLACEMENT_COL_TOPS[candidate_ids, tetr_cols]
+    bottoms = candidate_rows + PLACEMENT_COL_BOTTOMS[candidate_ids, tetr_cols]
+    old_tops = column_tops[candidates, grid_cols]
+    # The empty blocks between the bottom of the tetromino and the old top of the column become gaps
+    column_gaps[candidates, grid_cols] += old_tops - bottoms - 1
+    # If the tetromino fills the lowest empty block, the lowest empty block is now just above the tetromino
+    lowest_gaps[candidates, grid_cols] = np.where(
+        lowest_gaps[candidates, grid_cols] == bottoms + 1,
+        np.where(tops > 0, tops, HEIGHT),
+        lowest_gaps[candidates, grid_cols],
+    )
+    # The tetromino adds a change above itself, unless it reaches the top, and either adds a change below itself or
+    # removes the change above the old top, which it now rests on
+    column_transitions[candidates, grid_cols] += (tops > 0) + np.where(
+        bottoms + 1 < old_tops, 1, -1
+    )
+    column_tops[candidates, grid_cols] = tops
+
+    context = FeatureContext.from_stats(
+        column_tops,
+        column_gaps,
+        lowest_gaps,
+        column_transitions,
+        row_transitions,
+        rows,
+        PLACEMENT_HEIGHTS[placement_ids],
+    )
+    return measure_features(context, feature_names), exact
+
+
+def _check_kernel_results_(grids, bases, placement_ids, cols, rows, kernel_results):
+    """Raise AssertionError if the results of kernel.place_tetrominoes differ from numpy"""
+    numpy_results = place_tetrominoes(grids, bases, placement_ids, cols, rows=rows)
+    names = ["rows", "boards", "rows cleared", "eroded blocks"]
+    for name, kernel_values, numpy_values in zip(names, kernel_results, numpy_results):
+        if not np.array_equal(kernel_values, numpy_values):
+            raise AssertionError("kernel {} differ from numpy".format(name))
+    rows, boards, rows_cleared, _ = numpy_results
+    numpy_features = get_board_features(boards)
+    for name, numpy_values in zip(BOARD_FEATURES, numpy_features):
+        if not np.array_equal(kernel_results[4][name], numpy_values):
+            raise AssertionError("kernel {} differs from numpy".format(name))
+
+
+def evaluate_placements(
+    grids, bases, placement_ids, cols, return_boards=False, feature_names=(), rows=None
+):
+    """
+    Drop a tetromino onto a copy of a base board for every candidate, clear filled rows and measure the resulting
+    board. grids is an array of base boards, and each candidate is described by the index of its base board, its
+    placement index and its column. Return a FEATURE_DTYPE array with one entry per candidate, and also the resulting
+    boards if return_boards is true. The base features are always measured, and feature_names are the names of any
+    other features in features.FEATURES to measure. If rows is given, each tetromino is locked at its row rather than
+    dropped, e.g. for placements from movegen that are tucked under an overhang. The placements are made with the
+    backend selected in kernel.
+    """
+    extra_features = get_extra_features(feature_names)
+    grids = np.asarray(grids, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH)
+    bases = np.asarray(bases, dtype=np.int64)
+    placement_ids = np.asarray(placement_ids, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+
+    features = np.zeros(len(bases), dtype=FEATURE_DTYPE)
+    features["base"] = bases
+    features["placement"] = placement_ids
+    features["rotations"] = PLACEMENT_ROTATIONS[placement_ids]
+    features["col"] = cols
+
+    backend = kernel.get_backend()
+    if backend == "numpy":
+        rows, boards, rows_cleared, eroded_blocks = place_tetrominoes(
+            grids, bases, placement_ids, cols, "eroded cells" in extra_features, rows
+        )
+        board_features = {}
+        measured = BOARD_FEATURES + extra_features
+    else:
+        # The kernel measures the base features itself
+        results = kernel.place_tetrominoes(
+            grids, bases, placement_ids, cols, backend == "numba", rows
+        )
+        if backend == "check":
+            _check_kernel_results_(grids, bases, placement_ids, cols, rows, results)
+        rows, boards, rows_cleared, eroded_blocks, board_features = results
+        measured = extra_features
+
+    features["row"] = rows
+    features["rows_cleared"] = rows_cleared
+    # Features measured from the same context share their intermediate arrays
+    context = FeatureContext(
+        boards, rows, PLACEMENT_HEIGHTS[placement_ids], rows_cleared, eroded_blocks
+    )
+    board_features.update(measure_features(context, measured))
+    for name, values in board_features.items():
+        features[FEATURES[name].field] = values
+
+    if return_boards:
+        return features, boards
+    return features
+
+
+def evaluate_shapes(grids, bases, shapes, cache=None, feature_names=(), evaluator=None):
+    """
+    For each pair of base board index and shape, evaluate every distinct placement of the shape on the base board.
+    Return the FEATURE_DTYPE array, the resulting boards and the costs of all placements, ordered by pair then in the
+    order of get_candidates. If an EvaluationCache is given, pairs that have already been evaluated are looked up
+    rather than evaluated again. feature_names are passed on to evaluate_placements. If a
+    shared_evaluator.SharedEvaluator is given, the placements are evaluated by its worker processes, and the costs are
+    those its workers wrote back, or its own for cached pairs. Otherwise the costs are None.
+    """
+    grids = np.asarray(grids, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH)
+    results = [None] * len(bases)
+    keys = None
+    if cache is not None:
+        # Results depend on the features measured, so they are part of the key
+        key_suffix = "|".join(get_extra_features(feature_names)).encode()
+        keys = [
+            cache.get_key(grids[base], shape) + key_suffix
+            for base, shape in zip(bases, shapes)
+        ]
+        for pair, key in enumerate(keys):
+            cached = cache.get(key)
+            if cached is not None:
+                # Cached pairs have no costs, since the cache may be shared by solvers with other weights
+                results[pair] = cached + (None,)
+    misses = [pair for pair, result in enumerate(results) if result is None]
+
+    # Evaluate all of the pairs that weren't cached in a single batch
+    if misses:
+        candidates = [get_candidates(shapes[pair]) for pair in misses]
+        sizes = [len(cols) for _, cols in candidates]
+        miss_bases = np.repeat([bases[pair] for pair in misses], sizes)
+        miss_placement_ids = np.concatenate(
+            [placement_ids for placement_ids, _ in candidates]
+        )
+        miss_cols = np.concatenate([cols for _, cols in candidates])
+        costs = None
+        if evaluator is not None:
+            features, boards, costs = evaluator.evaluate_placements(
+                grids, miss_bases, miss_placement_ids, miss_cols, feature_names
+            )
+        else:
+            features, boards = evaluate_placements(
+                grids,
+                miss_bases,
+                miss_placement_ids,
+                miss_cols,
+                return_boards=True,
+                feature_names=feature_names,
+            )
+        stops = np.cumsum(sizes)
+        for pair, start, stop in zip(misses, stops - sizes, stops):
+            results[pair] = (
+                features[start:stop],
+                boards[start:stop],
+                costs[start:stop] if costs is not None else None,
+            )
+            if cache is not None:
+                # Copy the slices so that the cache doesn't keep the whole batch alive
+                value = (features[start:stop].copy(), boards[start:stop].copy())
+                cache.put(keys[pair], value, value[0].nbytes + value[1].nbytes)
+
+    features = np.concatenate([result[0] for result in results])
+    boards = np.concatenate([result[1] for result in results])
+    features["base"] = np.repeat(bases, [len(result[0]) for result in results])
+    costs = None
+    if evaluator is not None:
+        costs = np.concatenate(
+            [
+                (
+                    result[2]
+                    if result[2] is not None
+                    else evaluator.get_outcome_costs(result[0])
+                )
+                for result in results
+            ]
+        )
+    return features, boards, costs
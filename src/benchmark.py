@@ -0,0 +1,280 @@
+#!usr/bin/env python3
+# Benchmark the playfield and solver hot paths over a corpus of fixed boards, and compare against a stored baseline
+
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import runner
+from .game import PLAYFIELD_CLASSES, Game
+from .playfield import Playfield
+from .solver import Solver
+from .tetromino import Tetromino
+
+# Tetrominoes used by the benchmarks that need one
+BENCH_TETROMINO = "T"
+BENCH_HELD_TETROMINO = "I"
+
+# Relative drop in ops/sec, compared to the baseline, that is reported as a regression
+DEFAULT_TOLERANCE = 0.1
+
+# Seed of the first game played by measure_book, far from the seeds that batch runs start from, so that the book is
+# measured on games it wasn't built from
+BOOK_SEED_START = 1000000
+
+
+def _make_board_(heights, fill_probability, seed, full_rows=0):
+    """
+    Return a board with columns filled up to the given heights. Blocks below the top of each column are filled with
+    the given probability, and every row is left with at least one empty block so that no rows are full, except for
+    the bottom full_rows rows, which are completely filled. Every height must be at least full_rows.
+    """
+    rng = np.random.default_rng(seed)
+    board = np.zeros((Playfield.MAIN_BOX_HEIGHT, Playfield.MAIN_BOX_WIDTH), np.uint8)
+    for col, height in enumerate(heights):
+        top = Playfield.MAIN_BOX_HEIGHT - height
+        if height:
+            board[top, col] = rng.integers(1, 8)
+            filled = rng.random(height - 1) < fill_probability
+            board[top + 1 :, col] = filled * rng.integers(1, 8, height - 1)
+    for row in np.nonzero((board != 0).all(axis=1))[0]:
+        board[row, rng.integers(Playfield.MAIN_BOX_WIDTH)] = 0
+    if full_rows:
+        board[-full_rows:] = rng.integers(1, 8, (full_rows, Playfield.MAIN_BOX_WIDTH))
+    return board
+
+
+def get_board_corpus():
+    """
+    Return a dictionary of the fixed boards that every benchmark is run on.
+    """
+    return {
+        "empty": _make_board_([0] * 10, 1.0, 0),
+        "mid_game": _make_board_([6, 7, 5, 6, 8, 7, 6, 5, 7, 2], 0.9, 1),
+        "near_top": _make_board_([18, 19, 17, 20, 18, 19, 18, 17, 19, 12], 0.9, 2),
+        "holed": _make_board_([10, 9, 11, 10, 8, 10, 11, 9, 10, 10], 0.6, 3),
+        # Boards with rows to clear, so that clearing is measured on more than the nothing to clear path
+        "one_full_row": _make_board_([6, 7, 5, 6, 8, 7, 6, 5, 7, 2], 0.9, 4, 1),
+        "four_full_rows": _make_board_([9, 10, 8, 9, 11, 10, 9, 8, 10, 5], 0.9, 5, 4),
+    }
+
+
+def _make_game_(board, playfield_class):
+    """Return a game with the board as its playfield and fixed tetrominoes"""
+    game = Game(playfield_class, seed=0)
+    game.playfield = playfield_class(board)
+    game.current_tetromino = Tetromino(BENCH_TETROMINO)
+    game.holder.held_tetromino = Tetromino(BENCH_HELD_TETROMINO)
+    return game
+
+
+def get_benchmarks(board, playfield_class):
+    """
+    Return a dictionary of functions that each run a single call of a hot path on the board. A benchmark that
+    changes its input is instead a (setup, function) pair, where setup returns a fresh input for each call and only
+    the call of the function with it is timed.
+    """
+    playfield = playfield_class(board)
+    tetromino = Tetromino(BENCH_TETROMINO)
+    held_tetromino = Tetromino(BENCH_HELD_TETROMINO)
+    solver = Solver()
+    reachability_solver = Solver(reachability=True)
+    game = _make_game_(board, playfield_class)
+
+    def decide_outcome():
+        solver.ban_hold = False
+        solver.decide_outcome(game)
+
+    def decide_outcome_reachable():
+        reachability_solver.ban_hold = False
+        reachability_solver.decide_outcome(game)
+
+    return {
+        "Playfield.copy": playfield.copy,
+        "Playfield.drop_tetromino": lambda: playfield.copy().drop_tetromino(
+            tetromino, 3
+        ),
+        "Playfield._clear_filled_rows_": (
+            playfield.copy,
+            lambda copy: copy._clear_filled_rows_(),
+        ),
+        "Playfield.get_heights": playfield.get_heights,
+        "Playfield.get_gap_count": playfield.get_gap_count,
+        "Playfield.get_gap_depth": playfield.get_gap_depth,
+        "Playfield.get_well_count": playfield.get_well_count,
+        "Solver.get_reference_outcomes": lambda: solver.get_reference_outcomes(
+            playfield, tetromino, held_tetromino
+        ),
+        "Solver.evaluate_outcomes": lambda: solver.evaluate_outcomes(
+            playfield, tetromino, held_tetromino
+        ),
+        "Solver.evaluate_pruned_outcomes": lambda: solver.evaluate_pruned_outcomes(
+            playfield, tetromino, held_tetromino
+        ),
+        "Solver.decide_outcome": decide_outcome,
+        "Solver.decide_outcome (reachability)": decide_outcome_reachable,
+    }
+
+
+def _time_calls_(function, setup, num_calls):
+    """Return the time taken by num_calls calls of the function, leaving out the time taken by any setup"""
+    if setup is None:
+        start = time.perf_counter()
+        for _ in range(num_calls):
+            function()
+        return time.perf_counter() - start
+    total = 0.0
+    for _ in range(num_calls):
+        state = setup()
+        start = time.perf_counter()
+        function(state)
+        total += time.perf_counter() - start
+    return total
+
+
+def measure(function, min_time=0.2, num_samples=20, setup=None):
+    """
+    Time the function and return a dictionary of ops/sec, per-call latency percentiles and the peak memory allocated
+    by a single call. If setup is given, the function is called with a fresh result of setup every call, and the
+    setup is neither timed nor counted in the peak memory.
+    """
+    # Calibrate the number of calls per sample so that all samples take roughly min_time
+    single_call = max(_time_calls_(function, setup, 1), 1e-7)
+    num_calls = max(1, int(min_time / num_samples / single_call))
+
+    samples = []
+    for _ in range(num_samples):
+        samples.append(_time_calls_(function, setup, num_calls) / num_calls)
+    samples = np.array(samples)
+
+    args = (setup(),) if setup is not None else ()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+    function(*args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {
+        "ops_per_sec": 1 / p50,
+        "latency_min_us": samples.min() * 1e6,
+        "latency_p50_us": p50 * 1e6,
+        "latency_p90_us": p90 * 1e6,
+        "latency_p99_us": p99 * 1e6,
+        "alloc_peak_bytes": peak_memory - baseline_memory,
+    }
+
+
+def run_benchmarks(name_filter=None, min_time=0.2):
+    """
+    Run every benchmark on every board of the corpus, for every playfield class. Return a dictionary of results
+    keyed by "benchmark[playfield class:board]".
+    """
+    results = {}
+    for board_name, board in get_board_corpus().items():
+        for class_name, playfield_class in PLAYFIELD_CLASSES.items():
+            for bench_name, function in get_benchmarks(board, playfield_class).items():
+                name = "{}[{}:{}]".format(bench_name, class_name, board_name)
+                if name_filter is not None and name_filter not in name:
+                    continue
+                if isinstance(function, tuple):
+                    setup, function = function
+                    results[name] = measure(function, min_time, setup=setup)
+                else:
+                    results[name] = measure(function, min_time)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return a dictionary of the ratio of ops/sec against the baseline for every benchmark in both, and a list of the
+    benchmarks whose ops/sec have dropped by more than the tolerance.
+    """
+    ratios = {}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratios[name] = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        if ratios[name] < 1 - tolerance:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def format_results(results, ratios=None):
+    """
+    Return the results as a table, with the ratio against the baseline if given.
+    """
+    width = max([len(name) for name in results] + [9])
+    lines = [
+        "{}  {:>12}  {:>10}  {:>10}  {:>10}  {:>10}  {:>8}".format(
+            "benchmark".ljust(width),
+            "ops/sec",
+            "p50 us",
+            "p90 us",
+            "p99 us",
+            "peak B",
+            "vs base",
+        )
+    ]
+    for name, result in results.items():
+        ratio = ""
+        if ratios is not None and name in ratios:
+            ratio = "{:.2f}x".format(ratios[name])
+        lines.append(
+            "{}  {:>12.1f}  {:>10.1f}  {:>10.1f}  {:>10.1f}  {:>10d}  {:>8}".format(
+                name.ljust(width),
+                result["ops_per_sec"],
+                result["latency_p50_us"],
+                result["latency_p90_us"],
+                result["latency_p99_us"],
+                result["alloc_peak_bytes"],
+                ratio,
+            )
+        )
+    return "\n".join(lines)
+
+
+def measure_book(
+    book_path, num_games=4, max_pieces=200, seed_start=BOOK_SEED_START, **solver_options
+):
+    """
+    Play the same seeded games with and without the opening book, with solvers configured by solver_options, and
+    return a dictionary of the book's hit rate, the pieces/sec with and without it and the speedup.
+    """
+    seeds = range(seed_start, seed_start + num_games)
+    pieces_per_sec = {}
+    for name, path in [("search", None), ("book", book_path)]:
+        start = time.perf_counter()
+        results = [
+            runner.play_game(seed, max_pieces, book_path=path, **solver_options)
+            for seed in seeds
+        ]
+        elapsed = time.perf_counter() - start
+        pieces = sum(result["pieces"] for result in results)
+        pieces_per_sec[name] = pieces / elapsed
+    summary = runner.summarise(results, elapsed)
+    return {
+        "book_hits": summary["book_hits"],
+        "book_hit_rate": summary["book_hit_rate"],
+        "pieces_per_sec": pieces_per_sec["search"],
+        "book_pieces_per_sec": pieces_per_sec["book"],
+        "speedup": pieces_per_sec["book"] / pieces_per_sec["search"],
+    }
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(results, path):
+    with open(path, "w") as baseline_file:
+        json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    print(format_results(run_benchmarks("get_gap_count", min_time=0.05)))
@@ -0,0 +1,277 @@
+#!usr/bin/env python3
+# Model tetris playfield as a list of integer row bitmasks
+
+import numpy as np
+
+from .playfield import Playfield
+from .tetromino import CELL_BITS, Tetromino
+
+CELL_MASK = (1 << CELL_BITS) - 1
+
+
+class BitboardPlayfield(Playfield):
+    """
+    Drop-in alternative to Playfield that stores each row as an integer bitmask, so that dropping, locking and line
+    clearing become bitwise operations. A second list of integers holds the colour of each cell so that the playfield
+    can still be displayed.
+    """
+
+    FULL_ROW = (1 << Playfield.MAIN_BOX_WIDTH) - 1
+
+    # Shift of each column's colour bits within a colour row
+    COLOUR_SHIFTS = np.arange(Playfield.MAIN_BOX_WIDTH, dtype=np.uint64) * CELL_BITS
+
+    def __init__(self, grid=None):
+        self.rows = [0] * self.MAIN_BOX_HEIGHT
+        self.colours = [0] * self.MAIN_BOX_HEIGHT
+        self._grid_ = None
+        super().__init__(grid)
+
+    def __str__(self):
+        print_str = []
+        for colour_row in self.colours:
+            print_str.append(
+                "".join(
+                    str((colour_row >> (CELL_BITS * col)) & CELL_MASK)
+                    for col in range(self.MAIN_BOX_WIDTH)
+                )
+            )
+        return "\n".join(print_str)
+
+    @property
+    def grid(self):
+        """
+        Return the playfield as a read-only numpy array. The array is decoded from the colour rows the first time it
+        is read after the playfield changes, and shared until the next change, so the playfield can only be modified
+        through its methods or by assigning a whole grid.
+        """
+        if self._grid_ is None:
+            colours = np.array(self.colours, dtype=np.uint64)
+            grid = ((colours[:, None] >> self.COLOUR_SHIFTS) & CELL_MASK).astype(
+                np.uint8
+            )
+            grid.setflags(write=False)
+            self._grid_ = grid
+        return self._grid_
+
+    @grid.setter
+    def grid(self, grid):
+        self._grid_ = None
+        for row in range(self.MAIN_BOX_HEIGHT):
+            occupancy = 0
+            colours = 0
+            for col in range(self.MAIN_BOX_WIDTH):
+                value = int(grid[row, col])
+                if value != 0:
+                    occupancy |= 1 << col
+                    colours |= value << (CELL_BITS * col)
+            self.rows[row] = occupancy
+            self.colours[row] = colours
+
+    def _init_column_stats_(self):
+        """
+        The column statistics are calculated from the row masks whenever they are read, so there are none to set up
+        """
+
+    def update_column_stats(self, start_col=0, end_col=Playfield.MAIN_BOX_WIDTH):
+        """
+        The column statistics are calculated from the row masks whenever they are read, so there are none to update
+        """
+
+    @property
+    def column_tops(self):
+        """Return array containing the row of the top filled block in each column, see Playfield"""
+        return np.array(self._get_column_tops_(), dtype=np.int64)
+
+    @property
+    def column_gaps(self):
+        """Return array containing the number of empty blocks below the top filled block in each column"""
+        return np.array(self._get_column_gaps_(), dtype=np.int64)
+
+    @property
+    def lowest_gaps(self):
+        """
+        Return array containing one more than the row of the lowest empty block in each column, or MAIN_BOX_HEIGHT
+        for full columns
+        """
+        return np.array(self._get_lowest_gaps_(), dtype=np.int64)
+
+    def _get_stack_top_(self):
+        """Return the row number of the highest filled row"""
+        for row, occupancy in enumerate(self.rows):
+            if occupancy:
+                return row
+        return self.MAIN_BOX_HEIGHT
+
+    def _collides_(self, masks, row, col):
+        """
+        Return true if the tetromino row masks overlap the stack or the floor when the top of the tetromino is placed
+        at the specified row and column. Rows above the top of the playfield are treated as empty.
+        """
+        if row + len(masks) > self.MAIN_BOX_HEIGHT:
+            return True
+        for tetr_row, (occupancy, _) in enumerate(masks):
+            grid_row = row + tetr_row
+            if grid_row >= 0 and self.rows[grid_row] & (occupancy << col):
+                return True
+        return False
+
+    def _get_drop_row_(self, tetromino, start_col):
+        """
+        Return the row of the top block of the tetromino if the tetromino
+        is dropped with its left side aligned with the specified column.
+        """
+        end_col = start_col + tetromino.width()
+        if start_col < 0 or end_col > self.MAIN_BOX_WIDTH:
+            raise ValueError("drop puts tetromino out of bounds}")
+        masks = tetromino.placement.masks
+        # Start with the tetromino just above the stack, where it can't collide with anything, and move it down
+        # until it lands
+        drop_row = self._get_stack_top_() - len(masks)
+        while not self._collides_(masks, drop_row + 1, start_col):
+            drop_row += 1
+        return drop_row
+
+    def _lock_tetromino_(self, tetromino, position):
+        """
+        Lock the tetromino in the field at specified position. As with Playfield, blocks that would be locked above
+        the top of the playfield wrap around to the bottom rows, and the new tetromino will overwrite any existing
+        filled blocks.
+        """
+        self._grid_ = None
+        row, col = position
+        colour_shift = CELL_BITS * col
+        for tetr_row, (occupancy, colours) in enumerate(tetromino.placement.masks):
+            grid_row = (row + tetr_row) % self.MAIN_BOX_HEIGHT
+            # Clear the colour bits of the cells being written before setting them
+            colour_mask = 0
+            for tetr_col in range(tetromino.width()):
+                if occupancy & (1 << tetr_col):
+                    colour_mask |= CELL_MASK << (CELL_BITS * tetr_col)
+            self.rows[grid_row] |= occupancy << col
+            self.colours[grid_row] = (
+                self.colours[grid_row] & ~(colour_mask << colour_shift)
+            ) | (colours << colour_shift)
+
+    def _clear_filled_rows_(self):
+        """
+        Check for and remove filled rows. Return the number of rows cleared
+        """
+        self._grid_ = None
+        num_cleared_rows = self.rows.count(self.FULL_ROW)
+        # Keep rows that are partially filled, in the same way as Playfield
+        kept = [
+            row
+            for row, occupancy in enumerate(self.rows)
+            if 0 < occupancy < self.FULL_ROW
+        ]
+        num_empty_rows = self.MAIN_BOX_HEIGHT - len(kept)
+        self.rows = [0] * num_empty_rows + [self.rows[row] for row in kept]
+        self.colours = [0] * num_empty_rows + [self.colours[row] for row in kept]
+        return num_cleared_rows
+
+    def _get_column_tops_(self):
+        """Return list containing the row of the top filled block in each column"""
+        tops = [self.MAIN_BOX_HEIGHT] * self.MAIN_BOX_WIDTH
+        seen = 0
+        for row, occupancy in enumerate(self.rows):
+            new = occupancy & ~seen
+            if new:
+                seen |= new
+                for col in range(self.MAIN_BOX_WIDTH):
+                    if new & (1 << col):
+                        tops[col] = row
+                if seen == self.FULL_ROW:
+                    break
+        return tops
+
+    def get_heights(self):
+        """Return array containing heights of each column"""
+        return self.MAIN_BOX_HEIGHT - np.array(self._get_column_tops_())
+
+    def get_gap_count(self):
+        """Return number of gaps in stack"""
+        # Every empty cell underneath a filled cell in the same column is a gap
+        covered = 0
+        gap_count = 0
+        for occupancy in self.rows:
+            covered |= occupancy
+            gap_count += (covered & ~occupancy).bit_count()
+        return gap_count
+
+    def _get_column_gaps_(self):
+        """Return list containing the number of empty blocks below the top filled block in each column"""
+        gaps = [0] * self.MAIN_BOX_WIDTH
+        covered = 0
+        for occupancy in self.rows:
+            covered |= occupancy
+            row_gaps = covered & ~occupancy
+            while row_gaps:
+                lowest_bit = row_gaps & -row_gaps
+                gaps[lowest_bit.bit_length() - 1] += 1
+                row_gaps ^= lowest_bit
+        return gaps
+
+    def _get_lowest_gaps_(self):
+        """
+        Return list containing one more than the row of the lowest empty block in each column. As with Playfield,
+        columns with no empty blocks are treated as having a gap at the bottom.
+        """
+        lowest_gaps = [self.MAIN_BOX_HEIGHT] * self.MAIN_BOX_WIDTH
+        seen = 0
+        for row in range(self.MAIN_BOX_HEIGHT - 1, -1, -1):
+            new = ~self.rows[row] & self.FULL_ROW & ~seen
+            if new:
+                seen |= new
+                for col in range(self.MAIN_BOX_WIDTH):
+                    if new & (1 << col):
+                        lowest_gaps[col] = row + 1
+                if seen == self.FULL_ROW:
+                    break
+        return lowest_gaps
+
+    def get_gap_depth(self):
+        """Return sum of gap depth in stack"""
+        return sum(
+            lowest_gap - top + 1
+            for lowest_gap, top in zip(
+                self._get_lowest_gaps_(), self._get_column_tops_()
+            )
+        )
+
+    def get_well_count(self):
+        """
+        Return number of "wells" in stack that are > 2 deep, i.e. can only
+        be cleared by I shape.
+        """
+        # Append walls on either side represented with height 0
+        tops_walled = [0] + self._get_column_tops_() + [0]
+        return sum(
+            tops_walled[col] - tops_walled[col - 1] > 2
+            and tops_walled[col] - tops_walled[col + 1] > 2
+            for col in range(1, self.MAIN_BOX_WIDTH + 1)
+        )
+
+    def copy(self):
+        playfield = BitboardPlayfield.__new__(BitboardPlayfield)
+        playfield.rows = list(self.rows)
+        playfield.colours = list(self.colours)
+        # The decoded grid is read-only, so the copy can share it until either playfield changes
+        playfield._grid_ = self._grid_
+        playfield.num_rows_cleared = 0
+        playfield.num_blocks_placed = 0
+        return playfield
+
+    def is_game_over(self):
+        """
+        Return true if the game is over.
+        """
+        return self.rows[0] != 0
+
+
+if __name__ == "__main__":
+    playfield = BitboardPlayfield()
+    playfield.drop_tetromino(Tetromino("T"), 0)
+    playfield.drop_tetromino(Tetromino("I", 1), 9)
+    print(playfield)
+    print(playfield.get_heights(), playfield.get_gap_count())
@@ -1,8 +1,13 @@
 #!usr/bin/env python3
 # Manage CLI display/printing. A lot of the printing involves ASCII box shapes.
 
+import sys
+import time
+
 from .holder import Holder
+from .instrumentation import PROFILER
 from .playfield import Playfield
+from .tetromino import Tetromino
 from .tetromino_queue import TetrominoQueue
 
 BOX_CHAR = {
@@ -93,6 +98,7 @@ def update_display(game):
     """
     Claer the console and print a graphical representation of the playfield.
     """
+    start = PROFILER.start()
     clear_console_display()
     # Print the progress metrics
     print(
@@ -118,6 +124,182 @@ def update_display(game):
 
     # Rejoin and print the display string list.
     print("\n".join(display_str_list))
+    PROFILER.stop("display.update_display", start)
+
+
+class TerminalRenderer:
+    """
+    Draw the same display as update_display, but only redraw the cells that have changed since the previous frame,
+    using cursor positioning escape codes. The box borders and titles are built once, and frames can be skipped to
+    cap the frame rate so that the game can run faster than the display refreshes.
+    """
+
+    HEADER_FORMAT = "num blocks placed = {}, num rows cleared = {}"
+    # The header is padded to this width so that shorter headers overwrite longer ones
+    HEADER_WIDTH = 60
+
+    def __init__(self, max_fps=None, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.min_frame_interval = 1 / max_fps if max_fps else 0
+        self.last_draw_time = None
+        self.previous_frame = None
+        self._build_template_()
+
+    def _build_template_(self):
+        """
+        Build the static parts of the frame, i.e. the box borders and titles, as a list of lines of cells, and find
+        the position of every cell that changes between frames.
+        """
+        grid_line = "0" * Playfield.MAIN_BOX_WIDTH
+        playfield_lines = get_str_in_box(
+            "\n".join([grid_line] * Playfield.MAIN_BOX_HEIGHT)
+        ).split("\n")
+        # Layout of the holder and queue boxes, as in Holder.__str__ and TetrominoQueue.__str__
+        blank_line = " " * Tetromino.SHAPE_MAX_WIDTH
+        tetromino_lines = ["0" * Tetromino.SHAPE_MAX_WIDTH] * Tetromino.SHAPE_MAX_HEIGHT
+        holder_lines = get_str_in_box(
+            "\n".join(["HOLD", blank_line] + tetromino_lines)
+        ).split("\n")
+        queue_lines = get_str_in_box(
+            "\n".join(
+                ["NEXT"] + ([blank_line] + tetromino_lines) * TetrominoQueue.LENGTH
+            )
+        ).split("\n")
+
+        # Place the holder and queue boxes beside the playfield box, below the header line
+        lines = [" " * self.HEADER_WIDTH] + playfield_lines
+        side_col = len(playfield_lines[0]) + 2
+        for row, line in enumerate(holder_lines + queue_lines):
+            lines[1 + row] += "  " + line
+        self.template = [list(line) for line in lines]
+
+        def get_cell_positions(box_row, box_col, first_line, height, width):
+            # Grid values are double spaced inside the box walls
+            return [
+                [
+                    (box_row + 1 + first_line + row, box_col + 2 + 2 * col)
+                    for col in range(width)
+                ]
+                for row in range(height)
+            ]
+
+        self.playfield_positions = get_cell_positions(
+            1, 0, 0, Playfield.MAIN_BOX_HEIGHT, Playfield.MAIN_BOX_WIDTH
+        )
+        self.holder_positions = get_cell_positions(
+            1, side_col, 2, Tetromino.SHAPE_MAX_HEIGHT, Tetromino.SHAPE_MAX_WIDTH
+        )
+        queue_row = 1 + len(holder_lines)
+        self.queue_positions = [
+            get_cell_positions(
+                queue_row,
+                side_col,
+                2 + index * (Tetromino.SHAPE_MAX_HEIGHT + 1),
+                Tetromino.SHAPE_MAX_HEIGHT,
+                Tetromino.SHAPE_MAX_WIDTH,
+            )
+            for index in range(TetrominoQueue.LENGTH)
+        ]
+
+    def _fill_grid_(self, frame, positions, grid):
+        """Write the coloured cells of the grid into the frame at the positions"""
+        for position_row, grid_row in zip(positions, grid.tolist()):
+            for (row, col), value in zip(position_row, grid_row):
+                frame[row][col] = SHAPE_PRINT[value]
+
+    def build_frame(
+        self, grid, held_grid, queue_grids, num_blocks_placed, num_rows_cleared
+    ):
+        """
+        Return the frame as a list of lines of cells, where each cell is a single character that may be wrapped in
+        colour escape codes. held_grid and queue_grids are zero padded tetromino grids, and held_grid may be None.
+        """
+        frame = [line[:] for line in self.template]
+        header = self.HEADER_FORMAT.format(num_blocks_placed, num_rows_cleared)
+        frame[0][: len(header)] = header[: self.HEADER_WIDTH]
+        self._fill_grid_(frame, self.playfield_positions, grid)
+        if held_grid is not None:
+            self._fill_grid_(frame, self.holder_positions, held_grid)
+        for positions, queue_grid in zip(self.queue_positions, queue_grids):
+            self._fill_grid_(frame, positions, queue_grid)
+        return frame
+
+    def get_frame_update(self, frame):
+        """
+        Return the string that updates the terminal from the previous frame to the frame. The whole frame is drawn
+        if there is no previous frame.
+        """
+        if self.previous_frame is None:
+            # Clear the screen and move the cursor to the top left before drawing everything
+            return "\033[2J\033[H" + "\n".join("".join(line) for line in frame)
+        update = []
+        for row, (line, previous_line) in enumerate(zip(frame, self.previous_frame)):
+            col = 0
+            while col < len(line):
+                if line[col] == previous_line[col]:
+                    col += 1
+                    continue
+                # Move the cursor to the first changed cell and redraw the run of changed cells
+                start_col = col
+                while col < len(line) and line[col] != previous_line[col]:
+                    col += 1
+                update.append("\033[{};{}H".format(row + 1, start_col + 1))
+                update.append("".join(line[start_col:col]))
+        return "".join(update)
+
+    def draw_frame(
+        self,
+        grid,
+        held_grid,
+        queue_grids,
+        num_blocks_placed,
+        num_rows_cleared,
+        force=False,
+    ):
+        """
+        Draw the frame described by the arguments, see build_frame. Unless force is true, the frame is skipped if
+        it is too soon after the previous frame. Return true if the frame was drawn.
+        """
+        now = time.perf_counter()
+        if (
+            not force
+            and self.last_draw_time is not None
+            and now - self.last_draw_time < self.min_frame_interval
+        ):
+            return False
+        start = PROFILER.start()
+        frame = self.build_frame(
+            grid, held_grid, queue_grids, num_blocks_placed, num_rows_cleared
+        )
+        update = self.get_frame_update(frame)
+        # Leave the cursor below the frame
+        self.stream.write(update + "\033[{};1H".format(len(frame) + 1))
+        self.stream.flush()
+        self.previous_frame = frame
+        self.last_draw_time = now
+        PROFILER.stop("display.draw_frame", start, update_length=len(update))
+        return True
+
+    def draw(self, game, force=False):
+        """
+        Draw the game, see draw_frame. Return true if the frame was drawn.
+        """
+        held_tetromino = game.holder.held_tetromino
+        return self.draw_frame(
+            game.playfield.grid,
+            (
+                held_tetromino.get_zero_padded_grid()
+                if held_tetromino is not None
+                else None
+            ),
+            [
+                tetromino.get_zero_padded_grid()
+                for tetromino in game.tetromino_queue.queue
+            ],
+            game.playfield.num_blocks_placed,
+            game.playfield.num_rows_cleared,
+            force,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+#!usr/bin/env python3
+# Bounded least recently used cache of placement evaluations, keyed by board and shape
+
+from collections import OrderedDict
+
+
+class EvaluationCache:
+    """
+    Map a board and a shape to the evaluation of every placement of that shape on that board, so that boards that
+    are reached more than once, e.g. through hold swaps or across consecutive turns, are only evaluated once. The
+    least recently used entries are evicted once the cache exceeds its memory cap or entry cap.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=None):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def get_key(board, shape):
+        """
+        Return the key for a board, as a numpy array, and a shape.
+        """
+        return board.tobytes() + shape.encode()
+
+    def get(self, key):
+        """
+        Return the value stored for the key, or None if there isn't one.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size):
+        """
+        Store the value for the key. size is the approximate memory used by the value in bytes.
+        """
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key)[1]
+        size += len(key)
+        self.entries[key] = (value, size)
+        self.num_bytes += size
+        # Evict the least recently used entries until the cache is within its caps again
+        while self.num_bytes > self.max_bytes or (
+            self.max_entries is not None and len(self.entries) > self.max_entries
+        ):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.num_bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries, keeping the counters"""
+        self.entries.clear()
+        self.num_bytes = 0
+
+    def stats(self):
+        """Return a dictionary of the cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.num_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,224 @@
+#!usr/bin/env python3
+# Registry of board features, each measured for a whole batch of evaluated placements at once
+
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+from .playfield import Playfield
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# A registered feature. field is the name of the feature's field in batch_evaluator.FEATURE_DTYPE, and function
+# takes a FeatureContext and returns the value of the feature for every placement in the batch. Functions only read
+# the boards through the statistics of the context, e.g. column_tops, and never through boards or filled, so that
+# every feature can also be measured from a FeatureContext.from_stats.
+Feature = namedtuple("Feature", ["name", "field", "dtype", "function"])
+
+# Feature name -> Feature, in the order the features were registered
+FEATURES = {}
+
+# The features used by Solver.WEIGHTS. These are always measured, since they are part of every Outcome.
+BASE_FEATURES = ("wells", "gaps", "gap depth", "row")
+
+
+def register_feature(name, dtype=np.int16):
+    """
+    Decorator that registers a function as the feature with the given name. The feature's values are stored in a
+    batch_evaluator.FEATURE_DTYPE field with the given dtype, named after the feature with spaces replaced by
+    underscores. Features must be registered in this module, before FEATURE_DTYPE is built.
+    """
+
+    def register(function):
+        FEATURES[name] = Feature(name, name.replace(" ", "_"), dtype, function)
+        return function
+
+    return register
+
+
+class FeatureContext:
+    """
+    The boards resulting from a batch of placements, along with the details of each placement. Intermediate arrays
+    that are shared between features, e.g. the column tops, are computed the first time they are needed and then
+    reused by every other feature of the batch.
+    """
+
+    def __init__(self, boards, rows, heights, rows_cleared, eroded_blocks=None):
+        """
+        boards is the array of resulting boards after filled rows have been cleared, so that there are no empty rows
+        below a filled row. rows, heights and rows_cleared
+        are arrays of the drop row, the height and the number of rows cleared by each placed tetromino, and
+        eroded_blocks is the number of blocks of each tetromino that were cleared.
+        """
+        self.boards = boards
+        self.rows = rows
+        self.heights = heights
+        self.rows_cleared = rows_cleared
+        self.eroded_blocks = eroded_blocks
+
+    @classmethod
+    def from_stats(
+        cls,
+        column_tops,
+        column_gaps,
+        lowest_gaps,
+        column_transitions,
+        row_transitions,
+        rows,
+        heights,
+    ):
+        """
+        Return a context of placements that cleared no rows, described by the statistics of their resulting boards
+        rather than the boards themselves, e.g. from batch_evaluator.measure_features_from_stats.
+        """
+        no_rows = np.zeros(len(rows), np.int64)
+        context = cls(None, rows, heights, no_rows, no_rows)
+        context.column_tops = column_tops
+        context.column_gaps = column_gaps
+        context.lowest_gaps = lowest_gaps
+        context.column_transitions = column_transitions
+        context.row_transitions = row_transitions
+        return context
+
+    @functools.cached_property
+    def filled(self):
+        if self.boards is None:
+            raise ValueError("the context only has the statistics of the boards")
+        return self.boards != 0
+
+    @functools.cached_property
+    def column_tops(self):
+        """Row of the top filled block of each column, or HEIGHT for empty columns"""
+        filled = self.filled
+        return np.where(filled.any(axis=1), filled.argmax(axis=1), HEIGHT)
+
+    @functools.cached_property
+    def column_heights(self):
+        return HEIGHT - self.column_tops
+
+    @functools.cached_property
+    def holes(self):
+        """Mask of the empty blocks below the top filled block of their column"""
+        below_top = np.arange(HEIGHT)[None, :, None] >= self.column_tops[:, None, :]
+        return below_top & ~self.filled
+
+    @functools.cached_property
+    def column_gaps(self):
+        """Number of empty blocks below the top filled block of each column"""
+        return np.count_nonzero(self.holes, axis=1)
+
+    @functools.cached_property
+    def lowest_gaps(self):
+        """One more than the row of the lowest empty block of each column, or HEIGHT for full columns"""
+        return HEIGHT - np.flip(~self.filled, axis=1).argmax(axis=1)
+
+    @functools.cached_property
+    def column_transitions(self):
+        """
+        Number of vertical changes between filled and empty blocks in each column, with the floor counted as filled
+        """
+        filled = self.filled
+        # Changes inside the columns, plus the empty blocks on the floor
+        return (
+            np.count_nonzero(filled[:, 1:] != filled[:, :-1], axis=1) + ~filled[:, -1]
+        )
+
+    @functools.cached_property
+    def row_transitions(self):
+        """
+        Number of horizontal changes between filled and empty blocks in each row, with the walls counted as filled,
+        so that an empty row has 2
+        """
+        filled = self.filled
+        return (
+            np.count_nonzero(filled[:, :, 1:] != filled[:, :, :-1], axis=2)
+            + ~filled[:, :, 0]
+            + ~filled[:, :, -1]
+        )
+
+
+def measure_features(context, names):
+    """
+    Return a dictionary of the values of the named features for every placement in the context.
+    """
+    return {name: FEATURES[name].function(context) for name in names}
+
+
+@register_feature("wells", np.uint8)
+def get_wells(context):
+    """
+    Number of columns where the columns on both sides are > 2 higher, i.e. that can only be cleared by an I shape.
+    The walls are represented with height 0.
+    """
+    tops = context.column_tops
+    # Each column's top minus the top of the column to its right
+    deeper = -np.diff(tops, axis=1)
+    inner_wells = np.count_nonzero((deeper[:, 1:] > 2) & (deeper[:, :-1] < -2), axis=1)
+    return (
+        inner_wells
+        + ((tops[:, 0] > 2) & (deeper[:, 0] > 2))
+        + ((tops[:, -1] > 2) & (deeper[:, -1] < -2))
+    )
+
+
+@register_feature("gaps", np.uint16)
+def get_gaps(context):
+    """Number of empty blocks below the top of their column"""
+    return context.column_gaps.sum(axis=1)
+
+
+@register_feature("gap depth", np.uint16)
+def get_gap_depth(context):
+    """Sum over the columns of the distance from the top of the column to its lowest empty block, as in Playfield"""
+    return (context.lowest_gaps - context.column_tops + 1).sum(axis=1)
+
+
+@register_feature("row")
+def get_row(context):
+    """Row of the top block of the placed tetromino"""
+    return context.rows
+
+
+@register_feature("bumpiness")
+def get_bumpiness(context):
+    """Sum of the absolute differences between the heights of neighbouring columns"""
+    return np.abs(np.diff(context.column_heights, axis=1)).sum(axis=1)
+
+
+@register_feature("aggregate height")
+def get_aggregate_height(context):
+    """Sum of the heights of the columns"""
+    return context.column_heights.sum(axis=1)
+
+
+@register_feature("row transitions")
+def get_row_transitions(context):
+    """
+    Number of horizontal changes between filled and empty blocks in the rows that contain a filled block, with the
+    walls counted as filled
+    """
+    # Every row counts, so remove the two wall changes counted for each empty row. Clearing rows leaves no empty rows
+    # below filled rows, so the empty rows are the rows above the highest column.
+    return context.row_transitions.sum(axis=1) - 2 * context.column_tops.min(axis=1)
+
+
+@register_feature("column transitions")
+def get_column_transitions(context):
+    """
+    Number of vertical changes between filled and empty blocks in the columns, with the floor counted as filled
+    """
+    return context.column_transitions.sum(axis=1)
+
+
+@register_feature("landing height")
+def get_landing_height(context):
+    """Height of the bottom of the placed tetromino above the floor, before rows are cleared"""
+    return HEIGHT - context.rows - context.heights
+
+
+@register_feature("eroded cells")
+def get_eroded_cells(context):
+    """Number of rows cleared multiplied by the number of blocks of the placed tetromino that were cleared"""
+    return context.rows_cleared * context.eroded_blocks
@@ -1,18 +1,27 @@
 #!/usr/bin/env python3
 # Top-level wrapper for the game elements, i.e. playfield, holder, etc.
 
-from src import tetromino
+from src.bitboard_playfield import BitboardPlayfield
 from src.holder import Holder
+from src.instrumentation import PROFILER
 from src.tetromino_queue import TetrominoQueue
 from src.playfield import Playfield
 
+# Playfield backends by name, e.g. for selecting one on the command line
+PLAYFIELD_CLASSES = {"numpy": Playfield, "bitboard": BitboardPlayfield}
+
 
 class Game:
 
-    def __init__(self):
-        # Initialise game objects
-        self.playfield = Playfield()
-        self.tetromino_queue = TetrominoQueue()
+    def __init__(
+        self, playfield_class=Playfield, seed=None, randomiser="uniform", recorder=None
+    ):
+        # Initialise game objects. The playfield backend can be swapped for any Playfield compatible class, e.g.
+        # BitboardPlayfield. The seed and randomiser determine the sequence of tetrominoes, see TetrominoQueue.
+        # If recorder is given, e.g. a replay.ReplayWriter, its record method is called with every chosen outcome.
+        self.recorder = recorder
+        self.playfield = playfield_class()
+        self.tetromino_queue = TetrominoQueue(seed=seed, randomiser=randomiser)
         self.holder = Holder()
         # Get first tetronimo and hold it, since it is always optimal to have a piece held
         self.holder.swap(self.tetromino_queue.get_next())
@@ -30,9 +39,13 @@ class Game:
         Progress the gamestate to the next turn, using the chosen outcome to determine the placement of the current
         teromino.
         """
+        start = PROFILER.start()
+        if self.recorder is not None:
+            self.recorder.record(self, chosen_outcome)
         # Execute the outcome chosen by the solver
         self.playfield.execute_outcome(
             chosen_outcome, self.current_tetromino, self.holder
         )
         # Get the next tetromino ready
         self.current_tetromino = self.tetromino_queue.get_next()
+        PROFILER.stop("game.next_turn", start, turn=self.playfield.num_blocks_placed)
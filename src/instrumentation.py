@@ -0,0 +1,105 @@
+#!usr/bin/env python3
+# Optional timing instrumentation for the game loop, emitted as JSON lines and aggregated into histograms
+
+import json
+import time
+
+
+class Profiler:
+    """
+    Record the wall time of named sections of code. Profiling is disabled by default and can be toggled at runtime.
+    While disabled, start returns None and stop returns immediately, so the cost of the instrumentation is a
+    single attribute check per section. Usage:
+
+        start = PROFILER.start()
+        ...
+        PROFILER.stop("section name", start, extra_field=value)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sink = None
+        # Section name -> [count, total time, max time, {bucket: count}]
+        self.histograms = {}
+
+    def enable(self, sink=None):
+        """
+        Start recording. If sink is given, it is a file-like object that each event is written to as a line of
+        JSON.
+        """
+        self.sink = sink
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording, keeping the histograms recorded so far"""
+        self.enabled = False
+        if self.sink is not None:
+            self.sink.flush()
+        self.sink = None
+
+    def reset(self):
+        """Clear the histograms"""
+        self.histograms = {}
+
+    def start(self):
+        """Return the start time of a section, or None if disabled"""
+        if not self.enabled:
+            return None
+        return time.perf_counter()
+
+    def stop(self, name, start, **fields):
+        """
+        Record the end of the section that started at start. Any extra fields are included in the JSON event.
+        """
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [0, 0.0, 0.0, {}]
+        histogram[0] += 1
+        histogram[1] += elapsed
+        histogram[2] = max(histogram[2], elapsed)
+        # Bucket by the power of two number of microseconds
+        bucket = int(elapsed * 1e6).bit_length()
+        histogram[3][bucket] = histogram[3].get(bucket, 0) + 1
+        if self.sink is not None:
+            event = {"event": name, "start": start, "time": elapsed}
+            event.update(fields)
+            self.sink.write(json.dumps(event) + "\n")
+
+    def summary(self):
+        """
+        Return a dictionary of count, mean and max time and the histogram of each section. The histogram maps the
+        upper bound of each bucket in microseconds to the number of sections in that bucket.
+        """
+        return {
+            name: {
+                "count": count,
+                "mean_us": total / count * 1e6,
+                "max_us": max_time * 1e6,
+                "histogram_us": {
+                    2**bucket: buckets[bucket] for bucket in sorted(buckets)
+                },
+            }
+            for name, (count, total, max_time, buckets) in self.histograms.items()
+        }
+
+    def format_summary(self):
+        """
+        Return the summary as a string, with one line per section and one line per histogram bucket.
+        """
+        lines = []
+        for name, section in self.summary().items():
+            lines.append(
+                "{}: count = {}, mean = {:.1f} us, max = {:.1f} us".format(
+                    name, section["count"], section["mean_us"], section["max_us"]
+                )
+            )
+            for upper_bound, count in section["histogram_us"].items():
+                lines.append("    < {:>9} us: {}".format(upper_bound, count))
+        return "\n".join(lines)
+
+
+# Profiler shared by the whole game loop
+PROFILER = Profiler()
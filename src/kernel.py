@@ -0,0 +1,325 @@
+#!usr/bin/env python3
+# Optional compiled kernel that places tetrominoes and measures the resulting boards, used when numba is installed
+
+import numpy as np
+
+from .playfield import Playfield
+from .tetromino import Tetromino
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# Backends used by batch_evaluator.evaluate_placements:
+#   auto  - numba if it is installed, otherwise numpy
+#   numpy - the vectorised numpy implementation
+#   numba - the compiled kernel, which raises ImportError if numba isn't installed
+#   check - run both the kernel and numpy on every batch and raise AssertionError if they differ. The kernel runs as
+#           plain Python if numba isn't installed, which is slow but still checks its logic.
+BACKENDS = ["auto", "numpy", "numba", "check"]
+
+_backend = "auto"
+# The kernel compiled by numba, once it has been loaded
+_compiled_kernel = None
+
+
+def set_backend(name):
+    """Set the backend used to evaluate placements, see BACKENDS"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(
+            "backend must be one of {}, not {}".format(", ".join(BACKENDS), name)
+        )
+    if name == "numba":
+        _load_kernel_(compiled=True)
+    _backend = name
+
+
+def get_backend():
+    """
+    Return the backend in use, i.e. "numpy", "numba" or "check". An "auto" backend is resolved the first time this
+    is called, so that numba is only imported when placements are first evaluated rather than at start up.
+    """
+    global _backend
+    if _backend == "auto":
+        try:
+            _load_kernel_(compiled=True)
+            _backend = "numba"
+        except ImportError:
+            _backend = "numpy"
+    return _backend
+
+
+def _load_kernel_(compiled):
+    """
+    Return the kernel compiled by numba, or the plain Python kernel if numba isn't installed and compiled is false.
+    numba compiles the kernel on its first call, and caches the compiled code on disk so that later processes don't
+    pay the cost again.
+    """
+    global _compiled_kernel
+    if _compiled_kernel is None:
+        try:
+            import numba
+        except ImportError:
+            if compiled:
+                raise
+            return _place_tetrominoes_
+        _compiled_kernel = numba.njit(cache=True, nogil=True)(_place_tetrominoes_)
+    return _compiled_kernel
+
+
+def _place_tetrominoes_(
+    grids,
+    bases,
+    placement_ids,
+    cols,
+    placement_heights,
+    placement_elevations,
+    placement_col_valid,
+    placement_block_rows,
+    placement_block_cols,
+    placement_block_values,
+    given_rows,
+    boards,
+    rows,
+    rows_cleared,
+    eroded_blocks,
+    gaps,
+    gap_depth,
+    wells,
+):
+    """
+    For every candidate, copy its base board into boards, drop and lock its tetromino, clear filled rows and measure
+    the resulting board, in the same way as Playfield. If given_rows isn't empty, each tetromino is locked at its
+    given row rather than dropped. The results are written to the output arrays. This is written as plain loops over
+    scalars so that numba can compile it.
+    """
+    height = boards.shape[1]
+    width = boards.shape[2]
+    row_counts = np.zeros(height, np.int64)
+    tops = np.zeros(width, np.int64)
+    for index in range(bases.shape[0]):
+        placement = placement_ids[index]
+        col = cols[index]
+        board = boards[index]
+        board[:, :] = grids[bases[index]]
+
+        if given_rows.shape[0] > 0:
+            row = given_rows[index]
+        else:
+            # The highest of the per-column drop rows is the drop row
+            row = height
+            for tetr_col in range(placement_elevations.shape[1]):
+                if not placement_col_valid[placement, tetr_col]:
+                    continue
+                top = height
+                for board_row in range(height):
+                    if board[board_row, col + tetr_col] != 0:
+                        top = board_row
+                        break
+                col_row = (
+                    top
+                    - placement_heights[placement]
+                    + placement_elevations[placement, tetr_col]
+                )
+                if col_row < row:
+                    row = col_row
+        rows[index] = row
+
+        # Lock the tetromino. As with Playfield, negative rows wrap around.
+        for block in range(placement_block_rows.shape[1]):
+            block_row = row + placement_block_rows[placement, block]
+            if block_row < 0:
+                block_row += height
+            board[block_row, col + placement_block_cols[placement, block]] = (
+                placement_block_values[placement, block]
+            )
+
+        for board_row in range(height):
+            count = 0
+            for board_col in range(width):
+                if board[board_row, board_col] != 0:
+                    count += 1
+            row_counts[board_row] = count
+        eroded = 0
+        for block in range(placement_block_rows.shape[1]):
+            block_row = row + placement_block_rows[placement, block]
+            if block_row < 0:
+                block_row += height
+            if row_counts[block_row] == width:
+                eroded += 1
+        eroded_blocks[index] = eroded
+
+        # Keep the partially filled rows, moving them to the bottom of the board in order
+        cleared = 0
+        write_row = height - 1
+        for board_row in range(height - 1, -1, -1):
+            if row_counts[board_row] == width:
+                cleared += 1
+            elif row_counts[board_row] > 0:
+                if write_row != board_row:
+                    board[write_row, :] = board[board_row, :]
+                write_row -= 1
+        for board_row in range(write_row + 1):
+            board[board_row, :] = 0
+        rows_cleared[index] = cleared
+
+        # Measure the board in the same way as the Playfield metric methods
+        num_gaps = 0
+        depth = 0
+        for board_col in range(width):
+            top = height
+            for board_row in range(height):
+                if board[board_row, board_col] != 0:
+                    top = board_row
+                    break
+            tops[board_col] = top
+            # One more than the row of the lowest empty block, or the height for full columns
+            lowest_gap = height
+            for board_row in range(height - 1, -1, -1):
+                if board[board_row, board_col] == 0:
+                    lowest_gap = board_row + 1
+                    break
+            depth += lowest_gap - top + 1
+            for board_row in range(top, height):
+                if board[board_row, board_col] == 0:
+                    num_gaps += 1
+        num_wells = 0
+        for board_col in range(width):
+            left = tops[board_col - 1] if board_col > 0 else 0
+            right = tops[board_col + 1] if board_col < width - 1 else 0
+            if tops[board_col] - left > 2 and tops[board_col] - right > 2:
+                num_wells += 1
+        gaps[index] = num_gaps
+        gap_depth[index] = depth
+        wells[index] = num_wells
+
+
+def place_tetrominoes(grids, bases, placement_ids, cols, compiled=True, rows=None):
+    """
+    Run the kernel for every candidate, described as in batch_evaluator.evaluate_placements. Return the drop rows (or
+    the given rows), the resulting boards, the number of rows cleared and of tetromino blocks cleared, and a
+    dictionary of the base board features. If compiled is false and numba isn't installed, the kernel runs as plain
+    Python.
+    """
+    # Imported here since batch_evaluator uses this module
+    from . import batch_evaluator
+
+    kernel = _load_kernel_(compiled)
+    num_candidates = len(bases)
+    boards = np.empty((num_candidates, HEIGHT, WIDTH), np.uint8)
+    given_rows = np.asarray(rows if rows is not None else [], dtype=np.int64)
+    rows = np.empty(num_candidates, np.int64)
+    rows_cleared = np.empty(num_candidates, np.int64)
+    eroded_blocks = np.empty(num_candidates, np.int64)
+    gaps = np.empty(num_candidates, np.int64)
+    gap_depth = np.empty(num_candidates, np.int64)
+    wells = np.empty(num_candidates, np.int64)
+    kernel(
+        grids,
+        bases,
+        placement_ids,
+        cols,
+        batch_evaluator.PLACEMENT_HEIGHTS,
+        batch_evaluator.PLACEMENT_ELEVATIONS,
+        batch_evaluator.PLACEMENT_COL_VALID,
+        batch_evaluator.PLACEMENT_BLOCK_ROWS,
+        batch_evaluator.PLACEMENT_BLOCK_COLS,
+        batch_evaluator.PLACEMENT_BLOCK_VALUES,
+        given_rows,
+        boards,
+        rows,
+        rows_cleared,
+        eroded_blocks,
+        gaps,
+        gap_depth,
+        wells,
+    )
+    return (
+        rows,
+        boards,
+        rows_cleared,
+        eroded_blocks,
+        {"gaps": gaps, "gap depth": gap_depth, "wells": wells},
+    )
+
+
+def make_random_board(rng):
+    """
+    Return a random board with columns of random heights, including boards where tetrominoes land above the top of
+    the playfield and wrap around.
+    """
+    board = np.zeros((HEIGHT, WIDTH), np.uint8)
+    heights = rng.integers(0, HEIGHT + 1, WIDTH)
+    fill_probability = rng.random()
+    for col, height in enumerate(heights):
+        board[HEIGHT - height :, col] = (rng.random(height) < fill_probability) * (
+            rng.integers(1, 8, height)
+        )
+    if rng.random() < 0.5:
+        # Fill some rows with one gap, so that placements can clear them
+        for row in rng.integers(0, HEIGHT, rng.integers(1, 5)):
+            board[row] = rng.integers(1, 8, WIDTH)
+            board[row, rng.integers(WIDTH)] = 0
+    return board
+
+
+def cross_check(num_boards=100, seed=0, compiled=True):
+    """
+    Evaluate every placement of every shape on num_boards random boards with the kernel, and check that every
+    result is identical to the reference Playfield implementation. Raise AssertionError on the first difference, and
+    otherwise return the number of placements checked.
+    """
+    from . import batch_evaluator
+
+    rng = np.random.default_rng(seed)
+    num_checked = 0
+    for _ in range(num_boards):
+        grid = make_random_board(rng)
+        for shape in Tetromino.SHAPES:
+            placement_ids, cols = batch_evaluator.get_candidates(shape)
+            rows, boards, rows_cleared, _, values = place_tetrominoes(
+                grid[None],
+                np.zeros(len(cols), np.int64),
+                placement_ids,
+                cols,
+                compiled,
+            )
+            for index, (placement_id, col) in enumerate(zip(placement_ids, cols)):
+                playfield = Playfield(grid)
+                tetromino = Tetromino(*batch_evaluator.PLACEMENT_KEYS[placement_id])
+                row = playfield.drop_tetromino(tetromino, col)
+                expected = {
+                    "row": row,
+                    "grid": playfield.grid,
+                    "rows cleared": playfield.num_rows_cleared,
+                    "gaps": playfield.get_gap_count(),
+                    "gap depth": playfield.get_gap_depth(),
+                    "wells": playfield.get_well_count(),
+                }
+                actual = {
+                    "row": rows[index],
+                    "grid": boards[index],
+                    "rows cleared": rows_cleared[index],
+                    "gaps": values["gaps"][index],
+                    "gap depth": values["gap depth"][index],
+                    "wells": values["wells"][index],
+                }
+                for name in expected:
+                    if not np.array_equal(expected[name], actual[name]):
+                        raise AssertionError(
+                            "{} differs for {} at column {} on board\n{}\nexpected {}, got {}".format(
+                                name,
+                                batch_evaluator.PLACEMENT_KEYS[placement_id],
+                                col,
+                                grid,
+                                expected[name],
+                                actual[name],
+                            )
+                        )
+                num_checked += 1
+    return num_checked
+
+
+if __name__ == "__main__":
+    print("backend = {}".format(get_backend()))
+    print("{} placements checked".format(cross_check(20, compiled=False)))
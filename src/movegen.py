@@ -0,0 +1,469 @@
+#!usr/bin/env python3
+# Find every placement a tetromino can reach from its spawn position, including tucks and spins, with a BFS over states
+
+from collections import namedtuple
+
+import numpy as np
+
+from .playfield import Playfield
+from .tetromino import DISTINCT_ROTATIONS, PLACEMENTS, Tetromino
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# Inputs that move a tetromino. "sonic drop" moves it down as far as it can go without locking it, and "hard drop"
+# does the same and locks it.
+LEFT = "left"
+RIGHT = "right"
+SOFT_DROP = "soft drop"
+SONIC_DROP = "sonic drop"
+CLOCKWISE = "cw"
+ANTICLOCKWISE = "ccw"
+HARD_DROP = "hard drop"
+
+# Each state of a tetromino is the position of the top left corner of its rotation box and its number of clockwise
+# rotations, as in the Super Rotation System. States are stored as bits of a Python int per rotation, with one row of
+# STRIDE bits per playfield row, so that moving every state in a set is a single shift. The rows and columns are offset
+# by the padding so that every box position with a block in the playfield has a non-negative bit, and so that shifts
+# past either side of a row only reach padding bits, which are never set in a collision mask.
+ROW_PADDING = 4
+COL_PADDING = 4
+STRIDE = 16
+NUM_ROWS = HEIGHT + ROW_PADDING
+STATES_MASK = (1 << (NUM_ROWS * STRIDE)) - 1
+# Blocked cells are stored in the same layout, with extra rows of floor so that every block of every state is covered
+NUM_BLOCKED_ROWS = NUM_ROWS + 4
+WALLS_ROW = (1 << STRIDE) - 1 - (((1 << WIDTH) - 1) << COL_PADDING)
+
+# Rotation box side of each shape. Rotating the shape's box gives the grid of each rotation in tetromino.PLACEMENTS,
+# offset within the box.
+BOX_SIZES = {"I": 4, "O": 2, "T": 3, "S": 3, "Z": 3, "J": 3, "L": 3}
+
+# Super Rotation System wall kicks, as (columns right, rows up) offsets tried in order, keyed by (from rotations,
+# to rotations)
+JLSTZ_KICKS = {
+    (0, 1): [(0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)],
+    (1, 0): [(0, 0), (1, 0), (1, -1), (0, 2), (1, 2)],
+    (1, 2): [(0, 0), (1, 0), (1, -1), (0, 2), (1, 2)],
+    (2, 1): [(0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)],
+    (2, 3): [(0, 0), (1, 0), (1, 1), (0, -2), (1, -2)],
+    (3, 2): [(0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)],
+    (3, 0): [(0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)],
+    (0, 3): [(0, 0), (1, 0), (1, 1), (0, -2), (1, -2)],
+}
+I_KICKS = {
+    (0, 1): [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)],
+    (1, 0): [(0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)],
+    (1, 2): [(0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)],
+    (2, 1): [(0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)],
+    (2, 3): [(0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)],
+    (3, 2): [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)],
+    (3, 0): [(0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)],
+    (0, 3): [(0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)],
+}
+
+
+# A reachable placement. rotations, row and col describe the placement grid in the same way as Playfield, i.e. row
+# and col are the position of the top left block of the grid, and rotations is the smallest number of rotations with
+# the same grid. inputs is the shortest list of inputs that moves the tetromino there from its spawn position and
+# locks it, ending with HARD_DROP.
+Move = namedtuple("Move", ["shape", "rotations", "row", "col", "inputs"])
+
+
+def _get_shift_(dcol, drow):
+    """Return the bit shift that moves a state by the number of columns right and rows down"""
+    return drow * STRIDE + dcol
+
+
+def _shift_(bits, shift):
+    return bits << shift if shift >= 0 else bits >> -shift
+
+
+def get_blocked_cells(grid):
+    """
+    Return the cells blocked by the filled blocks of the grid, the walls and the floor, as a Python int with the same
+    layout as the states. The rows above the playfield are only blocked by the walls. The blocked cells only depend on
+    the grid, so they can be shared by the MoveGenerator of every shape.
+    """
+    rows = np.full(NUM_BLOCKED_ROWS, (1 << STRIDE) - 1, dtype="<u2")
+    rows[: ROW_PADDING + HEIGHT] = WALLS_ROW
+    filled = np.packbits(grid != 0, axis=1, bitorder="little").view("<u2")[:, 0]
+    rows[ROW_PADDING : ROW_PADDING + HEIGHT] |= filled << COL_PADDING
+    return int.from_bytes(rows.tobytes(), "little")
+
+
+def _get_kick_shifts_(kicks):
+    """
+    Return the (left shift, right shift) of the bits of a state for each wall kick, so that the kicked state is
+    (state << left shift) >> right shift
+    """
+    shifts = {}
+    for turn, offsets in kicks.items():
+        shifts[turn] = []
+        for dcol, drow_up in offsets:
+            shift = _get_shift_(dcol, -drow_up)
+            shifts[turn].append((max(shift, 0), max(-shift, 0)))
+    return shifts
+
+
+def _build_shape_table_(shape):
+    """
+    Return the (row, col) offset of the placement grid within the rotation box, the (row, col) positions of the
+    blocks within the box, and the rotations with a distinct grid, for each rotation of the shape.
+    """
+    size = BOX_SIZES[shape]
+    box = np.zeros((size, size), dtype=np.uint8)
+    grid = np.array(Tetromino.SHAPE_GRID[shape], dtype=np.uint8)
+    # The I shape starts in the second row of its box, and every other shape starts in the first row
+    top = 1 if shape == "I" else 0
+    box[top : top + grid.shape[0], : grid.shape[1]] = grid
+    offsets = []
+    blocks = []
+    distinct = []
+    for rotations in range(4):
+        rows, cols = np.nonzero(np.rot90(box, -rotations))
+        offsets.append((int(rows.min()), int(cols.min())))
+        blocks.append(list(zip(rows.tolist(), cols.tolist())))
+        grid = PLACEMENTS[(shape, rotations)].grid
+        distinct.append(
+            next(
+                n
+                for n in DISTINCT_ROTATIONS[shape]
+                if np.array_equal(PLACEMENTS[(shape, n)].grid, grid)
+            )
+        )
+    return offsets, blocks, distinct
+
+
+JLSTZ_KICK_SHIFTS = _get_kick_shifts_(JLSTZ_KICKS)
+I_KICK_SHIFTS = _get_kick_shifts_(I_KICKS)
+# Shape -> (offsets, blocks, distinct rotations), see _build_shape_table_
+SHAPE_TABLES = {shape: _build_shape_table_(shape) for shape in Tetromino.SHAPES}
+
+
+class MoveGenerator:
+    """
+    Find the placements of a shape that are reachable on a board from the tetromino's spawn position. The tetromino
+    can move left or right, soft drop one row, sonic drop and rotate either way with wall kicks. There is no gravity
+    and no lock delay, so the tetromino only locks when it is hard dropped.
+
+    Every set of states is a bitmask per rotation, so a collision check or a move of every state in a set is a single
+    bitwise operation. The collision masks are computed once per board from the blocked cells. The reachable states are
+    found with a flood fill that slides and drops every new state as far as it can go at once, so it only takes a
+    few steps. The shortest inputs to a placement need a breadth first search over the number of inputs, which takes
+    a step per input, so it is only run when get_inputs is first called and only as far as needed.
+    """
+
+    def __init__(self, grid, shape, blocked=None):
+        """blocked is the result of get_blocked_cells for the grid, which is computed if it isn't given"""
+        self.shape = shape
+        self.offsets, self.blocks, self.distinct = SHAPE_TABLES[shape]
+        self.kicks = I_KICKS if shape == "I" else JLSTZ_KICKS
+        self.kick_shifts = I_KICK_SHIFTS if shape == "I" else JLSTZ_KICK_SHIFTS
+        # Rotating the O shape never changes its grid, so its only rotation is 0
+        self.num_rotations = 1 if shape == "O" else 4
+        if blocked is None:
+            blocked = get_blocked_cells(grid)
+        self.fits = [
+            self._get_collision_mask_(blocked, rotations)
+            for rotations in range(self.num_rotations)
+        ]
+        # States that can't move down any further
+        self.resting = [fits & ~(fits >> STRIDE) for fits in self.fits]
+        self.moves = [
+            self._get_move_masks_(rotations) for rotations in range(self.num_rotations)
+        ]
+        self.spawn_bit = self.get_spawn_bit()
+        self.reachable = self._flood_fill_()
+        # The breadth first search, which is extended by get_inputs as needed
+        self.layers = None
+        self.visited = None
+
+    def _get_collision_mask_(self, blocked, rotations):
+        """Return the states of the rotation where the tetromino doesn't overlap a blocked cell"""
+        overlaps = 0
+        for row, col in self.blocks[rotations]:
+            overlaps |= blocked >> (row * STRIDE + col)
+        return ~overlaps & STATES_MASK
+
+    def _get_move_masks_(self, rotations):
+        """
+        Return the masks used to move the states of the rotation. For each of the right, left and down directions,
+        there is a (mask, shift) pair for each step of an occluded fill, where the distance filled doubles at each
+        step and the mask is the states that can move by that distance. For each neighbouring rotation, there is a
+        (mask, left shift, right shift) for each wall kick, where the mask is the states that use that kick, i.e.
+        whose kicked state fits and for which no earlier kick fits.
+        """
+        fits = self.fits[rotations]
+        right_1 = fits & (fits << 1)
+        right_2 = right_1 & (right_1 << 2)
+        left_1 = fits & (fits >> 1)
+        left_2 = left_1 & (left_1 >> 2)
+        down_1 = fits & (fits << STRIDE)
+        down_2 = down_1 & (down_1 << 2 * STRIDE)
+        down_3 = down_2 & (down_2 << 4 * STRIDE)
+        fills = (
+            ((fits, 1), (right_1, 2), (right_2, 4), (right_2 & (right_2 << 4), 8)),
+            ((fits, 1), (left_1, 2), (left_2, 4), (left_2 & (left_2 >> 4), 8)),
+            (
+                (fits, STRIDE),
+                (down_1, 2 * STRIDE),
+                (down_2, 4 * STRIDE),
+                (down_3, 8 * STRIDE),
+                (down_3 & (down_3 << 8 * STRIDE), 16 * STRIDE),
+            ),
+        )
+        turns = []
+        if self.num_rotations > 1:
+            for new_rotations in [(rotations + 1) % 4, (rotations - 1) % 4]:
+                fits = self.fits[new_rotations]
+                kicked = 0
+                kick_masks = []
+                for left_shift, right_shift in self.kick_shifts[
+                    (rotations, new_rotations)
+                ]:
+                    # States whose kicked state fits
+                    mask = ((fits << right_shift) >> left_shift) & ~kicked
+                    if mask:
+                        kicked |= mask
+                        kick_masks.append((mask, left_shift, right_shift))
+                turns.append((new_rotations, kick_masks))
+        return fills, turns
+
+    def get_spawn_bit(self):
+        """Return the bit of the spawn state, which has no rotations, or None if the tetromino can't spawn"""
+        row_offset, col_offset = self.offsets[0]
+        spawn_col = Tetromino(self.shape).spawn_column()
+        bit = (ROW_PADDING - row_offset) * STRIDE + (
+            COL_PADDING + spawn_col - col_offset
+        )
+        if not (self.fits[0] >> bit) & 1:
+            return None
+        return bit
+
+    def _turn_(self, states, turns, reached):
+        """Add the states reached by rotating the states to reached"""
+        for new_rotations, kick_masks in turns:
+            for mask, left_shift, right_shift in kick_masks:
+                reached[new_rotations] |= ((states & mask) << left_shift) >> right_shift
+
+    def _flood_fill_(self):
+        """Return the reachable states of each rotation"""
+        visited = [0] * self.num_rotations
+        if self.spawn_bit is None:
+            return visited
+        visited[0] = 1 << self.spawn_bit
+        frontier = list(visited)
+        while any(frontier):
+            reached = [0] * self.num_rotations
+            for rotations, states in enumerate(frontier):
+                if not states:
+                    continue
+                (right, left, down), turns = self.moves[rotations]
+                # Slide the states as far as they can go either way, and then drop them
+                for mask, shift in right:
+                    states |= mask & (states << shift)
+                for mask, shift in left:
+                    states |= mask & (states >> shift)
+                for mask, shift in down:
+                    states |= mask & (states << shift)
+                reached[rotations] |= states
+                self._turn_(states, turns, reached)
+            frontier = [states & ~seen for states, seen in zip(reached, visited)]
+            visited = [seen | states for seen, states in zip(visited, frontier)]
+        return visited
+
+    def _search_layer_(self):
+        """
+        Add the layer of states first reached after one more input to the breadth first search. Return false if there
+        are no new states.
+        """
+        frontier = self.layers[-1]
+        reached = [0] * self.num_rotations
+        for rotations, states in enumerate(frontier):
+            if not states:
+                continue
+            (_, _, down), turns = self.moves[rotations]
+            fits = self.fits[rotations]
+            # Sonic drop, by filling down through the collision mask
+            dropped = states
+            for mask, shift in down:
+                dropped |= mask & (dropped << shift)
+            reached[rotations] |= (
+                ((states >> 1) | (states << 1) | (states << STRIDE)) & fits
+            ) | (dropped & self.resting[rotations])
+            self._turn_(states, turns, reached)
+        frontier = [states & ~seen for states, seen in zip(reached, self.visited)]
+        if not any(frontier):
+            return False
+        self.visited = [seen | states for seen, states in zip(self.visited, frontier)]
+        self.layers.append(frontier)
+        return True
+
+    def _get_layer_(self, rotations, bit):
+        """
+        Return the number of inputs to reach the state, extending the search as needed, or None if the state isn't
+        reachable
+        """
+        if not (self.reachable[rotations] >> bit) & 1:
+            return None
+        if self.layers is None:
+            frontier = [0] * self.num_rotations
+            frontier[0] = 1 << self.spawn_bit
+            self.layers = [frontier]
+            self.visited = list(frontier)
+        while not (self.visited[rotations] >> bit) & 1:
+            self._search_layer_()
+        return next(
+            layer
+            for layer, states in enumerate(self.layers)
+            if (states[rotations] >> bit) & 1
+        )
+
+    def _get_predecessor_(self, layer, rotations, bit):
+        """
+        Return an input and the rotations and bit of a state in the layer that the input moves to the state
+        """
+        previous = self.layers[layer]
+        fits = self.fits[rotations]
+        # A sonic drop is checked first so that the last input before locking is a sonic drop whenever possible,
+        # since it is replaced by the hard drop
+        if (self.resting[rotations] >> bit) & 1:
+            source = bit - STRIDE
+            while source >= 0 and (fits >> source) & 1:
+                if (previous[rotations] >> source) & 1:
+                    return SONIC_DROP, rotations, source
+                source -= STRIDE
+        for move, source in [
+            (LEFT, bit + 1),
+            (RIGHT, bit - 1),
+            (SOFT_DROP, bit - STRIDE),
+        ]:
+            if source >= 0 and (previous[rotations] >> source) & 1:
+                return move, rotations, source
+        for move, old_rotations in [
+            (CLOCKWISE, (rotations - 1) % 4),
+            (ANTICLOCKWISE, (rotations + 1) % 4),
+        ]:
+            if self.num_rotations == 1:
+                break
+            kicks = self.kicks[(old_rotations, rotations)]
+            for index, (dcol, drow_up) in enumerate(kicks):
+                source = bit - _get_shift_(dcol, -drow_up)
+                if source < 0 or not (previous[old_rotations] >> source) & 1:
+                    continue
+                # The kick is only used if no earlier kick fits
+                earlier_fits = any(
+                    (fits >> (source + _get_shift_(earlier_dcol, -earlier_drow_up))) & 1
+                    for earlier_dcol, earlier_drow_up in kicks[:index]
+                )
+                if not earlier_fits:
+                    return move, old_rotations, source
+        raise AssertionError("no predecessor found")
+
+    def _get_state_inputs_(self, rotations, bit):
+        """Return the shortest list of inputs that moves the tetromino to the resting state and locks it"""
+        layer = self._get_layer_(rotations, bit)
+        inputs = []
+        while layer > 0:
+            move, rotations, bit = self._get_predecessor_(layer - 1, rotations, bit)
+            inputs.append(move)
+            layer -= 1
+        inputs.reverse()
+        # Hard dropping a tetromino that is already resting only locks it
+        if inputs and inputs[-1] == SONIC_DROP:
+            inputs.pop()
+        inputs.append(HARD_DROP)
+        return inputs
+
+    def get_placement(self, rotations, bit):
+        """Return the (rotations, row, col) of the placement grid of a state, as used by Playfield"""
+        row_offset, col_offset = self.offsets[rotations]
+        box_row, box_col = divmod(bit, STRIDE)
+        return (
+            self.distinct[rotations],
+            box_row - ROW_PADDING + row_offset,
+            box_col - COL_PADDING + col_offset,
+        )
+
+    def get_state(self, placement):
+        """Return the (rotations, bit) of a state with the placement"""
+        rotations, row, col = placement
+        row_offset, col_offset = self.offsets[rotations]
+        return rotations, (row - row_offset + ROW_PADDING) * STRIDE + (
+            col - col_offset + COL_PADDING
+        )
+
+    def get_placements(self):
+        """
+        Return the distinct reachable placements as a list of (rotations, row, col). States with different rotations
+        can have the same grid, e.g. an S shape rotated twice, so they lead to the same placement.
+        """
+        placements = {}
+        for rotations, states in enumerate(self.reachable):
+            states &= self.resting[rotations]
+            while states:
+                low_bit = states & -states
+                placements[self.get_placement(rotations, low_bit.bit_length() - 1)] = (
+                    None
+                )
+                states ^= low_bit
+        return list(placements)
+
+    def get_inputs(self, placement):
+        """
+        Return the shortest list of inputs that moves the tetromino from its spawn position to the reachable
+        placement and locks it, or None if the placement isn't reachable
+        """
+        rotations, row, col = placement
+        inputs = None
+        # Every rotation with the same grid as the placement leads to it
+        for state_rotations in range(self.num_rotations):
+            if self.distinct[state_rotations] != rotations:
+                continue
+            state = self.get_state((state_rotations, row, col))
+            if state[1] < 0 or not (self.reachable[state[0]] >> state[1]) & 1:
+                continue
+            if not (self.resting[state[0]] >> state[1]) & 1:
+                continue
+            state_inputs = self._get_state_inputs_(*state)
+            if inputs is None or len(state_inputs) < len(inputs):
+                inputs = state_inputs
+        return inputs
+
+    def get_moves(self):
+        """Return a Move for every distinct reachable placement"""
+        return [
+            Move(self.shape, *placement, self.get_inputs(placement))
+            for placement in self.get_placements()
+        ]
+
+
+def get_moves(grid, shape):
+    """Return a Move for every distinct placement of the shape that is reachable on the grid, see MoveGenerator"""
+    return MoveGenerator(grid, shape).get_moves()
+
+
+if __name__ == "__main__":
+    import time
+
+    # A T slot under an overhang, which can only be filled by a T spin
+    grid = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    grid[18, [0, 1, 2, 3]] = 1
+    grid[19, [0, 1, 2, 3]] = 1
+    grid[20, [0, 1, 2, 3, 7, 8, 9]] = 1
+    grid[21, [0, 1, 2, 3, 4, 6, 7, 8, 9]] = 1
+    grid[18, 4] = 1
+    playfield = Playfield(grid)
+    start = time.perf_counter()
+    generator = MoveGenerator(grid, "T")
+    placements = generator.get_placements()
+    print(
+        "{} placements in {:.3f} ms".format(
+            len(placements), (time.perf_counter() - start) * 1000
+        )
+    )
+    for rotations, row, col in placements:
+        drop_row = playfield._get_drop_row_(Tetromino("T", rotations), col)
+        if row != drop_row:
+            print((rotations, row, col), generator.get_inputs((rotations, row, col)))
@@ -0,0 +1,247 @@
+#!usr/bin/env python3
+# Persistent book of moves keyed by the surface profile of the board and the current and held tetrominoes
+
+import json
+import zlib
+
+import numpy as np
+
+from .tetromino import Tetromino
+
+FORMAT_VERSION = 2
+BOOK_MAGIC = b"TBOB"
+
+# A book file is this header, followed by the sorted array of keys and then a move record for each key. The keys are
+# stored on their own so that a binary search over them doesn't copy or touch the moves. The header also holds the
+# settings of the solver that chose the moves, see get_book_settings, since keys don't include the queue or weights.
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S4"),
+        ("version", "<u2"),
+        ("record_size", "<u2"),
+        ("num_entries", "<u8"),
+        ("depth", "<u2"),
+        ("beam_width", "<u2"),
+        ("weights_hash", "<u4"),
+        ("reachability", "u1"),
+        ("reserved", "u1", (7,)),
+    ]
+)
+# Header fields that must match the solver using a book
+SETTINGS_FIELDS = ("depth", "beam_width", "weights_hash", "reachability")
+KEY_DTYPE = np.dtype("<u8")
+
+# count is the number of times the key was seen when the book was built
+MOVE_DTYPE = np.dtype(
+    [
+        ("count", "<u4"),
+        ("hold_swap", "u1"),
+        ("rotations", "u1"),
+        ("col", "i1"),
+        ("reserved", "u1"),
+    ]
+)
+
+# Keys are packed into an int, with HEIGHT_BITS per relative column height followed by SHAPE_BITS for each of the
+# current and held shapes and a bit for a banned hold
+HEIGHT_BITS = 5
+SHAPE_BITS = 3
+
+# Keys must be chosen at least this many times before they are written to a book
+DEFAULT_MIN_COUNT = 2
+
+
+def _get_shape_code_(tetromino):
+    if tetromino is None:
+        return 0
+    return Tetromino.SHAPES.index(tetromino.shape) + 1
+
+
+def get_book_settings(solver):
+    """
+    Return the settings of a solver that decide its moves, as stored in a book header: the search depth and beam
+    width, with a beam width of 0 for the greedy solver, a hash of the weights and whether it uses reachability.
+    """
+    weights = json.dumps(sorted(solver.weights.items())).encode()
+    return {
+        "depth": solver.search.depth if solver.search is not None else 1,
+        "beam_width": solver.search.beam_width if solver.search is not None else 0,
+        "weights_hash": zlib.crc32(weights),
+        "reachability": int(solver.reachability),
+    }
+
+
+def get_book_key(playfield, current_tetromino, held_tetromino, ban_hold):
+    """
+    Return the book key of a position. The board is reduced to its surface profile, i.e. the heights of the
+    columns relative to the lowest column, which decides where every placement lands. Boards with the same profile
+    only score placements differently when holes change which rows are cleared, so a book move is the solver's move
+    on any board with that profile in all but rare cases.
+    """
+    heights = playfield.get_heights()
+    key = 0
+    for height in (heights - heights.min()).tolist():
+        key = (key << HEIGHT_BITS) | height
+    key = (key << SHAPE_BITS) | _get_shape_code_(current_tetromino)
+    key = (key << SHAPE_BITS) | _get_shape_code_(held_tetromino)
+    return (key << 1) | bool(ban_hold)
+
+
+class BookBuilder:
+    """
+    Count the moves chosen for every key over many games, e.g. the games of a batch run, and write the most common
+    move of each key that recurs to a book file. settings are the get_book_settings of the solver choosing the moves.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        # (key, hold_swap, rotations, col) -> number of times chosen
+        self.counts = {}
+
+    def record(self, game, outcome, ban_hold):
+        """Count the outcome chosen for the current turn of the game, before it is executed"""
+        key = get_book_key(
+            game.playfield, game.current_tetromino, game.holder.held_tetromino, ban_hold
+        )
+        move = (key, bool(outcome["hold_swap"]), outcome["rotations"], outcome["col"])
+        self.counts[move] = self.counts.get(move, 0) + 1
+
+    def update(self, counts):
+        """Add the counts of another builder, e.g. from another process"""
+        for move, count in counts.items():
+            self.counts[move] = self.counts.get(move, 0) + count
+
+    def write(self, path, min_count=DEFAULT_MIN_COUNT):
+        """
+        Write the most common move of every key chosen at least min_count times to a book file, breaking ties by the
+        order of the moves. Return the number of keys written.
+        """
+        # Key -> (count of the key, best move count, best move)
+        best = {}
+        for move, count in self.counts.items():
+            key = move[0]
+            key_count, move_count, best_move = best.get(key, (0, 0, None))
+            if count > move_count or (count == move_count and move < best_move):
+                move_count, best_move = count, move
+            best[key] = (key_count + count, move_count, best_move)
+        keys = sorted(key for key in best if best[key][0] >= min_count)
+        moves = np.zeros(len(keys), MOVE_DTYPE)
+        for index, key in enumerate(keys):
+            key_count, _, (_, hold_swap, rotations, col) = best[key]
+            moves[index] = (key_count, hold_swap, rotations, col, 0)
+        header = np.zeros((), HEADER_DTYPE)
+        header["magic"] = BOOK_MAGIC
+        header["version"] = FORMAT_VERSION
+        header["record_size"] = MOVE_DTYPE.itemsize
+        header["num_entries"] = len(keys)
+        for field in SETTINGS_FIELDS:
+            header[field] = self.settings[field]
+        with open(path, "wb") as book_file:
+            book_file.write(header.tobytes())
+            book_file.write(np.array(keys, KEY_DTYPE).tobytes())
+            book_file.write(moves.tobytes())
+        return len(keys)
+
+
+class OpeningBook:
+    """
+    Read-only book written by BookBuilder. The keys and moves are memory mapped, so opening a book costs nothing
+    however large it is, and a lookup is a binary search that only touches the pages it needs. If settings are given,
+    the book is refused unless it was built by a solver with the same get_book_settings, since its moves are only
+    the moves of that solver.
+    """
+
+    def __init__(self, path, settings=None):
+        self.path = path
+        header = np.fromfile(path, HEADER_DTYPE, count=1)
+        if header.size == 0 or header[0]["magic"] != BOOK_MAGIC:
+            raise ValueError("{} is not an opening book".format(path))
+        header = header[0]
+        if (
+            header["version"] != FORMAT_VERSION
+            or header["record_size"] != MOVE_DTYPE.itemsize
+        ):
+            raise ValueError(
+                "{} has unsupported book format version {}".format(
+                    path, header["version"]
+                )
+            )
+        self.settings = {field: int(header[field]) for field in SETTINGS_FIELDS}
+        if settings is not None and settings != self.settings:
+            raise ValueError(
+                "{} was built by a solver with {}, not {}".format(
+                    path, self.settings, settings
+                )
+            )
+        num_entries = int(header["num_entries"])
+        if num_entries == 0:
+            # Empty files can't be memory mapped
+            self.keys = np.zeros(0, KEY_DTYPE)
+            self.moves = np.zeros(0, MOVE_DTYPE)
+        else:
+            self.keys = np.memmap(
+                path,
+                dtype=KEY_DTYPE,
+                mode="r",
+                offset=HEADER_DTYPE.itemsize,
+                shape=(num_entries,),
+            )
+            self.moves = np.memmap(
+                path,
+                dtype=MOVE_DTYPE,
+                mode="r",
+                offset=HEADER_DTYPE.itemsize + num_entries * KEY_DTYPE.itemsize,
+                shape=(num_entries,),
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_move(self, playfield, current_tetromino, held_tetromino, ban_hold):
+        """Return the (hold_swap, rotations, col) of the book move for the position, or None if there isn't one"""
+        key = get_book_key(playfield, current_tetromino, held_tetromino, ban_hold)
+        index = int(np.searchsorted(self.keys, np.uint64(key)))
+        if index == len(self.keys) or self.keys[index] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        move = self.moves[index]
+        return bool(move["hold_swap"]), int(move["rotations"]), int(move["col"])
+
+    def stats(self):
+        """Return a dictionary of the book counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    from .runner import make_solver, play_game
+
+    # Build a book from the openings of some games and play other games with it
+    builder = BookBuilder(get_book_settings(make_solver()))
+    for seed in range(50):
+        builder.update(play_game(seed, max_pieces=20, build_book=True)["book_counts"])
+    path = os.path.join(tempfile.mkdtemp(), "book.bin")
+    print("{} entries".format(builder.write(path)))
+    results = [play_game(seed, max_pieces=20, book_path=path) for seed in range(50, 60)]
+    hits = sum(result["book_hits"] for result in results)
+    misses = sum(result["book_misses"] for result in results)
+    print("{} hits and {} misses on other games".format(hits, misses))
+
+    # A solver with another search depth refuses the book
+    try:
+        make_solver(depth=2, book_path=path)
+    except ValueError as error:
+        print(error)
+    else:
+        raise RuntimeError("a depth 2 solver opened a depth 1 book")
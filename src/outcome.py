@@ -0,0 +1,211 @@
+#!usr/bin/env python3
+# Compact outcome records and immutable board snapshots that share row storage
+
+import numpy as np
+
+from .bitboard_playfield import BitboardPlayfield
+from .playfield import Playfield
+from .tetromino import PLACEMENTS, Tetromino
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# Every empty row of every snapshot is this object
+EMPTY_ROW = bytes(WIDTH)
+
+
+def _get_column_tops_(grid):
+    """Return tuple containing the row of the top filled block in each column of the grid, or HEIGHT if it is empty"""
+    filled = grid != 0
+    return tuple(np.where(filled.any(axis=0), filled.argmax(axis=0), HEIGHT).tolist())
+
+
+class BoardSnapshot:
+    """
+    Immutable playfield grid stored as a tuple of rows, where each row is a bytes object. Placing a tetromino on a
+    snapshot returns a new snapshot that shares every unchanged row with its parent, rather than copying the grid.
+    """
+
+    __slots__ = ("rows", "column_tops")
+
+    def __init__(self, rows, column_tops=None):
+        """column_tops is the tuple of the row of the top filled block in each column, which is found if not given"""
+        self.rows = tuple(rows)
+        if column_tops is None:
+            column_tops = _get_column_tops_(self.grid)
+        self.column_tops = column_tops
+
+    @classmethod
+    def from_grid(cls, grid, column_tops=None):
+        """Return a snapshot of a numpy grid"""
+        grid = np.asarray(grid, dtype=np.uint8)
+        if column_tops is None:
+            column_tops = _get_column_tops_(grid)
+        data = grid.tobytes()
+        return cls(
+            (data[row * WIDTH : (row + 1) * WIDTH] for row in range(HEIGHT)),
+            column_tops,
+        )
+
+    @classmethod
+    def from_playfield(cls, playfield):
+        """Return a snapshot of the playfield's grid, reusing the column tops that the playfield keeps track of"""
+        if isinstance(playfield, BitboardPlayfield):
+            column_tops = tuple(playfield._get_column_tops_())
+        else:
+            column_tops = tuple(playfield.column_tops.tolist())
+        return cls.from_grid(playfield.grid, column_tops)
+
+    @property
+    def grid(self):
+        """Return the snapshot as a read-only numpy array"""
+        return np.frombuffer(b"".join(self.rows), dtype=np.uint8).reshape(HEIGHT, WIDTH)
+
+    def to_playfield(self):
+        """Return a new Playfield with a copy of the snapshot's grid"""
+        return Playfield(self.grid)
+
+    def get_drop_row(self, placement, col):
+        """Return the row that the tetromino described by the placement lands on when dropped at the column"""
+        return min(
+            self.column_tops[col + tetr_col] - placement.height + elevation
+            for tetr_col, elevation in enumerate(placement.elevations)
+        )
+
+    def place(self, placement, col, row=None):
+        """
+        Drop the tetromino described by the placement (see tetromino.PLACEMENTS) with its left side aligned with the
+        column, and clear filled rows, in the same way as Playfield.drop_tetromino. If row is given, the tetromino is
+        locked at that row instead, as with Playfield.place_tetromino. Return the new snapshot, the drop row and the
+        number of rows cleared.
+        """
+        drop_row = row if row is not None else self.get_drop_row(placement, col)
+        rows = list(self.rows)
+        # Only copy the rows that the tetromino is locked into. As with Playfield, negative rows wrap around.
+        for tetr_row, tetr_values in enumerate(placement.grid.tolist()):
+            row = bytearray(rows[drop_row + tetr_row])
+            for tetr_col, value in enumerate(tetr_values):
+                if value != 0:
+                    row[col + tetr_col] = value
+            rows[drop_row + tetr_row] = bytes(row)
+
+        # Keep rows that are partially filled, in the same way as Playfield
+        kept = [row for row in rows if row != EMPTY_ROW and 0 in row]
+        num_cleared_rows = sum(0 not in row for row in rows)
+        num_empty_rows = HEIGHT - len(kept)
+        if num_cleared_rows or rows[num_empty_rows:] != kept:
+            rows = [EMPTY_ROW] * num_empty_rows + kept
+            return BoardSnapshot(rows), drop_row, num_cleared_rows
+
+        if drop_row < 0:
+            # The tetromino has wrapped around, so the column tops can't be updated incrementally
+            return BoardSnapshot(rows), drop_row, num_cleared_rows
+        column_tops = list(self.column_tops)
+        for tetr_col, top in enumerate(placement.tops):
+            column_tops[col + tetr_col] = min(
+                column_tops[col + tetr_col], drop_row + top
+            )
+        return BoardSnapshot(rows, tuple(column_tops)), drop_row, num_cleared_rows
+
+
+class Outcome:
+    """
+    Compact record of a single potential outcome. The resulting board is only built when it is first accessed, by
+    placing the tetromino on the snapshot of the board the outcome started from. For compatibility with code that
+    expects outcome dictionaries, fields can also be accessed with outcome["field"]. If the outcome was found by a
+    movegen.MoveGenerator, the tetromino is locked at its row rather than dropped, and the inputs that move it there
+    are found when they are first accessed.
+    """
+
+    __slots__ = (
+        "parent",
+        "shape",
+        "rotations",
+        "row",
+        "col",
+        "hold_swap",
+        "gaps",
+        "gap_depth",
+        "wells",
+        "cost",
+        "move_generator",
+        "_board",
+        "_inputs",
+    )
+
+    def __init__(
+        self,
+        parent,
+        shape,
+        rotations,
+        row,
+        col,
+        hold_swap,
+        gaps=0,
+        gap_depth=0,
+        wells=0,
+        cost=None,
+        move_generator=None,
+    ):
+        self.parent = parent
+        self.shape = shape
+        self.rotations = rotations
+        self.row = row
+        self.col = col
+        self.hold_swap = hold_swap
+        self.gaps = gaps
+        self.gap_depth = gap_depth
+        self.wells = wells
+        self.cost = cost
+        self.move_generator = move_generator
+        self._board = None
+        self._inputs = None
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        return "Outcome(shape={}, rotations={}, col={}, row={}, hold_swap={})".format(
+            self.shape, self.rotations, self.col, self.row, self.hold_swap
+        )
+
+    @property
+    def tetromino(self):
+        """Return a new Tetromino for the placed tetromino, or None if no tetromino was placed"""
+        if self.shape is None:
+            return None
+        return Tetromino(self.shape, self.rotations)
+
+    @property
+    def inputs(self):
+        """
+        Return the shortest list of inputs that moves the tetromino from its spawn position to the outcome's placement
+        and locks it, or None if the outcome wasn't found by a move generator
+        """
+        if self._inputs is None and self.move_generator is not None:
+            self._inputs = self.move_generator.get_inputs(
+                (self.rotations, self.row, self.col)
+            )
+        return self._inputs
+
+    @property
+    def board(self):
+        """Return the BoardSnapshot after the outcome, sharing unchanged rows with the parent snapshot"""
+        if self._board is None:
+            if self.shape is None:
+                self._board = self.parent
+            else:
+                # Outcomes from a move generator may be tucked under an overhang, so they are placed at their row
+                row = self.row if self.move_generator is not None else None
+                self._board = self.parent.place(
+                    PLACEMENTS[(self.shape, self.rotations)], self.col, row
+                )[0]
+        return self._board
+
+    @property
+    def playfield(self):
+        """Return a new Playfield of the board after the outcome"""
+        return self.board.to_playfield()
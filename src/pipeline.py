@@ -0,0 +1,109 @@
+#!usr/bin/env python3
+# Solve and render in parallel, so that drawing the display never blocks the solver
+
+import queue
+import threading
+from collections import namedtuple
+
+# Immutable copy of everything needed to draw a frame, in the order of TerminalRenderer.draw_frame's arguments
+FrameSnapshot = namedtuple(
+    "FrameSnapshot",
+    ["grid", "held_grid", "queue_grids", "num_blocks_placed", "num_rows_cleared"],
+)
+
+
+def take_snapshot(game):
+    """
+    Return a FrameSnapshot of the game. The grids are copies, so the snapshot is unaffected by later turns.
+    """
+    grid = game.playfield.grid.copy()
+    grid.setflags(write=False)
+    held_tetromino = game.holder.held_tetromino
+    return FrameSnapshot(
+        grid,
+        held_tetromino.get_zero_padded_grid() if held_tetromino is not None else None,
+        tuple(
+            tetromino.get_zero_padded_grid() for tetromino in game.tetromino_queue.queue
+        ),
+        game.playfield.num_blocks_placed,
+        game.playfield.num_rows_cleared,
+    )
+
+
+class RenderPipeline:
+    """
+    Run the solver in a producer thread that publishes a FrameSnapshot after every turn, while the calling thread
+    renders the snapshots. Only the latest snapshot is kept, so if the renderer falls behind, intermediate frames
+    are dropped rather than slowing down the solver.
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        # Holds at most the latest snapshot. None signals the end of the game.
+        self.frames = queue.Queue(maxsize=1)
+        # Frames are dropped by the producer when the renderer hasn't taken the previous frame yet, and skipped by the
+        # renderer when they arrive faster than its frame rate cap
+        self.frames_published = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.frames_drawn = 0
+        self._error = None
+
+    def _publish_(self, snapshot):
+        """Publish the snapshot, replacing any snapshot that hasn't been rendered yet"""
+        self.frames_published += 1
+        while True:
+            try:
+                self.frames.put_nowait(snapshot)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _produce_(self, game, solver, max_pieces):
+        """Play the game, publishing a snapshot after every turn"""
+        try:
+            while not game.is_over():
+                if (
+                    max_pieces is not None
+                    and game.playfield.num_blocks_placed >= max_pieces
+                ):
+                    break
+                game.next_turn(solver.decide_outcome(game))
+                self._publish_(take_snapshot(game))
+        except Exception as error:
+            self._error = error
+        finally:
+            # Wait for the renderer to take any remaining snapshot, so that the end signal is never dropped
+            self.frames.put(None)
+
+    def run(self, game, solver, max_pieces=None):
+        """
+        Play the game with the solver until it is over or max_pieces tetrominoes have been placed, rendering
+        frames as they become available. The final frame is always drawn.
+        """
+        producer = threading.Thread(
+            target=self._produce_, args=(game, solver, max_pieces), daemon=True
+        )
+        producer.start()
+        last_snapshot = None
+        last_drawn = True
+        while True:
+            snapshot = self.frames.get()
+            if snapshot is None:
+                break
+            last_snapshot = snapshot
+            last_drawn = self.renderer.draw_frame(*snapshot)
+            if last_drawn:
+                self.frames_drawn += 1
+            else:
+                self.frames_skipped += 1
+        producer.join()
+        if self._error is not None:
+            raise self._error
+        if not last_drawn:
+            self.renderer.draw_frame(*last_snapshot, force=True)
+            self.frames_drawn += 1
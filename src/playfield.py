@@ -1,6 +1,8 @@
 #!usr/bin/env python3
 # Model tetris playfield as numpy array
 
+import bisect
+
 import numpy as np
 
 from .tetromino import Tetromino
@@ -23,6 +25,20 @@ class Playfield:
             )
         self.num_rows_cleared = 0
         self.num_blocks_placed = 0
+        self._init_column_stats_()
+
+    def _init_column_stats_(self):
+        """Set up the per-column statistics and calculate them from the grid"""
+        # Per-column statistics, adjusted as tetrominoes are locked and rows are cleared so that the metrics don't
+        # need to scan the whole grid:
+        #   column_tops - row of the top filled block in each column, or MAIN_BOX_HEIGHT for empty columns
+        #   column_gaps - number of empty blocks below the top filled block in each column
+        #   lowest_gaps - one more than the row of the lowest empty block in each column, or MAIN_BOX_HEIGHT for full
+        #                 columns
+        self.column_tops = np.zeros(self.MAIN_BOX_WIDTH, dtype=np.int64)
+        self.column_gaps = np.zeros(self.MAIN_BOX_WIDTH, dtype=np.int64)
+        self.lowest_gaps = np.zeros(self.MAIN_BOX_WIDTH, dtype=np.int64)
+        self.update_column_stats()
 
     def __str__(self):
         print_str = []
@@ -37,25 +53,49 @@ class Playfield:
         Return the row of the top block of the tetromino if the tetromino
         is dropped with its left side aligned with the specified column.
         """
-        end_col = start_col + tetromino.width()
+        placement = tetromino.placement
+        end_col = start_col + placement.width
         if start_col < 0 or end_col > self.MAIN_BOX_WIDTH:
             raise ValueError("drop puts tetromino out of bounds}")
-        # Initialise to lowest possible row
-        drop_row = self.MAIN_BOX_HEIGHT
         # For each column, get the drop row ignoring other columns. The
         # highest of these is the final drop row
-        for tetr_col, grid_col in enumerate(range(start_col, end_col)):
-            # 8 appended to column represent floor of playing field
-            col_data = np.append(self.grid[:, grid_col], 8)
-            # Get row number of highest filled row
-            stack_top = (col_data != 0).argmax()
-            col_drop_row = (
-                stack_top - tetromino.height() + tetromino.elevation(tetr_col)
+        return min(
+            stack_top - placement.height + elevation
+            for stack_top, elevation in zip(
+                self.column_tops[start_col:end_col], placement.elevations
+            )
+        )
+
+    def update_column_stats(self, start_col=0, end_col=MAIN_BOX_WIDTH):
+        """
+        Recalculate the per-column statistics for the columns in [start_col, end_col). This must be called if the
+        grid is modified directly.
+        """
+        filled = self.grid[:, start_col:end_col] != 0
+        tops = np.where(filled.any(axis=0), filled.argmax(axis=0), self.MAIN_BOX_HEIGHT)
+        self.column_tops[start_col:end_col] = tops
+        self.column_gaps[start_col:end_col] = (
+            (np.arange(self.MAIN_BOX_HEIGHT)[:, None] >= tops) & ~filled
+        ).sum(axis=0)
+        self.lowest_gaps[start_col:end_col] = self.MAIN_BOX_HEIGHT - (
+            np.flip(~filled, axis=0).argmax(axis=0)
+        )
+
+    def _fill_column_blocks_(self, col, rows):
+        """Adjust the statistics of the column for the previously empty blocks in the rows that have been filled"""
+        top = int(self.column_tops[col])
+        new_top = min(top, min(rows))
+        # Blocks below the old top fill gaps, and the empty blocks between a new top and the old top become gaps
+        self.column_gaps[col] += (top - new_top) - len(rows)
+        self.column_tops[col] = new_top
+        lowest_gap = int(self.lowest_gaps[col]) - 1
+        if lowest_gap in rows:
+            # The lowest empty block was filled, so the next one up is the lowest
+            while lowest_gap >= 0 and self.grid[lowest_gap, col] != 0:
+                lowest_gap -= 1
+            self.lowest_gaps[col] = (
+                lowest_gap + 1 if lowest_gap >= 0 else self.MAIN_BOX_HEIGHT
             )
-            # Keep highest row, other drop rows will be overlapping in other
-            # columns
-            drop_row = min(drop_row, col_drop_row)
-        return drop_row
 
     def _lock_tetromino_(self, tetromino, position):
         """
@@ -65,31 +105,82 @@ class Playfield:
         tetromino is locked is a position that overlaps with existing filled
         blocks, the new tetromino will overwrite the exsting blocks.
         """
-        for tetr_col in range(tetromino.width()):
-            for tetr_row in range(tetromino.height()):
-                grid_position = (position[0] + tetr_row, position[1] + tetr_col)
+        for tetr_col in range(tetromino.placement.width):
+            grid_col = position[1] + tetr_col
+            # Rows of the blocks in this column that were empty before the tetromino was locked
+            filled_rows = []
+            for tetr_row in range(tetromino.placement.height):
                 tetr_position = (tetr_row, tetr_col)
                 # Overwrite grid value with tetromino value
                 if tetromino[tetr_position] != 0:
-                    self.grid[grid_position] = tetromino[tetr_position]
+                    # Negative rows index from the bottom of the grid
+                    grid_row = (position[0] + tetr_row) % self.MAIN_BOX_HEIGHT
+                    if self.grid[grid_row, grid_col] == 0:
+                        filled_rows.append(grid_row)
+                    self.grid[grid_row, grid_col] = tetromino[tetr_position]
+            if filled_rows:
+                self._fill_column_blocks_(grid_col, filled_rows)
 
     def _clear_filled_rows_(self):
         """
         Check for and remove filled rows. Return a list of the rows cleared
         """
-        # Get the number of the rows that are filled
-        num_cleared_rows = np.count_nonzero([row.all() for row in self.grid])
+        filled = self.grid != 0
+        full_rows = filled.all(axis=1)
+        occupied_rows = filled.any(axis=1)
         # Get rows that are partially filled
-        part_rows = np.array(
-            [row for row in self.grid if (not row.all() and row.any())]
-        )
-        # Reset grid with zeros
-        self.grid.fill(0)
-        # Refill the bottom of the grid with the partially filled rows, leaving out rows that were filled.
-        if part_rows.any():
-            self.grid[self.MAIN_BOX_HEIGHT - part_rows.shape[0] :, :] = part_rows
+        part_rows = ~full_rows & occupied_rows
+        # Get the number of the rows that are filled
+        num_cleared_rows = np.count_nonzero(full_rows)
+        # The grid only changes if a row is filled or there is an empty row below a partially filled row
+        if num_cleared_rows or (part_rows[:-1] & ~part_rows[1:]).any():
+            part_rows = self.grid[part_rows]
+            # Reset grid with zeros
+            self.grid.fill(0)
+            # Refill the bottom of the grid with the partially filled rows, leaving out rows that were filled.
+            if part_rows.any():
+                self.grid[self.MAIN_BOX_HEIGHT - part_rows.shape[0] :, :] = part_rows
+            self._shift_column_stats_(occupied_rows, full_rows)
         return num_cleared_rows
 
+    def _shift_column_stats_(self, occupied_rows, full_rows):
+        """
+        Adjust the per-column statistics after the full rows have been removed from the grid, given which rows had
+        any filled blocks and which were full before they were removed
+        """
+        num_occupied = np.count_nonzero(occupied_rows)
+        if not occupied_rows[self.MAIN_BOX_HEIGHT - num_occupied :].all():
+            # Empty rows inside the stack are removed too, which changes the gaps of every column
+            self.update_column_stats()
+            return
+        full_rows = np.flatnonzero(full_rows).tolist()
+        num_full_rows = len(full_rows)
+        tops = self.column_tops.tolist()
+        lowest_gaps = self.lowest_gaps.tolist()
+        # Columns whose top block was removed
+        rescan = []
+        for col, (top, gaps) in enumerate(zip(tops, self.column_gaps.tolist())):
+            if top in full_rows:
+                rescan.append(col)
+                continue
+            # Every block that is kept moves down by the number of full rows below it. Full rows have no empty blocks,
+            # so the gaps of the column don't change.
+            top += num_full_rows - bisect.bisect_right(full_rows, top)
+            tops[col] = top
+            if gaps == 0:
+                # The lowest empty block is just above the top
+                lowest_gaps[col] = top if top > 0 else self.MAIN_BOX_HEIGHT
+            else:
+                lowest_gap = lowest_gaps[col] - 1
+                lowest_gaps[col] += num_full_rows - bisect.bisect_right(
+                    full_rows, lowest_gap
+                )
+        self.column_tops[:] = tops
+        self.lowest_gaps[:] = lowest_gaps
+        if rescan:
+            # The new top of a column whose top block was removed is wherever its next block down was
+            self.update_column_stats(rescan[0], rescan[-1] + 1)
+
     def drop_tetromino(self, tetromino, col):
         """
         Drop tetromino with left side aligned with specified column. This ends the turn, so update the score as
@@ -97,37 +188,31 @@ class Playfield:
         """
         assert isinstance(tetromino, Tetromino)
         row = self._get_drop_row_(tetromino, col)
+        self.place_tetromino(tetromino, row, col)
+        return row
+
+    def place_tetromino(self, tetromino, row, col):
+        """
+        Lock tetromino with its top left corner at the specified row and column, e.g. after it has been moved under
+        an overhang, rather than dropping it. This ends the turn in the same way as drop_tetromino.
+        """
+        assert isinstance(tetromino, Tetromino)
         self._lock_tetromino_(tetromino, (row, col))
         num_cleared_rows = self._clear_filled_rows_()
         self.num_rows_cleared += num_cleared_rows
         self.num_blocks_placed += 1
-        return row
 
     def get_heights(self):
         """Return array containing heights of each column"""
-        # Append 8 to each column to represent floor
-        grid_with_floor = np.append(self.grid, [[8] * self.MAIN_BOX_WIDTH], axis=0)
-        return self.MAIN_BOX_HEIGHT - (grid_with_floor != 0).argmax(axis=0)
+        return self.MAIN_BOX_HEIGHT - self.column_tops
 
     def get_gap_count(self):
         """Return number of gaps in stack"""
-        # Count number of zeros after top of stack for each column
-        return sum(
-            [
-                np.count_nonzero(col[top:] == 0)
-                for col, top in zip(
-                    self.grid.T, self.MAIN_BOX_HEIGHT - self.get_heights()
-                )
-            ]
-        )
+        return self.column_gaps.sum()
 
     def get_gap_depth(self):
         """Return sum of gap depth in stack"""
-        # Get the row of the lowest gap for each column
-        lowest_gaps = self.MAIN_BOX_HEIGHT - (np.flip(self.grid, axis=0) == 0).argmax(
-            axis=0
-        )
-        return sum(lowest_gaps - (self.MAIN_BOX_HEIGHT - self.get_heights()) + 1)
+        return (self.lowest_gaps - self.column_tops + 1).sum()
 
     def get_well_count(self):
         """
@@ -135,7 +220,7 @@ class Playfield:
         be cleared by I shape.
         """
         # Get height of top filled block in each column
-        col_heights = self.MAIN_BOX_HEIGHT - self.get_heights()
+        col_heights = self.column_tops
         # Append walls on either side represented with height 0
         col_heights_walled = np.concatenate(([0], col_heights, [0]))
         # Get difference between column height and column height to the
@@ -146,7 +231,14 @@ class Playfield:
         return sum((left_diffs > 2) & (right_diffs > 2))
 
     def copy(self):
-        return Playfield(self.grid)
+        playfield = Playfield.__new__(Playfield)
+        playfield.grid = self.grid.copy()
+        playfield.num_rows_cleared = 0
+        playfield.num_blocks_placed = 0
+        playfield.column_tops = self.column_tops.copy()
+        playfield.column_gaps = self.column_gaps.copy()
+        playfield.lowest_gaps = self.lowest_gaps.copy()
+        return playfield
 
     def execute_outcome(self, outcome, tetromino, holder):
         if outcome["hold_swap"]:
@@ -154,10 +246,15 @@ class Playfield:
         # If hold swap returned an empty Tetromino, skip movement
         if tetromino is not None:
             tetromino.rotate(outcome["rotations"])
-            self.drop_tetromino(tetromino, outcome["col"])
+            if outcome["move_generator"] is not None:
+                # The outcome was reached by a sequence of inputs, which may tuck or spin the tetromino under an
+                # overhang, so it is locked where it was placed rather than dropped
+                self.place_tetromino(tetromino, outcome["row"], outcome["col"])
+            else:
+                self.drop_tetromino(tetromino, outcome["col"])
 
     def is_game_over(self):
         """
         Return true if the game is over.
         """
-        return max(self.get_heights()) == self.MAIN_BOX_HEIGHT
+        return self.column_tops.min() == 0
@@ -0,0 +1,81 @@
+#!usr/bin/env python3
+# Generate the sequence of tetromino shapes in chunks, from an injectable random number generator
+
+import random
+
+from .tetromino import Tetromino
+
+
+class UniformRandomiser:
+    """
+    Select every shape independently with equal probability.
+    """
+
+    CHUNK_SIZE = 64
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def get_chunk(self):
+        """Return a list of the next shapes in the sequence"""
+        return self.rng.choices(Tetromino.SHAPES, k=self.CHUNK_SIZE)
+
+
+class BagRandomiser:
+    """
+    Deal shapes from a shuffled bag containing one of each shape, refilling the bag when it is empty. This is the
+    randomiser used by modern versions of tetris.
+    """
+
+    BAGS_PER_CHUNK = 8
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def get_chunk(self):
+        """Return a list of the next shapes in the sequence"""
+        chunk = []
+        for _ in range(self.BAGS_PER_CHUNK):
+            bag = list(Tetromino.SHAPES)
+            self.rng.shuffle(bag)
+            chunk += bag
+        return chunk
+
+
+class SequenceRandomiser:
+    """
+    Replay a pre-recorded sequence of shapes read from a file, e.g. "IOTSZJL...". Whitespace in the file is ignored.
+    The sequence is repeated once it has been used up.
+    """
+
+    def __init__(self, path):
+        with open(path) as sequence_file:
+            self.sequence = [
+                shape for shape in sequence_file.read().upper() if not shape.isspace()
+            ]
+        if not self.sequence:
+            raise ValueError("{} contains no shapes".format(path))
+        for shape in self.sequence:
+            if shape not in Tetromino.SHAPES:
+                raise ValueError("Type {} not recognised".format(shape))
+
+    def get_chunk(self):
+        """Return a list of the next shapes in the sequence"""
+        return list(self.sequence)
+
+
+RANDOMISERS = {"uniform": UniformRandomiser, "bag": BagRandomiser}
+
+
+def get_randomiser(name, rng):
+    """
+    Return the randomiser with the given name, using rng as its random number generator. Any name that isn't a
+    randomiser name is treated as the path of a sequence file.
+    """
+    if name in RANDOMISERS:
+        return RANDOMISERS[name](rng)
+    return SequenceRandomiser(name)
+
+
+if __name__ == "__main__":
+    print("".join(get_randomiser("bag", random.Random(0)).get_chunk()))
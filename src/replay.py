@@ -0,0 +1,266 @@
+#!usr/bin/env python3
+# Record games to a compact binary replay file, and read them back from any turn
+
+import numpy as np
+
+from .playfield import Playfield
+from .tetromino import Tetromino
+
+FORMAT_VERSION = 2
+MOVES_MAGIC = b"TBRM"
+CHECKPOINTS_MAGIC = b"TBRC"
+# The checkpoints of a replay are stored next to the moves, in a file with this suffix
+CHECKPOINTS_SUFFIX = ".ckpt"
+
+# Both files start with this header, followed by back to back records
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S4"),
+        ("version", "<u2"),
+        ("record_size", "<u2"),
+        ("checkpoint_interval", "<u4"),
+        ("reserved", "<u4"),
+    ]
+)
+
+# One record per turn. Shapes are stored as their grid values, i.e. one more than their index in Tetromino.SHAPES,
+# and 0 means no tetromino. held is the tetromino held at the start of the turn. row is the row the tetromino was
+# locked at, which is its drop row unless it was tucked or spun under an overhang.
+MOVE_DTYPE = np.dtype(
+    [
+        ("current", "u1"),
+        ("held", "u1"),
+        ("hold_swap", "u1"),
+        ("rotations", "u1"),
+        ("col", "i1"),
+        ("row", "i1"),
+    ]
+)
+
+# The playfield at the start of every checkpoint_interval turns
+CHECKPOINT_DTYPE = np.dtype(
+    [
+        ("turn", "<u8"),
+        ("num_blocks_placed", "<u8"),
+        ("num_rows_cleared", "<u8"),
+        ("grid", "u1", (Playfield.MAIN_BOX_HEIGHT, Playfield.MAIN_BOX_WIDTH)),
+    ]
+)
+
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+# Number of moves buffered in memory before they are written
+BUFFER_MOVES = 4096
+
+
+def get_shape_code(tetromino):
+    """Return the code stored in a move record for the tetromino, which may be None"""
+    if tetromino is None:
+        return 0
+    return Tetromino.SHAPES.index(tetromino.shape) + 1
+
+
+def get_shape(code):
+    """Return the shape for a code stored in a move record, or None for no tetromino"""
+    if code == 0:
+        return None
+    return Tetromino.SHAPES[code - 1]
+
+
+def _make_header_(magic, record_size, checkpoint_interval):
+    header = np.zeros((), HEADER_DTYPE)
+    header["magic"] = magic
+    header["version"] = FORMAT_VERSION
+    header["record_size"] = record_size
+    header["checkpoint_interval"] = checkpoint_interval
+    return header.tobytes()
+
+
+def _map_records_(path, magic, dtype):
+    """
+    Return the header and a read-only memory map of the records in the file. An incomplete record at the end of
+    the file, e.g. from a writer that was killed, is ignored.
+    """
+    header = np.fromfile(path, HEADER_DTYPE, count=1)
+    if header.size == 0 or header[0]["magic"] != magic:
+        raise ValueError("{} is not a replay file".format(path))
+    header = header[0]
+    if header["version"] != FORMAT_VERSION or header["record_size"] != dtype.itemsize:
+        raise ValueError(
+            "{} has unsupported replay format version {}".format(
+                path, header["version"]
+            )
+        )
+    with open(path, "rb") as replay_file:
+        num_records = (replay_file.seek(0, 2) - HEADER_DTYPE.itemsize) // dtype.itemsize
+    if num_records == 0:
+        # Empty files can't be memory mapped
+        return header, np.zeros(0, dtype)
+    records = np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=HEADER_DTYPE.itemsize,
+        shape=(num_records,),
+    )
+    return header, records
+
+
+class ReplayWriter:
+    """
+    Streaming, append-only writer of a replay. Call record with the game and the chosen outcome before every turn
+    is executed, e.g. by passing the writer as the recorder of a Game, and close the writer when the game ends.
+    Moves are buffered and written in blocks, and a checkpoint of the playfield is written every
+    checkpoint_interval turns, so memory use doesn't grow with the length of the game.
+    """
+
+    def __init__(self, path, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.num_moves = 0
+        self.moves_file = open(path, "wb")
+        self.moves_file.write(
+            _make_header_(MOVES_MAGIC, MOVE_DTYPE.itemsize, checkpoint_interval)
+        )
+        self.checkpoints_file = open(path + CHECKPOINTS_SUFFIX, "wb")
+        self.checkpoints_file.write(
+            _make_header_(
+                CHECKPOINTS_MAGIC, CHECKPOINT_DTYPE.itemsize, checkpoint_interval
+            )
+        )
+        self.buffer = np.zeros(BUFFER_MOVES, MOVE_DTYPE)
+        self.buffer_length = 0
+        self.checkpoint = np.zeros((), CHECKPOINT_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, game, outcome):
+        """
+        Record the outcome chosen for the current turn of the game. This must be called before the outcome is
+        executed.
+        """
+        if self.num_moves % self.checkpoint_interval == 0:
+            self._write_checkpoint_(game.playfield)
+        self.buffer[self.buffer_length] = (
+            get_shape_code(game.current_tetromino),
+            get_shape_code(game.holder.held_tetromino),
+            outcome["hold_swap"],
+            outcome["rotations"],
+            outcome["col"],
+            outcome["row"],
+        )
+        self.buffer_length += 1
+        self.num_moves += 1
+        if self.buffer_length == BUFFER_MOVES:
+            self.flush()
+
+    def _write_checkpoint_(self, playfield):
+        self.checkpoint["turn"] = self.num_moves
+        self.checkpoint["num_blocks_placed"] = playfield.num_blocks_placed
+        self.checkpoint["num_rows_cleared"] = playfield.num_rows_cleared
+        self.checkpoint["grid"] = playfield.grid
+        self.checkpoints_file.write(self.checkpoint.tobytes())
+
+    def flush(self):
+        """Write the buffered moves and checkpoints to disk"""
+        self.moves_file.write(self.buffer[: self.buffer_length].tobytes())
+        self.buffer_length = 0
+        self.moves_file.flush()
+        self.checkpoints_file.flush()
+
+    def close(self):
+        if self.moves_file.closed:
+            return
+        self.flush()
+        self.moves_file.close()
+        self.checkpoints_file.close()
+
+
+class ReplayReader:
+    """
+    Read a replay written by ReplayWriter. The moves and checkpoints are memory mapped, so opening a replay is fast
+    regardless of its length, and the playfield at any turn is rebuilt from the nearest checkpoint at or before that
+    turn rather than from the start of the game.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header, self.moves = _map_records_(path, MOVES_MAGIC, MOVE_DTYPE)
+        self.checkpoint_interval = int(header["checkpoint_interval"])
+        _, self.checkpoints = _map_records_(
+            path + CHECKPOINTS_SUFFIX, CHECKPOINTS_MAGIC, CHECKPOINT_DTYPE
+        )
+
+    def __len__(self):
+        return len(self.moves)
+
+    def get_move(self, turn):
+        """
+        Return a dictionary of the move made on the turn, with the shapes of the current and held tetrominoes at the
+        start of the turn.
+        """
+        move = self.moves[turn]
+        return {
+            "current": get_shape(move["current"]),
+            "held": get_shape(move["held"]),
+            "hold_swap": bool(move["hold_swap"]),
+            "rotations": int(move["rotations"]),
+            "col": int(move["col"]),
+            "row": int(move["row"]),
+        }
+
+    def get_playfield(self, turn, playfield_class=Playfield):
+        """
+        Return the playfield at the start of the turn, i.e. after turn moves have been made. A turn equal to the
+        number of moves gives the final playfield.
+        """
+        if not 0 <= turn <= len(self.moves):
+            raise IndexError("turn {} is out of range".format(turn))
+        index = np.searchsorted(self.checkpoints["turn"], turn, side="right") - 1
+        if index < 0:
+            raise ValueError(
+                "{} has no checkpoint before turn {}".format(self.path, turn)
+            )
+        checkpoint = self.checkpoints[index]
+        playfield = playfield_class(np.array(checkpoint["grid"]))
+        playfield.num_blocks_placed = int(checkpoint["num_blocks_placed"])
+        playfield.num_rows_cleared = int(checkpoint["num_rows_cleared"])
+        for move in self.moves[int(checkpoint["turn"]) : turn].tolist():
+            apply_move(playfield, *move)
+        return playfield
+
+
+def apply_move(playfield, current, held, hold_swap, rotations, col, row):
+    """
+    Make the move described by the fields of a move record on the playfield, in the same way as
+    Playfield.execute_outcome. Locking the tetromino at its recorded row gives the same playfield as dropping it,
+    unless it was tucked under an overhang. Return the row, or None if no tetromino was placed.
+    """
+    shape = get_shape(held if hold_swap else current)
+    if shape is None:
+        return None
+    playfield.place_tetromino(Tetromino(shape, rotations), row, col)
+    return row
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    from .game import Game
+    from .solver import Solver
+
+    path = os.path.join(tempfile.mkdtemp(), "game.replay")
+    solver = Solver()
+    with ReplayWriter(path, checkpoint_interval=20) as writer:
+        game = Game(seed=0, recorder=writer)
+        while not game.is_over() and game.playfield.num_blocks_placed < 100:
+            game.next_turn(solver.decide_outcome(game))
+    reader = ReplayReader(path)
+    print("{} moves, {} checkpoints".format(len(reader), len(reader.checkpoints)))
+    assert (reader.get_playfield(len(reader)).grid == game.playfield.grid).all()
+    print(reader.get_move(50))
+    print(reader.get_playfield(50))
@@ -0,0 +1,324 @@
+#!usr/bin/env python3
+# Play many seeded games without a display, spread across processes, and summarise the results
+
+import functools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+
+import numpy as np
+
+from . import kernel
+from .evaluation_cache import EvaluationCache
+from .game import PLAYFIELD_CLASSES, Game
+from .instrumentation import PROFILER
+from .opening_book import BookBuilder, OpeningBook, get_book_settings
+from .replay import ReplayWriter
+from .search import BeamSearch
+from .shared_evaluator import SharedEvaluator
+from .solver import Solver
+from .training_export import TrainingExporter
+
+# Latency percentiles reported by summarise
+LATENCY_PERCENTILES = [50, 90, 99]
+
+# The shared evaluator of this process and the (weights, workers) it was started with, set by get_shared_evaluator
+_shared_evaluator = None
+_shared_evaluator_key = None
+
+
+def _close_shared_evaluator_():
+    """Stop the shared evaluator of this process, if there is one"""
+    global _shared_evaluator, _shared_evaluator_key
+    if _shared_evaluator is not None:
+        _shared_evaluator.close()
+    _shared_evaluator = None
+    _shared_evaluator_key = None
+
+
+def _forget_shared_evaluator_():
+    """Drop the shared evaluator inherited by a forked child, whose workers and shared memory belong to the parent"""
+    global _shared_evaluator, _shared_evaluator_key
+    if _shared_evaluator is not None:
+        _shared_evaluator._finalizer.detach()
+    _shared_evaluator = None
+    _shared_evaluator_key = None
+
+
+os.register_at_fork(after_in_child=_forget_shared_evaluator_)
+
+
+def get_shared_evaluator(weights, workers):
+    """
+    Return this process's shared_evaluator.SharedEvaluator with the given weights and number of workers, starting it
+    on first use. Every game played by the process reuses the same workers and shared memory, which are released when
+    the process exits, including the worker processes of run_games. Asking for different weights or workers replaces
+    the evaluator.
+    """
+    global _shared_evaluator, _shared_evaluator_key
+    key = (tuple(sorted(weights.items())), workers)
+    if _shared_evaluator is not None and _shared_evaluator_key == key:
+        return _shared_evaluator
+    if _shared_evaluator is None:
+        # multiprocessing's exit finalizers also run in pool workers, unlike atexit. This one must run before the
+        # finalizers of the executor's queues, which have a priority of 10, or shutting down the workers hangs
+        util.Finalize(None, _close_shared_evaluator_, exitpriority=100)
+    else:
+        _shared_evaluator.close()
+    _shared_evaluator = SharedEvaluator(weights, workers)
+    _shared_evaluator_key = key
+    return _shared_evaluator
+
+
+def make_solver(
+    depth=1,
+    beam_width=8,
+    cache_bytes=None,
+    weights=None,
+    backend=None,
+    reachability=False,
+    eval_workers=0,
+    book_path=None,
+    prune=False,
+):
+    """
+    Return a Solver configured with the given options. A depth of 1 gives the greedy solver. weights is an optional
+    dictionary of weights and reachability enables tucks and spins, see Solver. If backend is
+    given, it selects the placement backend for the whole process, see kernel.BACKENDS. If eval_workers is positive,
+    large batches are evaluated by that many worker processes through shared memory, which are shared by every solver
+    of the process, see get_shared_evaluator. If book_path is given, the solver plays the moves of that opening book
+    wherever it has one. ValueError is raised if the book was built by a solver with other settings, see
+    opening_book.OpeningBook. prune lets the greedy solver measure most outcomes from board statistics, see
+    Solver.evaluate_pruned_outcomes.
+    """
+    if backend is not None:
+        kernel.set_backend(backend)
+    search = BeamSearch(depth, beam_width) if depth > 1 else None
+    cache = EvaluationCache(cache_bytes) if cache_bytes else None
+    evaluator = None
+    if eval_workers:
+        evaluator = get_shared_evaluator(
+            weights if weights is not None else Solver.WEIGHTS, eval_workers
+        )
+    solver = Solver(search, cache, weights, reachability, evaluator, None, prune)
+    if book_path is not None:
+        solver.book = OpeningBook(book_path, get_book_settings(solver))
+    return solver
+
+
+def play_game(
+    seed,
+    max_pieces=None,
+    randomiser="uniform",
+    playfield="numpy",
+    profile_path=None,
+    replay_path=None,
+    export_path=None,
+    move_deadline=None,
+    build_book=False,
+    **solver_options
+):
+    """
+    Play a single game with the given seed until it is over or max_pieces tetrominoes have been placed, on the
+    playfield backend named by playfield, see game.PLAYFIELD_CLASSES. Return a dictionary of results, including the time taken to decide each move. If move_deadline is given, each move must
+    be decided within that many seconds, see Solver.decide_outcome, and the results include the deadline counters.
+    If profile_path is given, profiling events are appended to that file as JSON lines. Any "{pid}" in profile_path
+    is replaced with the process ID. If replay_path is given, the game is recorded to that replay file, see
+    replay.ReplayWriter. Any "{seed}" in replay_path is replaced with the seed. If export_path is given, every
+    decision is exported as training data in the same way, see training_export.TrainingExporter. If build_book is
+    true, every move is counted for an opening book, and the results include the counts and the solver's book
+    settings, see opening_book.BookBuilder. If the solver has a book, the results include its hit counters.
+    """
+    if profile_path is not None:
+        PROFILER.enable(open(profile_path.format(pid=os.getpid()), "a"))
+    recorder = None
+    exporter = None
+    try:
+        if replay_path is not None:
+            recorder = ReplayWriter(replay_path.format(seed=seed))
+        if export_path is not None:
+            exporter = TrainingExporter(export_path.format(seed=seed))
+        solver = make_solver(**solver_options)
+        if exporter is not None:
+            # Exported candidates need every feature measured, and book moves aren't evaluated at all
+            solver.book = None
+        builder = BookBuilder(get_book_settings(solver)) if build_book else None
+        game = Game(
+            PLAYFIELD_CLASSES[playfield],
+            seed=seed,
+            randomiser=randomiser,
+            recorder=recorder,
+        )
+        latencies = []
+        start_time = time.perf_counter()
+        while not game.is_over():
+            if (
+                max_pieces is not None
+                and game.playfield.num_blocks_placed >= max_pieces
+            ):
+                break
+            ban_hold = solver.ban_hold
+            move_start = time.perf_counter()
+            deadline = move_start + move_deadline if move_deadline is not None else None
+            chosen_outcome = solver.decide_outcome(game, deadline)
+            latencies.append(time.perf_counter() - move_start)
+            if builder is not None:
+                builder.record(game, chosen_outcome, ban_hold)
+            if exporter is not None:
+                exporter.record(game, solver)
+            game.next_turn(chosen_outcome)
+    finally:
+        # Everything is closed even if the game raises, so the replay, the exported shards and the profiling events
+        # are complete up to the failure. The evaluator is kept for the next game, see get_shared_evaluator
+        if recorder is not None:
+            recorder.close()
+        if exporter is not None:
+            exporter.close()
+        if profile_path is not None:
+            sink = PROFILER.sink
+            PROFILER.disable()
+            sink.close()
+    results = {
+        "seed": seed,
+        "pieces": game.playfield.num_blocks_placed,
+        "rows_cleared": int(game.playfield.num_rows_cleared),
+        "game_over": game.is_over(),
+        "time": time.perf_counter() - start_time,
+        "latencies": np.array(latencies, dtype=np.float32),
+    }
+    if move_deadline is not None:
+        results["deadline_counts"] = {
+            name: value
+            for name, value in solver.get_deadline_stats().items()
+            if not name.endswith("_rate")
+        }
+    if builder is not None:
+        results["book_counts"] = builder.counts
+        results["book_settings"] = builder.settings
+    if solver.book is not None:
+        results["book_hits"] = solver.book.hits
+        results["book_misses"] = solver.book.misses
+    return results
+
+
+def run_games(
+    num_games,
+    workers=None,
+    max_pieces=None,
+    seed_start=0,
+    randomiser="uniform",
+    playfield="numpy",
+    profile_path=None,
+    replay_path=None,
+    export_path=None,
+    move_deadline=None,
+    build_book=False,
+    **solver_options
+):
+    """
+    Play num_games games with consecutive seeds starting at seed_start, spread over workers processes. If workers
+    is 1, the games are played in this process. Return the list of results from play_game, ordered by seed. If
+    profile_path is given, each process appends profiling events to its own file, named profile_path.<pid>. If
+    replay_path is given, each game is recorded to its own replay file, named replay_path.<seed>, and likewise if
+    export_path is given, each game's training data is exported to shards named export_path.<seed>.<shard>.npz.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    if profile_path is not None and workers != 1:
+        profile_path += ".{pid}"
+    if replay_path is not None and "{seed}" not in replay_path:
+        replay_path += ".{seed}"
+    if export_path is not None and "{seed}" not in export_path:
+        export_path += ".{seed}"
+    seeds = range(seed_start, seed_start + num_games)
+    play = functools.partial(
+        play_game,
+        max_pieces=max_pieces,
+        randomiser=randomiser,
+        playfield=playfield,
+        profile_path=profile_path,
+        replay_path=replay_path,
+        export_path=export_path,
+        move_deadline=move_deadline,
+        build_book=build_book,
+        **solver_options
+    )
+    if workers == 1:
+        return [play(seed) for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Send the seeds in chunks to reduce the inter-process overhead for short games
+        chunksize = max(1, num_games // (4 * workers))
+        return list(executor.map(play, seeds, chunksize=chunksize))
+
+
+def summarise(results, wall_time):
+    """
+    Return a dictionary of summary statistics for a list of results from play_game, which took wall_time seconds
+    to play in total. An empty list of results gives zero counts.
+    """
+    pieces = np.array([result["pieces"] for result in results], dtype=np.int64)
+    rows_cleared = np.array(
+        [result["rows_cleared"] for result in results], dtype=np.int64
+    )
+    latencies = np.concatenate(
+        [result["latencies"] for result in results] + [np.zeros(0, np.float32)]
+    )
+    summary = {
+        "games": len(results),
+        "games_over": sum(result["game_over"] for result in results),
+        "pieces_total": int(pieces.sum()),
+        "pieces_mean": float(pieces.mean()) if results else 0.0,
+        "rows_cleared_total": int(rows_cleared.sum()),
+        "rows_cleared_mean": float(rows_cleared.mean()) if results else 0.0,
+        "wall_time": wall_time,
+        "games_per_sec": len(results) / wall_time,
+        "pieces_per_sec": float(pieces.sum()) / wall_time,
+    }
+    if latencies.size:
+        for percentile, value in zip(
+            LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES)
+        ):
+            summary["latency_p{}_ms".format(percentile)] = float(value) * 1000
+        summary["latency_max_ms"] = float(latencies.max()) * 1000
+    if results and "deadline_counts" in results[0]:
+        counts = {}
+        for result in results:
+            for name, value in result["deadline_counts"].items():
+                counts[name] = counts.get(name, 0) + value
+        decisions = counts["deadline_decisions"]
+        if decisions:
+            summary["deadline_cut_short_rate"] = (
+                counts["deadline_cut_short"] / decisions
+            )
+            summary["deadline_missed_rate"] = counts["deadline_missed"] / decisions
+        for name in ["deadline_decisions", "deadline_cut_short", "deadline_missed"]:
+            summary[name] = counts.pop(name)
+        # The rest are the numbers of decisions that searched to each depth
+        for name in sorted(counts, key=lambda name: int(name.rsplit("_", 1)[1])):
+            summary[name] = counts[name]
+    if results and "book_hits" in results[0]:
+        hits = sum(result["book_hits"] for result in results)
+        lookups = hits + sum(result["book_misses"] for result in results)
+        summary["book_hits"] = hits
+        summary["book_hit_rate"] = hits / lookups if lookups else 0.0
+    return summary
+
+
+def format_summary(summary):
+    """
+    Return the summary as a string with one statistic per line.
+    """
+    width = max(len(name) for name in summary)
+    lines = []
+    for name, value in summary.items():
+        if isinstance(value, float):
+            value = "{:.3f}".format(value)
+        lines.append("{} = {}".format(name.ljust(width), value))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    results = run_games(4, workers=1, max_pieces=100)
+    print(format_summary(summarise(results, time.perf_counter() - start)))
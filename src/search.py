@@ -0,0 +1,401 @@
+#!usr/bin/env python3
+# Look ahead through the tetromino queue with a beam search, to choose placements that set up good future placements.
+
+import time
+
+import numpy as np
+
+from . import batch_evaluator
+
+
+class BeamSearch:
+    """
+    Chain placements of the current tetromino and the tetrominoes in the queue, optionally swapping with the held
+    tetromino at each step. At each depth, every node in the beam is expanded in a single batch evaluation and only
+    the beam_width nodes with the lowest cumulative cost are kept.
+    """
+
+    # Cost added to any placement that ends the game, so that the search avoids it whenever possible
+    GAME_OVER_COST = 10000
+    # Number of beam nodes expanded per batch when searching to a deadline, so that the deadline is checked often
+    # enough to stop a slow expansion, e.g. one with no cache hits, before it overruns
+    DEADLINE_CHUNK_NODES = 2
+
+    def __init__(self, depth=2, beam_width=8, time_budget=None, node_budget=None):
+        """
+        depth is the number of tetrominoes to place, including the current tetromino. time_budget is the time
+        allowed per move in seconds and node_budget is the number of placements allowed to be evaluated per move. When
+        either budget would be exceeded, the search stops at the deepest depth reached so far.
+        """
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        if beam_width < 1:
+            raise ValueError("beam_width must be at least 1")
+        self.depth = depth
+        self.beam_width = beam_width
+        self.time_budget = time_budget
+        self.node_budget = node_budget
+        # Statistics about the last search
+        self.last_depth = 0
+        self.last_node_count = 0
+        self.last_budget_hit = False
+
+    def _expand_(self, solver, boards, held_shapes, shape, allow_swap):
+        """
+        Evaluate every placement of every node, where each node places either the shape or its held shape. Return
+        the features, boards and costs of the placements, and whether each placement swapped with the held shape.
+        """
+        return self._expand_nodes_(
+            solver,
+            boards,
+            held_shapes,
+            [shape] * len(held_shapes),
+            [allow_swap] * len(held_shapes),
+        )
+
+    @staticmethod
+    def _expand_nodes_(solver, boards, held_shapes, node_shapes, allow_swaps):
+        """
+        Expand nodes in the same way as _expand_, where each node has its own shape and may or may not swap with its
+        held shape, e.g. the nodes of several searches.
+        """
+        bases = []
+        shapes = []
+        hold_swaps = []
+        for node, (held_shape, shape, allow_swap) in enumerate(
+            zip(held_shapes, node_shapes, allow_swaps)
+        ):
+            bases.append(node)
+            shapes.append(shape)
+            hold_swaps.append(False)
+            if allow_swap and held_shape is not None:
+                bases.append(node)
+                shapes.append(held_shape)
+                hold_swaps.append(True)
+        features, child_boards, costs = batch_evaluator.evaluate_shapes(
+            boards,
+            bases,
+            shapes,
+            solver.cache,
+            solver.feature_names,
+            solver.evaluator,
+        )
+        features["hold_swap"] = np.repeat(
+            hold_swaps,
+            [len(batch_evaluator.get_candidates(shape)[1]) for shape in shapes],
+        )
+        # A shared evaluator's workers have already scored the placements
+        if costs is None:
+            costs = solver.get_outcome_costs(features)
+        return features, child_boards, costs
+
+    @staticmethod
+    def _count_children_(held_shapes, shape):
+        """
+        Return the number of placements that expanding nodes with the held shapes evaluates, with hold swaps. Nodes
+        without a held shape only place the shape, as in _expand_.
+        """
+        return sum(
+            len(batch_evaluator.get_candidates(node_shape)[1])
+            for held_shape in held_shapes
+            for node_shape in (shape, held_shape)
+            if node_shape is not None
+        )
+
+    def _expand_to_deadline_(
+        self, solver, boards, held_shapes, shape, deadline, time_per_child
+    ):
+        """
+        Expand the nodes in the same way as _expand_ with hold swaps, a few nodes at a time. time_per_child is the
+        expected time to evaluate a placement, which is updated as each chunk is expanded. Return None as soon as a
+        chunk is predicted to finish after the deadline, or if the last chunk finishes after it, since a partly
+        expanded depth can't be compared with the previous depth.
+        """
+        features = []
+        child_boards = []
+        costs = []
+        for start in range(0, len(held_shapes), self.DEADLINE_CHUNK_NODES):
+            stop = start + self.DEADLINE_CHUNK_NODES
+            chunk_start = time.perf_counter()
+            num_children = self._count_children_(held_shapes[start:stop], shape)
+            if chunk_start + time_per_child * num_children > deadline:
+                return None
+            chunk_features, chunk_boards, chunk_costs = self._expand_(
+                solver, boards[start:stop], held_shapes[start:stop], shape, True
+            )
+            time_per_child = (time.perf_counter() - chunk_start) / num_children
+            chunk_features["base"] += start
+            features.append(chunk_features)
+            child_boards.append(chunk_boards)
+            costs.append(chunk_costs)
+        if time.perf_counter() > deadline:
+            return None
+        return (
+            np.concatenate(features),
+            np.concatenate(child_boards),
+            np.concatenate(costs),
+        )
+
+    def _select_(self, costs, boards, held_shapes):
+        """
+        Return the indices of the beam_width lowest cost nodes, skipping nodes with an identical board and held
+        shape to a lower cost node. Ties keep the earliest node.
+        """
+        selected = []
+        seen = set()
+        for index in np.argsort(costs, kind="stable"):
+            key = (boards[index].tobytes(), held_shapes[index])
+            if key in seen:
+                continue
+            seen.add(key)
+            selected.append(index)
+            if len(selected) == self.beam_width:
+                break
+        return np.array(selected, dtype=np.int64)
+
+    def search(
+        self,
+        solver,
+        playfield,
+        current_tetromino,
+        held_tetromino,
+        queue,
+        deadline=None,
+        ban_hold=None,
+    ):
+        """
+        Search for the best placement of the current tetromino. queue is the list of upcoming tetrominoes. Return the
+        batch_evaluator.FEATURE_DTYPE array of the possible first placements, their costs when placed on their own,
+        and the index of the first placement of the best sequence found.
+
+        If deadline is given, as a time.perf_counter() time, the search is anytime: the first depth, which gives the
+        greedy placement, is always searched, and each deeper depth is only kept if it is fully searched before the
+        deadline. Otherwise the best placement of the deepest complete depth is returned.
+
+        ban_hold is whether the first placement may not swap in the held tetromino, defaulting to solver.ban_hold.
+        """
+        start_time = time.perf_counter()
+        if self.time_budget is not None:
+            budget_deadline = start_time + self.time_budget
+            deadline = (
+                budget_deadline if deadline is None else min(deadline, budget_deadline)
+            )
+        shapes = [current_tetromino.shape] + [tetromino.shape for tetromino in queue]
+        max_depth = min(self.depth, len(shapes))
+
+        # Expand the root playfield
+        boards = playfield.grid[None]
+        held_shapes = [held_tetromino.shape if held_tetromino is not None else None]
+        if ban_hold is None:
+            ban_hold = solver.ban_hold
+        root_features, boards, root_costs = self._expand_(
+            solver, boards, held_shapes, shapes[0], not ban_hold
+        )
+        hold_swaps = root_features["hold_swap"]
+        costs = root_costs + self.GAME_OVER_COST * boards[:, 0, :].any(axis=1)
+        held_shapes = [
+            shapes[0] if hold_swap else held_shapes[0] for hold_swap in hold_swaps
+        ]
+        roots = np.arange(len(root_features))
+        node_count = len(root_features)
+        depth = 1
+        budget_hit = False
+        expansion_time = time.perf_counter() - start_time
+        expansion_size = node_count
+
+        while depth < max_depth:
+            beam = self._select_(costs, boards, held_shapes)
+            beam_held_shapes = [held_shapes[index] for index in beam]
+            # Stop if expanding the next depth would exceed the node budget. The deadline is checked chunk by chunk in
+            # _expand_to_deadline_, starting from the time per node of the previous expansion, which overestimates
+            # the time of deeper depths as they hit the cache more often
+            num_children = self._count_children_(beam_held_shapes, shapes[depth])
+            time_per_child = expansion_time / expansion_size
+            if (
+                self.node_budget is not None
+                and node_count + num_children > self.node_budget
+            ):
+                budget_hit = True
+                break
+            expansion_start = time.perf_counter()
+            if deadline is not None:
+                expanded = self._expand_to_deadline_(
+                    solver,
+                    boards[beam],
+                    beam_held_shapes,
+                    shapes[depth],
+                    deadline,
+                    time_per_child,
+                )
+                if expanded is None:
+                    budget_hit = True
+                    break
+                features, child_boards, child_costs = expanded
+            else:
+                features, child_boards, child_costs = self._expand_(
+                    solver, boards[beam], beam_held_shapes, shapes[depth], True
+                )
+            hold_swaps = features["hold_swap"]
+            parents = beam[features["base"]]
+            costs = (
+                costs[parents]
+                + child_costs
+                + self.GAME_OVER_COST * child_boards[:, 0, :].any(axis=1)
+            )
+            held_shapes = [
+                shapes[depth] if hold_swap else held_shapes[parent]
+                for parent, hold_swap in zip(parents, hold_swaps)
+            ]
+            boards = child_boards
+            roots = roots[parents]
+            node_count += len(features)
+            expansion_time = time.perf_counter() - expansion_start
+            expansion_size = len(features)
+            depth += 1
+
+        self.last_depth = depth
+        self.last_node_count = node_count
+        self.last_budget_hit = budget_hit
+        # argmin returns the earliest of the lowest cost nodes, which descends from the earliest root
+        return root_features, root_costs, roots[np.argmin(costs)]
+
+    def search_many(self, solver, problems):
+        """
+        Search several independent problems together, e.g. the requests of a service batch. problems is a list of
+        (playfield, current_tetromino, held_tetromino, queue, ban_hold) tuples, and a list of what search returns
+        for each problem is returned, with the same results as searching them one at a time. Each depth of every
+        problem is expanded in a single batch evaluation. The node budget applies to each problem on its own, and
+        problems are searched one at a time if there is a time budget. The statistics cover all of the problems.
+        """
+        if not problems:
+            return []
+        if self.time_budget is not None:
+            return [
+                self.search(solver, playfield, current, held, queue, ban_hold=ban_hold)
+                for playfield, current, held, queue, ban_hold in problems
+            ]
+        searches = []
+        for playfield, current, held, queue, ban_hold in problems:
+            shapes = [current.shape] + [tetromino.shape for tetromino in queue]
+            searches.append(
+                {
+                    "shapes": shapes,
+                    "max_depth": min(self.depth, len(shapes)),
+                    "held_shapes": [held.shape if held is not None else None],
+                    "allow_swap": not (
+                        solver.ban_hold if ban_hold is None else ban_hold
+                    ),
+                    "depth": 1,
+                    "budget_hit": False,
+                }
+            )
+
+        # Expand the root playfields
+        features, boards, costs = self._expand_nodes_(
+            solver,
+            np.stack([playfield.grid for playfield, *_ in problems]),
+            [state["held_shapes"][0] for state in searches],
+            [state["shapes"][0] for state in searches],
+            [state["allow_swap"] for state in searches],
+        )
+        splits = np.searchsorted(features["base"], np.arange(1, len(searches)))
+        for index, (state, root_features, root_boards, root_costs) in enumerate(
+            zip(
+                searches,
+                np.split(features, splits),
+                np.split(boards, splits),
+                np.split(costs, splits),
+            )
+        ):
+            root_features["base"] -= index
+            state["root_features"] = root_features
+            state["root_costs"] = root_costs
+            state["costs"] = state["root_costs"] + self.GAME_OVER_COST * root_boards[
+                :, 0, :
+            ].any(axis=1)
+            state["boards"] = root_boards
+            state["held_shapes"] = [
+                state["shapes"][0] if hold_swap else state["held_shapes"][0]
+                for hold_swap in root_features["hold_swap"]
+            ]
+            state["roots"] = np.arange(len(root_features))
+            state["node_count"] = len(root_features)
+
+        while True:
+            # Select the beam of every search that goes deeper, as in search
+            expanding = []
+            for state in searches:
+                if state["budget_hit"] or state["depth"] >= state["max_depth"]:
+                    continue
+                beam = self._select_(
+                    state["costs"], state["boards"], state["held_shapes"]
+                )
+                beam_held_shapes = [state["held_shapes"][index] for index in beam]
+                num_children = self._count_children_(
+                    beam_held_shapes, state["shapes"][state["depth"]]
+                )
+                if (
+                    self.node_budget is not None
+                    and state["node_count"] + num_children > self.node_budget
+                ):
+                    state["budget_hit"] = True
+                    continue
+                expanding.append((state, beam, beam_held_shapes))
+            if not expanding:
+                break
+            features, child_boards, child_costs = self._expand_nodes_(
+                solver,
+                np.concatenate([state["boards"][beam] for state, beam, _ in expanding]),
+                [shape for _, _, held_shapes in expanding for shape in held_shapes],
+                [
+                    state["shapes"][state["depth"]]
+                    for state, beam, _ in expanding
+                    for _ in beam
+                ],
+                [True] * sum(len(beam) for _, beam, _ in expanding),
+            )
+            offsets = np.cumsum([len(beam) for _, beam, _ in expanding])
+            splits = np.searchsorted(features["base"], offsets[:-1])
+            for (
+                (state, beam, _),
+                start,
+                search_features,
+                search_boards,
+                search_costs,
+            ) in zip(
+                expanding,
+                np.concatenate([[0], offsets[:-1]]),
+                np.split(features, splits),
+                np.split(child_boards, splits),
+                np.split(child_costs, splits),
+            ):
+                parents = beam[search_features["base"] - start]
+                state["costs"] = (
+                    state["costs"][parents]
+                    + search_costs
+                    + self.GAME_OVER_COST * search_boards[:, 0, :].any(axis=1)
+                )
+                state["held_shapes"] = [
+                    (
+                        state["shapes"][state["depth"]]
+                        if hold_swap
+                        else state["held_shapes"][parent]
+                    )
+                    for parent, hold_swap in zip(parents, search_features["hold_swap"])
+                ]
+                state["boards"] = search_boards
+                state["roots"] = state["roots"][parents]
+                state["node_count"] += len(search_features)
+                state["depth"] += 1
+
+        self.last_depth = max(state["depth"] for state in searches)
+        self.last_node_count = sum(state["node_count"] for state in searches)
+        self.last_budget_hit = any(state["budget_hit"] for state in searches)
+        return [
+            (
+                state["root_features"],
+                state["root_costs"],
+                state["roots"][np.argmin(state["costs"])],
+            )
+            for state in searches
+        ]
@@ -0,0 +1,446 @@
+#!usr/bin/env python3
+# Long-lived solver server that answers move requests from many clients over a Unix socket, batching concurrent requests
+
+import asyncio
+import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import batch_evaluator
+from .outcome import BoardSnapshot, Outcome
+from .playfield import Playfield
+from .runner import LATENCY_PERCENTILES, make_solver
+from .tetromino import Tetromino
+
+HEIGHT = Playfield.MAIN_BOX_HEIGHT
+WIDTH = Playfield.MAIN_BOX_WIDTH
+
+# Most requests evaluated in a single batch
+DEFAULT_MAX_BATCH = 64
+# Number of recent request latencies kept for the stats command
+LATENCY_WINDOW = 10000
+
+
+class MoveRequest:
+    """
+    A parsed move request. board is the (HEIGHT, WIDTH) playfield grid, current and held are shapes from
+    Tetromino.SHAPES (held may be None), queue is the list of upcoming shapes and ban_hold is true if the held
+    tetromino can't be swapped in this turn, i.e. the previous move swapped in an empty hold.
+    """
+
+    __slots__ = ("id", "board", "current", "held", "queue", "ban_hold", "received")
+
+    def __init__(self, message, received):
+        self.id = message.get("id")
+        self.board = np.asarray(message["board"], dtype=np.uint8)
+        if self.board.shape != (HEIGHT, WIDTH):
+            raise ValueError(
+                "board must have {} rows of {} blocks, not shape {}".format(
+                    HEIGHT, WIDTH, self.board.shape
+                )
+            )
+        self.current = _parse_shape_(message["current"])
+        self.held = _parse_shape_(message.get("held"))
+        self.queue = [_parse_shape_(shape) for shape in message.get("queue", [])]
+        self.ban_hold = bool(message.get("ban_hold", False))
+        self.received = received
+
+
+def _parse_shape_(shape):
+    if shape is None:
+        return None
+    if shape not in Tetromino.SHAPES:
+        raise ValueError(
+            "shape must be one of {}, not {!r}".format(
+                ", ".join(Tetromino.SHAPES), shape
+            )
+        )
+    return shape
+
+
+def evaluate_requests(solver, requests):
+    """
+    Evaluate every potential outcome of every request in a single batch, and return a list of the chosen outcome of
+    each request as a (FEATURE_DTYPE record, cost) pair. The outcomes of each request are ordered and scored as in
+    Solver.evaluate_outcomes, so each request gets the same move as Solver.decide_outcome would choose for a game in
+    the same state. If the solver has a search, requests with a current and held tetromino are searched together
+    instead, see BeamSearch.search_many.
+    """
+    bases = []
+    shapes = []
+    # The shapes evaluated for each request, and whether the request also has the outcome of swapping in an empty hold
+    request_shapes = []
+    searched = []
+    for index, request in enumerate(requests):
+        if (
+            solver.search is not None
+            and request.current is not None
+            and request.held is not None
+        ):
+            searched.append(index)
+            request_shapes.append(([], False))
+            continue
+        allow_hold = not request.ban_hold and request.current is not None
+        evaluated = [request.current] if request.current is not None else []
+        if allow_hold and request.held is not None:
+            evaluated.append(request.held)
+        request_shapes.append((evaluated, allow_hold and request.held is None))
+        bases += [index] * len(evaluated)
+        shapes += evaluated
+
+    if shapes:
+        grids = np.stack([request.board for request in requests])
+        features, _, _ = batch_evaluator.evaluate_shapes(
+            grids,
+            bases,
+            shapes,
+            solver.cache,
+            solver.feature_names,
+            solver.evaluator,
+        )
+    searched_results = {}
+    if searched:
+        searched_results = dict(
+            zip(
+                searched,
+                solver.search.search_many(
+                    solver,
+                    [
+                        (
+                            Playfield(requests[index].board),
+                            Tetromino(requests[index].current),
+                            Tetromino(requests[index].held),
+                            [Tetromino(shape) for shape in requests[index].queue],
+                            requests[index].ban_hold,
+                        )
+                        for index in searched
+                    ],
+                ),
+            )
+        )
+    chosen = []
+    start = 0
+    for index, (request, (evaluated, empty_hold)) in enumerate(
+        zip(requests, request_shapes)
+    ):
+        if index in searched_results:
+            features_searched, costs, best = searched_results[index]
+            chosen.append((features_searched[best], int(costs[best])))
+            continue
+        if request.current is None:
+            request_features = batch_evaluator.get_empty_features(False)
+        else:
+            sizes = [
+                len(batch_evaluator.get_candidates(shape)[1]) for shape in evaluated
+            ]
+            stop = start + sum(sizes)
+            request_features = features[start:stop]
+            # Every outcome after the current tetromino's outcomes is a hold swap
+            request_features["hold_swap"][sizes[0] :] = True
+            start = stop
+            if empty_hold:
+                request_features = np.concatenate(
+                    [request_features, batch_evaluator.get_empty_features(True)]
+                )
+        costs = solver.get_outcome_costs(request_features)
+        best = np.argmin(costs)
+        chosen.append((request_features[best], int(costs[best])))
+    return chosen
+
+
+def format_move(feature, cost):
+    """Return the move described by a FEATURE_DTYPE record as a JSON serialisable dictionary"""
+    if feature["placement"] < 0:
+        shape = None
+    else:
+        shape = batch_evaluator.PLACEMENT_KEYS[feature["placement"]][0]
+    return {
+        "shape": shape,
+        "hold_swap": bool(feature["hold_swap"]),
+        "rotations": int(feature["rotations"]),
+        "col": int(feature["col"]),
+        "row": int(feature["row"]),
+        "cost": cost,
+    }
+
+
+class SolverService:
+    """
+    Serve move requests over a Unix socket, as lines of JSON. Each request is a JSON object with a "board" (a list of
+    rows of grid values), a "current" shape, and optionally a "held" shape, a "queue" of shapes, "ban_hold" and an
+    "id" that is echoed in the response. The response is the chosen move (see format_move) along with the request's
+    latency from receipt to response in milliseconds, the number of requests waiting when it was batched and the size
+    of its batch, or an "error" if the request is invalid. A {"command": "stats"} request returns the service's
+    statistics instead.
+
+    Requests from every client go into a single queue. Whenever the solver is idle, every waiting request, up to
+    max_batch, is evaluated in a single batch in a worker thread, so the solver and its cache are shared by every
+    client and only used by one batch at a time.
+    """
+
+    def __init__(self, path, max_batch=DEFAULT_MAX_BATCH, **solver_options):
+        self.path = path
+        self.max_batch = max_batch
+        self.solver = make_solver(**solver_options)
+        if self.solver.reachability:
+            # Requests are evaluated in batches of hard drops, see evaluate_requests
+            raise ValueError("the solver service doesn't support reachability")
+        if self.solver.book is not None:
+            raise ValueError("the solver service doesn't support opening books")
+        self.requests = None
+        self.server = None
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_batches = 0
+        self.max_queue_depth = 0
+        self.latencies = []
+
+    async def start(self):
+        """Start listening on the socket, and return once the service is ready for clients"""
+        self.requests = asyncio.Queue()
+        self.server = await asyncio.start_unix_server(self._handle_client_, self.path)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batcher = asyncio.ensure_future(self._run_batches_())
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown()
+
+    async def _handle_client_(self, reader, writer):
+        """Read the client's requests, and write each response as soon as its batch is done"""
+        loop = asyncio.get_running_loop()
+        pending = set()
+        # Responses are written by separate tasks, so the lock stops their lines from interleaving
+        lock = asyncio.Lock()
+
+        async def respond(future):
+            response = await future
+            async with lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                received = time.perf_counter()
+                future = loop.create_future()
+                try:
+                    message = json.loads(line)
+                    if message.get("command") == "stats":
+                        future.set_result(self.get_stats())
+                    else:
+                        self.requests.put_nowait(
+                            (MoveRequest(message, received), future)
+                        )
+                except (
+                    ValueError,
+                    KeyError,
+                    TypeError,
+                    AttributeError,
+                    OverflowError,
+                ) as error:
+                    self.num_errors += 1
+                    future.set_result({"error": "invalid request: {}".format(error)})
+                task = asyncio.ensure_future(respond(future))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _run_batches_(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            queue_depth = self.requests.qsize() + 1
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            while len(batch) < self.max_batch and not self.requests.empty():
+                batch.append(self.requests.get_nowait())
+            requests = [request for request, _ in batch]
+            try:
+                chosen = await loop.run_in_executor(
+                    self.executor, evaluate_requests, self.solver, requests
+                )
+            except Exception as error:
+                # Never let one bad batch stop the service
+                for _, future in batch:
+                    future.set_result({"error": "evaluation failed: {}".format(error)})
+                continue
+            self.num_batches += 1
+            finished = time.perf_counter()
+            for (request, future), (feature, cost) in zip(batch, chosen):
+                latency = finished - request.received
+                self.latencies.append(latency)
+                response = format_move(feature, cost)
+                response.update(
+                    id=request.id,
+                    latency_ms=latency * 1000,
+                    queue_depth=queue_depth,
+                    batch_size=len(batch),
+                )
+                future.set_result(response)
+            self.num_requests += len(batch)
+            if len(self.latencies) > 2 * LATENCY_WINDOW:
+                del self.latencies[:-LATENCY_WINDOW]
+
+    def get_stats(self):
+        """Return a dictionary of statistics about the requests served so far"""
+        stats = {
+            "requests": self.num_requests,
+            "errors": self.num_errors,
+            "batches": self.num_batches,
+            "batch_size_mean": self.num_requests / max(self.num_batches, 1),
+            "queue_depth": self.requests.qsize(),
+            "queue_depth_max": self.max_queue_depth,
+        }
+        latencies = np.array(self.latencies[-LATENCY_WINDOW:])
+        if latencies.size:
+            for percentile, value in zip(
+                LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES)
+            ):
+                stats["latency_p{}_ms".format(percentile)] = float(value) * 1000
+            stats["latency_max_ms"] = float(latencies.max()) * 1000
+        return stats
+
+
+class SolverClient:
+    """
+    Blocking client of a SolverService, for game instances that don't need their own Solver. Requests are sent one
+    at a time, so each client has at most one request waiting. decide_outcome can be used in place of
+    Solver.decide_outcome to play a game, in which case the client tracks whether hold is banned, as Solver does.
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+        self.ban_hold = False
+        self.last_response = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, message):
+        """Send a request message and return the response"""
+        self.file.write(json.dumps(message).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def request_move(self, board, current, held=None, queue=(), ban_hold=False):
+        """Return the service's move for the board and shapes, see SolverService"""
+        return self.send(
+            {
+                "board": np.asarray(board).tolist(),
+                "current": current,
+                "held": held,
+                "queue": list(queue),
+                "ban_hold": ban_hold,
+            }
+        )
+
+    def decide_outcome(self, game):
+        """Return the Outcome chosen by the service for the current turn of the game"""
+        shapes = [
+            tetromino.shape if tetromino is not None else None
+            for tetromino in [game.current_tetromino, game.holder.held_tetromino]
+        ]
+        move = self.request_move(
+            game.playfield.grid,
+            *shapes,
+            [tetromino.shape for tetromino in game.tetromino_queue.queue],
+            self.ban_hold
+        )
+        self.last_response = move
+        outcome = Outcome(
+            BoardSnapshot.from_playfield(game.playfield),
+            move["shape"],
+            move["rotations"],
+            move["row"],
+            move["col"],
+            move["hold_swap"],
+        )
+        outcome.cost = move["cost"]
+        # if None was swapped out, ban hold for next turn
+        self.ban_hold = move["shape"] is None
+        return outcome
+
+    def get_stats(self):
+        return self.send({"command": "stats"})
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import threading
+
+    from .game import Game
+
+    # A searched request with a banned hold must never swap in the held tetromino
+    searching_solver = make_solver(depth=2, beam_width=4)
+    empty_board = [[0] * WIDTH for _ in range(HEIGHT)]
+    for shape in Tetromino.SHAPES:
+        request = MoveRequest(
+            {
+                "board": empty_board,
+                "current": shape,
+                "held": "I",
+                "queue": ["O"],
+                "ban_hold": True,
+            },
+            time.perf_counter(),
+        )
+        [(feature, _)] = evaluate_requests(searching_solver, [request])
+        if feature["hold_swap"]:
+            raise RuntimeError(
+                "searched request with a banned hold swapped in the held tetromino for {}".format(
+                    shape
+                )
+            )
+
+    path = os.path.join(tempfile.mkdtemp(), "solver.sock")
+    service = SolverService(path)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(service.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def play_client(seed):
+        with SolverClient(path) as client:
+            game = Game(seed=seed)
+            while not game.is_over() and game.playfield.num_blocks_placed < 200:
+                game.next_turn(client.decide_outcome(game))
+            print(seed, game.playfield.num_rows_cleared, client.last_response)
+
+    threads = [threading.Thread(target=play_client, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with SolverClient(path) as client:
+        print(client.get_stats())
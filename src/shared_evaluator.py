@@ -0,0 +1,229 @@
+#!usr/bin/env python3
+# Evaluate large batches of placements across processes, through a ring buffer of boards in shared memory
+
+import os
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import batch_evaluator
+from .solver import Solver
+
+HEIGHT = batch_evaluator.HEIGHT
+WIDTH = batch_evaluator.WIDTH
+
+# One fixed size slot per candidate. The parent writes the candidate's base board, placement and column, and a worker
+# writes back the evaluated features, the resulting board and the cost.
+SLOT_DTYPE = np.dtype(
+    [
+        ("grid", np.uint8, (HEIGHT, WIDTH)),
+        ("placement", np.int64),
+        ("col", np.int64),
+        ("features", batch_evaluator.FEATURE_DTYPE),
+        ("board", np.uint8, (HEIGHT, WIDTH)),
+        ("cost", np.int64),
+    ]
+)
+
+# Number of candidates in each slice of the ring that a worker evaluates in one task
+DEFAULT_SLICE_SIZE = 256
+# Number of slices in the ring, i.e. the most slices that can be waiting for or being evaluated by workers at once
+DEFAULT_NUM_SLICES = 16
+# Smaller batches are evaluated in this process, since the round trip to a worker would take longer
+DEFAULT_MIN_BATCH = 512
+
+# State of each worker process, set by _attach_
+_worker_state = None
+
+
+def _attach_(name, num_slots, weights):
+    """Initialise a worker process by attaching to the shared ring buffer"""
+    global _worker_state
+    memory = shared_memory.SharedMemory(name=name)
+    slots = np.ndarray(num_slots, SLOT_DTYPE, buffer=memory.buf)
+    _worker_state = (memory, slots, Solver(weights=weights))
+
+
+def _evaluate_slice_(start, stop):
+    """Evaluate the candidates in the slots from start to stop in place, writing back their results"""
+    _, slots, solver = _worker_state
+    region = slots[start:stop]
+    features, boards = batch_evaluator.evaluate_placements(
+        region["grid"],
+        np.arange(stop - start),
+        region["placement"],
+        region["col"],
+        return_boards=True,
+        feature_names=solver.feature_names,
+    )
+    region["features"] = features
+    region["board"] = boards
+    region["cost"] = solver.get_outcome_costs(features)
+
+
+def _release_(executor, memory):
+    """Shut down the workers and free the shared memory"""
+    executor.shutdown()
+    memory.close()
+    memory.unlink()
+
+
+class SharedEvaluator:
+    """
+    Evaluate batches of placements across worker processes without pickling any boards or features. Candidates are
+    streamed through a ring buffer of num_slices slices of slice_size fixed size slots in shared memory. The parent
+    writes each slice and hands its offsets to a worker, which evaluates the slice in place and writes back the
+    features, resulting boards and costs. Once every slice of the ring is in use, the parent waits for the oldest
+    slice, copies out its results and reuses it, so batches of any size fit in a fixed amount of memory.
+
+    The workers score outcomes with the given weights, which must be the weights of the solver using the evaluator.
+    Results are identical to batch_evaluator.evaluate_placements. Call close, or use the evaluator as a context
+    manager, to stop the workers and free the shared memory, which is otherwise done when the evaluator is garbage
+    collected.
+    """
+
+    def __init__(
+        self,
+        weights,
+        workers=None,
+        slice_size=DEFAULT_SLICE_SIZE,
+        num_slices=DEFAULT_NUM_SLICES,
+        min_batch=DEFAULT_MIN_BATCH,
+    ):
+        if workers is None:
+            workers = os.cpu_count()
+        self.slice_size = slice_size
+        self.num_slices = num_slices
+        self.min_batch = min_batch
+        # Scores the outcomes evaluated in this process in the same way as the workers
+        self.solver = Solver(weights=weights)
+        num_slots = slice_size * num_slices
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=num_slots * SLOT_DTYPE.itemsize
+        )
+        self.slots = np.ndarray(num_slots, SLOT_DTYPE, buffer=self.memory.buf)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_attach_,
+            initargs=(self.memory.name, num_slots, weights),
+        )
+        self._finalizer = weakref.finalize(self, _release_, self.executor, self.memory)
+        # Index of the next slice of the ring to write
+        self.head = 0
+        # Number of batches and slices sent to the workers
+        self.num_batches = 0
+        self.num_slices_evaluated = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # The slots view must go before the shared memory can be closed
+        self.slots = None
+        self._finalizer()
+
+    def get_outcome_costs(self, features):
+        """Return the costs of a FEATURE_DTYPE array with the evaluator's weights, as the workers score them"""
+        return self.solver.get_outcome_costs(features)
+
+    def evaluate_placements(self, grids, bases, placement_ids, cols, feature_names=()):
+        """
+        Evaluate the candidates in the same way as batch_evaluator.evaluate_placements with return_boards, and return
+        their FEATURE_DTYPE array, resulting boards and costs. The workers measure the features of the solver's
+        weights, so feature_names must be a subset of them. Batches smaller than min_batch are evaluated and scored in
+        this process.
+        """
+        if len(bases) < self.min_batch:
+            features, boards = batch_evaluator.evaluate_placements(
+                grids,
+                bases,
+                placement_ids,
+                cols,
+                return_boards=True,
+                feature_names=feature_names,
+            )
+            return features, boards, self.get_outcome_costs(features)
+        grids = np.asarray(grids, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH)
+        bases = np.asarray(bases, dtype=np.int64)
+        placement_ids = np.asarray(placement_ids, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        num_candidates = len(bases)
+        features = np.empty(num_candidates, batch_evaluator.FEATURE_DTYPE)
+        boards = np.empty((num_candidates, HEIGHT, WIDTH), np.uint8)
+        costs = np.empty(num_candidates, np.int64)
+        # (future, region of the ring, start of the slice in the batch) of every slice in flight, oldest first
+        pending = deque()
+
+        def collect():
+            future, region, start = pending.popleft()
+            # Re-raises any error from the worker
+            future.result()
+            stop = start + len(region)
+            features[start:stop] = region["features"]
+            boards[start:stop] = region["board"]
+            costs[start:stop] = region["cost"]
+
+        for start in range(0, num_candidates, self.slice_size):
+            stop = min(start + self.slice_size, num_candidates)
+            if len(pending) == self.num_slices:
+                collect()
+            slot = self.head * self.slice_size
+            self.head = (self.head + 1) % self.num_slices
+            region = self.slots[slot : slot + stop - start]
+            region["grid"] = grids[bases[start:stop]]
+            region["placement"] = placement_ids[start:stop]
+            region["col"] = cols[start:stop]
+            pending.append(
+                (
+                    self.executor.submit(_evaluate_slice_, slot, slot + stop - start),
+                    region,
+                    start,
+                )
+            )
+            self.num_slices_evaluated += 1
+        while pending:
+            collect()
+        self.num_batches += 1
+        features["base"] = bases
+        return features, boards, costs
+
+
+if __name__ == "__main__":
+    import time
+
+    from .kernel import make_random_board
+    from .tetromino import Tetromino
+
+    # A batch the size of a deep search expansion: every placement of every shape on 200 random boards
+    rng = np.random.default_rng(0)
+    grids = np.stack([make_random_board(rng) for _ in range(200)])
+    candidates = [batch_evaluator.get_candidates(shape) for shape in Tetromino.SHAPES]
+    placement_ids = np.tile(np.concatenate([ids for ids, _ in candidates]), len(grids))
+    cols = np.tile(np.concatenate([cols for _, cols in candidates]), len(grids))
+    bases = np.repeat(np.arange(len(grids)), len(placement_ids) // len(grids))
+    with SharedEvaluator(Solver.WEIGHTS) as evaluator:
+        # Start the workers before timing
+        evaluator.evaluate_placements(grids, bases, placement_ids, cols)
+        start = time.perf_counter()
+        features, boards, costs = evaluator.evaluate_placements(
+            grids, bases, placement_ids, cols
+        )
+        shared_time = time.perf_counter() - start
+    start = time.perf_counter()
+    expected, expected_boards = batch_evaluator.evaluate_placements(
+        grids, bases, placement_ids, cols, return_boards=True
+    )
+    local_time = time.perf_counter() - start
+    assert (features == expected).all() and (boards == expected_boards).all()
+    assert (costs == Solver().get_outcome_costs(expected)).all()
+    print(
+        "{} placements: {:.1f} ms in this process, {:.1f} ms with {} workers".format(
+            len(bases), local_time * 1000, shared_time * 1000, os.cpu_count()
+        )
+    )
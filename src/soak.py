@@ -0,0 +1,300 @@
+#!usr/bin/env python3
+# Play games back to back for days, with rolling statistics and a check that memory use stays bounded
+
+import gc
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from .game import Game
+from .runner import make_solver
+
+# Number of recent games kept for the game length percentiles
+DEFAULT_WINDOW = 1000
+# Seconds between reports
+DEFAULT_REPORT_INTERVAL = 60.0
+# Number of games played before the memory baseline is taken, so that caches have time to fill up
+DEFAULT_WARMUP_GAMES = 5
+# Most that RSS or the memory traced by tracemalloc may grow past the baseline before the soak fails
+DEFAULT_MAX_GROWTH = 256 * 1024 * 1024
+# Number of allocation sites listed when memory has grown too much
+NUM_TOP_SITES = 10
+GAME_LENGTH_PERCENTILES = [50, 90, 99]
+
+
+class MemoryGrowthError(RuntimeError):
+    """Raised when memory use has grown by more than the limit since the end of the warm up"""
+
+
+class RingBuffer:
+    """Fixed size buffer of the most recent values, which overwrites the oldest value once it is full"""
+
+    def __init__(self, size, dtype=np.int64):
+        self.values = np.zeros(size, dtype)
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+
+    def get_values(self):
+        """Return the values in the buffer, in no particular order"""
+        return self.values[: min(self.count, len(self.values))]
+
+
+def get_rss():
+    """Return the resident set size of this process in bytes, or None if it can't be read, e.g. without /proc"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class SoakRunner:
+    """
+    Play seeded games back to back with a single solver, so that its caches and search structures live for the whole
+    soak, as they would in a long running bot. Every report_interval seconds, a report of the rolling statistics and
+    memory use is made. Every statistic is kept in a fixed size structure, so the soak itself doesn't grow:
+        pieces_per_sec and rows_per_piece are measured over the last report interval
+        the game length percentiles are over the last window games, and the game length histogram counts every game
+            in power of two buckets
+
+    Memory is measured with every report, after a garbage collection, as RSS and, if trace is true, as the memory
+    and number of blocks allocated by Python that tracemalloc traces. Tracing makes the solver about three times
+    slower, but finds the allocation sites that grew. The baseline is taken at the first report after warmup_games
+    games, and if either measurement grows by more than max_growth bytes past it, the soak fails with
+    MemoryGrowthError.
+    """
+
+    def __init__(
+        self,
+        max_pieces=None,
+        seed_start=0,
+        randomiser="uniform",
+        window=DEFAULT_WINDOW,
+        report_interval=DEFAULT_REPORT_INTERVAL,
+        warmup_games=DEFAULT_WARMUP_GAMES,
+        max_growth=DEFAULT_MAX_GROWTH,
+        trace=True,
+        move_deadline=None,
+        **solver_options
+    ):
+        """
+        max_pieces limits the length of each game, and solver_options are passed to runner.make_solver. If
+        move_deadline is given, each move must be decided within that many seconds, see Solver.decide_outcome, and
+        the reports include the deadline counters.
+        """
+        self.solver = make_solver(**solver_options)
+        self.max_pieces = max_pieces
+        self.seed = seed_start
+        self.randomiser = randomiser
+        self.report_interval = report_interval
+        self.warmup_games = warmup_games
+        self.max_growth = max_growth
+        self.trace = trace
+        self.move_deadline = move_deadline
+        self.game_lengths = RingBuffer(window)
+        # Power of two bucket of the game length -> number of games
+        self.length_histogram = {}
+        self.num_games = 0
+        self.num_pieces = 0
+        self.num_rows_cleared = 0
+        self.start_time = None
+        # Pieces placed and rows cleared since the last report
+        self.interval_start = None
+        self.interval_pieces = 0
+        self.interval_rows_cleared = 0
+        # Memory measurements at the end of the warm up, and the tracemalloc snapshot they were taken from. snapshot is
+        # the snapshot of the last measurement.
+        self.baseline = None
+        self.baseline_snapshot = None
+        self.snapshot = None
+
+    def run(self, duration=None, max_games=None, report=None):
+        """
+        Play games until duration seconds have passed or max_games games have been played, or forever if neither is
+        given. report is called with the dictionary of statistics every report interval. Return the final
+        statistics, or raise MemoryGrowthError as soon as memory use has grown too much.
+        """
+        started_tracing = self.trace and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self.start_time = self.interval_start = time.perf_counter()
+        next_report = self.start_time + self.report_interval
+        try:
+            while max_games is None or self.num_games < max_games:
+                game = Game(seed=self.seed, randomiser=self.randomiser)
+                self.seed += 1
+                # The solver is reused, so it mustn't carry a banned hold over from the last game
+                self.solver.ban_hold = False
+                playfield = game.playfield
+                out_of_time = False
+                while not game.is_over():
+                    if (
+                        self.max_pieces is not None
+                        and playfield.num_blocks_placed >= self.max_pieces
+                    ):
+                        break
+                    rows_cleared = playfield.num_rows_cleared
+                    deadline = None
+                    if self.move_deadline is not None:
+                        deadline = time.perf_counter() + self.move_deadline
+                    game.next_turn(self.solver.decide_outcome(game, deadline))
+                    rows_cleared = int(playfield.num_rows_cleared - rows_cleared)
+                    self.num_pieces += 1
+                    self.num_rows_cleared += rows_cleared
+                    self.interval_pieces += 1
+                    self.interval_rows_cleared += rows_cleared
+                    now = time.perf_counter()
+                    if now >= next_report:
+                        self._report_(report)
+                        next_report = now + self.report_interval
+                    if duration is not None and now - self.start_time >= duration:
+                        out_of_time = True
+                        break
+                if out_of_time:
+                    break
+                self._end_game_(playfield)
+            stats = self.get_stats()
+            if self.baseline is not None:
+                self.check_memory(stats)
+            return stats
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _report_(self, report):
+        """
+        Make a report and check memory use against the baseline. The baseline is taken at the first report after the
+        warm up, so that anything the reports themselves allocate once, e.g. lazy imports, is already included.
+        """
+        stats = self.get_stats()
+        if report is not None:
+            report(stats)
+        if self.baseline is None:
+            if self.num_games >= self.warmup_games:
+                self.baseline = {
+                    "rss": stats["rss_bytes"],
+                    "traced": stats["traced_bytes"],
+                    "games": self.num_games,
+                }
+                self.baseline_snapshot = self.snapshot
+        else:
+            self.check_memory(stats)
+
+    def _end_game_(self, playfield):
+        """Add a finished game to the statistics"""
+        length = playfield.num_blocks_placed
+        self.game_lengths.append(length)
+        bucket = 2 ** int(length).bit_length()
+        self.length_histogram[bucket] = self.length_histogram.get(bucket, 0) + 1
+        self.num_games += 1
+
+    def measure_memory(self):
+        """
+        Return a dictionary of RSS, and of the memory and number of blocks traced by tracemalloc if tracing, after
+        a garbage collection. Values that can't be measured are None. The tracemalloc snapshot is kept in snapshot.
+        """
+        gc.collect()
+        self.snapshot = None
+        traced_bytes = traced_blocks = None
+        if tracemalloc.is_tracing():
+            # The snapshots kept by the soak are traced too, so leave out the memory allocated by tracemalloc itself
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            traced_bytes = sum(trace.size for trace in self.snapshot.traces)
+            traced_blocks = len(self.snapshot.traces)
+        return {
+            "rss": get_rss(),
+            "traced": traced_bytes,
+            "traced_blocks": traced_blocks,
+        }
+
+    def get_stats(self):
+        """
+        Return a dictionary of the rolling statistics and the current memory use, and start a new report interval
+        """
+        now = time.perf_counter()
+        interval = now - self.interval_start
+        stats = {
+            "elapsed": now - self.start_time,
+            "games": self.num_games,
+            "pieces_total": self.num_pieces,
+            "rows_cleared_total": self.num_rows_cleared,
+            "pieces_per_sec": self.interval_pieces / interval if interval else 0.0,
+            "rows_per_piece": (
+                self.interval_rows_cleared / self.interval_pieces
+                if self.interval_pieces
+                else 0.0
+            ),
+        }
+        lengths = self.game_lengths.get_values()
+        if lengths.size:
+            for percentile, value in zip(
+                GAME_LENGTH_PERCENTILES,
+                np.percentile(lengths, GAME_LENGTH_PERCENTILES),
+            ):
+                stats["game_length_p{}".format(percentile)] = float(value)
+            stats["game_length_max"] = int(lengths.max())
+        if self.move_deadline is not None:
+            stats.update(self.solver.get_deadline_stats())
+        memory = self.measure_memory()
+        for name in ["rss", "traced"]:
+            stats[name + "_bytes"] = memory[name]
+            if self.baseline is not None and memory[name] is not None:
+                stats[name + "_growth_bytes"] = memory[name] - self.baseline[name]
+        stats["traced_blocks"] = memory["traced_blocks"]
+        self.interval_start = now
+        self.interval_pieces = 0
+        self.interval_rows_cleared = 0
+        return stats
+
+    def check_memory(self, stats):
+        """
+        Raise MemoryGrowthError if RSS or the traced memory in the statistics has grown by more than max_growth past
+        the baseline, listing the allocation sites that grew the most since the baseline if tracing
+        """
+        for name in ["rss", "traced"]:
+            growth = stats.get(name + "_growth_bytes")
+            if growth is None or growth <= self.max_growth:
+                continue
+            message = "{} grew by {} bytes over {} games since the warm up, more than the limit of {} bytes".format(
+                name, growth, self.num_games - self.baseline["games"], self.max_growth
+            )
+            if self.snapshot is not None and self.baseline_snapshot is not None:
+                sites = self.snapshot.compare_to(self.baseline_snapshot, "lineno")
+                message += "\nlargest growth by allocation site:\n" + "\n".join(
+                    str(site) for site in sites[:NUM_TOP_SITES]
+                )
+            raise MemoryGrowthError(message)
+
+    def format_histogram(self):
+        """Return the game length histogram as a string, with one line per power of two bucket"""
+        return "\n".join(
+            "    < {:>9} pieces: {}".format(bucket, self.length_histogram[bucket])
+            for bucket in sorted(self.length_histogram)
+        )
+
+
+def format_report(stats):
+    """Return the statistics as a single line, e.g. for a log that a soak appends to for days"""
+    fields = []
+    for name, value in stats.items():
+        if isinstance(value, float):
+            value = "{:.3f}".format(value)
+        fields.append("{}={}".format(name, value))
+    return " ".join(fields)
+
+
+if __name__ == "__main__":
+    soak = SoakRunner(max_pieces=200, report_interval=1.0, warmup_games=2)
+    print(
+        format_report(
+            soak.run(duration=5, report=lambda stats: print(format_report(stats)))
+        )
+    )
+    print(soak.format_histogram())
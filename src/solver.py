@@ -2,124 +2,609 @@
 # Given playfield and tetromino, decide best action and determine moves needed
 # to take action.
 
+import json
+import time
+
 import numpy as np
 
+from . import batch_evaluator, kernel, movegen
+from .features import BASE_FEATURES, FEATURES
+from .instrumentation import PROFILER
+from .bitboard_playfield import BitboardPlayfield
+from .outcome import BoardSnapshot, Outcome
 from .playfield import Playfield
+from .tetromino import DISTINCT_ROTATIONS, PLACEMENTS, Tetromino
 
 
 class Solver:
 
     # These weights define how costly each move is. A higher cost is worse. See get_outcome_cost for details.
     # These weights are not optimal, but they have been manually tuned to be
-    # "good enough"
+    # "good enough". Tuned weights can be loaded from a file, see load_weights and tuner.py.
     WEIGHTS = {"wells": 40, "gaps": 20, "gap depth": 5, "row": -20}
 
-    WEIGHTS_VECTOR = np.array(list(WEIGHTS.values()), dtype=np.int8)
+    # Fields of batch_evaluator.FEATURE_DTYPE that are measured by get_reference_outcomes
+    REFERENCE_FIELDS = (
+        "placement",
+        "hold_swap",
+        "rotations",
+        "col",
+        "row",
+        "rows_cleared",
+        "gaps",
+        "gap_depth",
+        "wells",
+    )
+
+    # Seconds before the deadline of an anytime decision that the search stops, left to build the chosen outcome
+    DEADLINE_MARGIN = 0.0005
 
-    def __init__(self):
+    def __init__(
+        self,
+        search=None,
+        cache=None,
+        weights=None,
+        reachability=False,
+        evaluator=None,
+        book=None,
+        prune=False,
+    ):
+        """
+        search is an optional search strategy, e.g. BeamSearch, used to look ahead through the tetromino queue. By
+        default, only the current and held tetrominoes are considered. cache is an optional EvaluationCache used to
+        avoid evaluating the same board and tetromino more than once. weights is an optional dictionary of integer
+        weights, used instead of WEIGHTS, whose keys are the names of the features in features.FEATURES to score
+        outcomes with. If reachability is true, the greedy solver only considers placements that can be reached from
+        the spawn position, including tucks and spins under overhangs, see evaluate_reachable_outcomes.
+        evaluator is an optional shared_evaluator.SharedEvaluator, created with the same weights, that evaluates large
+        batches, e.g. the expansions of a deep search, across processes. book is an optional
+        opening_book.OpeningBook of moves, which is consulted before any outcome is evaluated. If prune is true, the
+        greedy solver only builds and measures the boards of outcomes that clear rows, see evaluate_pruned_outcomes.
+        """
+        if weights is None:
+            weights = Solver.WEIGHTS
+        unknown = [name for name in weights if name not in FEATURES]
+        if unknown:
+            raise ValueError("unknown features {}".format(", ".join(unknown)))
+        self.weights = {name: int(value) for name, value in weights.items()}
+        self.feature_names = tuple(self.weights)
+        self.feature_fields = [FEATURES[name].field for name in self.feature_names]
+        self.weights_vector = np.array(list(self.weights.values()), dtype=np.int64)
+        self.prune = prune
+        self.reachability = reachability
         self.ban_hold = False
-        pass
+        self.search = search
+        self.cache = cache
+        self.evaluator = evaluator
+        self.book = book
+        # The candidate outcomes of the last decision, their costs and the index of the chosen outcome, e.g. for
+        # exporting training data
+        self.last_features = None
+        self.last_costs = None
+        self.last_index = None
+        # Number of outcomes measured by the last evaluate_pruned_outcomes
+        self.last_measured = None
+        # Counters of the decisions made with a deadline, see get_deadline_stats
+        self.deadline_decisions = 0
+        self.deadline_cut_short = 0
+        self.deadline_missed = 0
+        # Depth searched -> number of decisions made with a deadline
+        self.deadline_depths = {}
 
     def get_all_outcomes(self, playfield, current_tetromino, held_tetromino):
         """
-        Get all potential outcomes so that they can be scored and filtered.
+        Get all potential outcomes so that they can be scored and filtered. Each outcome is a compact Outcome record
+        that shares a snapshot of the playfield with the other outcomes, and only builds its resulting board when
+        it is accessed.
+        """
+        features = self.evaluate_outcomes(playfield, current_tetromino, held_tetromino)
+        parent = BoardSnapshot.from_playfield(playfield)
+        return [self.get_outcome(feature, parent) for feature in features]
+
+    def get_reference_outcomes(self, playfield, current_tetromino, held_tetromino):
+        """
+        Evaluate every potential outcome one at a time, by dropping the tetromino on a copy of the playfield and
+        measuring the copy with the Playfield metric methods. This is the reference that the batched evaluation is
+        checked against, see cross_check_outcomes. Return a batch_evaluator.FEATURE_DTYPE array, ordered in the same
+        way as evaluate_outcomes, with only REFERENCE_FIELDS set.
         """
         assert isinstance(playfield, Playfield)
 
         if current_tetromino is None:
-            return [
-                {
-                    "playfield": playfield,
-                    "tetromino": None,
-                    "rotations": 0,
-                    "row": playfield.MAIN_BOX_HEIGHT,
-                    "col": 0,
-                    "hold_swap": False,
-                    "gaps": 0,
-                    "gap_depth": 0,
-                    "wells": 0,
-                }
-            ]
-
-        outcomes = []
+            return batch_evaluator.get_empty_features(False)
+
         hold_swap_options = [False]
         if not self.ban_hold:
             hold_swap_options += [True]
 
+        records = []
         for hold_swap in hold_swap_options:
-            if hold_swap and held_tetromino is None:
-                outcomes.append(
-                    {
-                        "playfield": playfield,
-                        "tetromino": None,
-                        "rotations": 0,
-                        "row": outcome_playfield.MAIN_BOX_HEIGHT,
-                        "col": 0,
-                        "hold_swap": hold_swap,
-                        "gaps": 0,
-                        "gap_depth": 0,
-                        "wells": 0,
-                    }
-                )
+            active_tetromino = held_tetromino if hold_swap else current_tetromino
+            if active_tetromino is None:
                 continue
-            else:
-                if hold_swap:
-                    active_tetromino = held_tetromino
-                else:
-                    active_tetromino = current_tetromino
-            # Get all outcomes for each hold/rotate permutation of tetromino
-            for tetr in [active_tetromino.copy().rotate(n) for n in range(4)]:
-                for col in range(playfield.MAIN_BOX_WIDTH - tetr.width() + 1):
+            for rotations in DISTINCT_ROTATIONS[active_tetromino.shape]:
+                tetr = Tetromino(active_tetromino.shape, rotations)
+                for col in tetr.placement.columns:
                     outcome_playfield = playfield.copy()
                     row = outcome_playfield.drop_tetromino(tetr, col)
-                    outcomes.append(
-                        {
-                            "playfield": outcome_playfield,
-                            "tetromino": tetr,
-                            "rotations": tetr.rotations,
-                            "row": row,
-                            "col": col,
-                            "hold_swap": hold_swap,
-                            "gaps": outcome_playfield.get_gap_count(),
-                            "gap_depth": outcome_playfield.get_gap_depth(),
-                            "wells": outcome_playfield.get_well_count(),
-                        }
+                    records.append(
+                        (
+                            batch_evaluator.PLACEMENT_IDS[(tetr.shape, rotations)],
+                            hold_swap,
+                            rotations,
+                            col,
+                            row,
+                            outcome_playfield.num_rows_cleared,
+                            outcome_playfield.get_gap_count(),
+                            outcome_playfield.get_gap_depth(),
+                            outcome_playfield.get_well_count(),
+                        )
                     )
-        return outcomes
+        features = np.zeros(len(records), dtype=batch_evaluator.FEATURE_DTYPE)
+        for field, values in zip(self.REFERENCE_FIELDS, zip(*records)):
+            features[field] = values
+        # Swapping in an empty hold is always the last outcome
+        if True in hold_swap_options and held_tetromino is None:
+            features = np.concatenate(
+                [features, batch_evaluator.get_empty_features(True)]
+            )
+        return features
 
     def get_outcome_cost(self, outcome):
         """Get scoring vector for outcome by performing dot product with
-        weights vector. Each outcome is scored on the following paramters:
+        weights vector. With the default weights, each outcome is scored on the following paramters:
             How many wells it contains (fewer is better)
             How many gaps it contains (fewer is better)
             How many blocks are above gaps (fewer is better)
             Drop row (lower is better)
+        The outcome can be anything indexed by feature field, e.g. a batch_evaluator.FEATURE_DTYPE record.
         """
         score_vector = np.array(
-            [outcome["wells"], outcome["gaps"], outcome["gap_depth"], outcome["row"]],
-            dtype=np.uint8,
+            [outcome[field] for field in self.feature_fields], dtype=np.int64
+        )
+        return np.dot(score_vector, self.weights_vector)
+
+    def evaluate_outcomes(self, playfield, current_tetromino, held_tetromino):
+        """
+        Evaluate all potential outcomes in a single batch. Return a batch_evaluator.FEATURE_DTYPE array, ordered in
+        the same way as get_all_outcomes.
+        """
+        return self._evaluate_outcomes_(playfield, current_tetromino, held_tetromino)[0]
+
+    def _evaluate_outcomes_(self, playfield, current_tetromino, held_tetromino):
+        """
+        Evaluate all potential outcomes in the same way as evaluate_outcomes. Return their features and the costs
+        written back by the shared evaluator's workers, or None for the costs if there is no evaluator.
+        """
+        assert isinstance(playfield, Playfield)
+
+        if current_tetromino is None:
+            return batch_evaluator.get_empty_features(False), None
+
+        hold_swap_options = [False]
+        if not self.ban_hold:
+            hold_swap_options += [True]
+
+        shapes = []
+        for hold_swap in hold_swap_options:
+            active_tetromino = held_tetromino if hold_swap else current_tetromino
+            if active_tetromino is not None:
+                shapes.append(active_tetromino.shape)
+
+        features, _, costs = batch_evaluator.evaluate_shapes(
+            playfield.grid[None],
+            [0] * len(shapes),
+            shapes,
+            self.cache,
+            self.feature_names,
+            self.evaluator,
+        )
+        # Every outcome after the current tetromino's outcomes is a hold swap
+        features["hold_swap"][
+            len(batch_evaluator.get_candidates(current_tetromino.shape)[1]) :
+        ] = True
+        # Swapping in an empty hold is always the last outcome
+        if True in hold_swap_options and held_tetromino is None:
+            empty_features = batch_evaluator.get_empty_features(True)
+            features = np.concatenate([features, empty_features])
+            if costs is not None:
+                costs = np.concatenate([costs, self.get_outcome_costs(empty_features)])
+        return features, costs
+
+    def evaluate_pruned_outcomes(self, playfield, current_tetromino, held_tetromino):
+        """
+        Evaluate the potential outcomes with a cheap first pass, that only builds and measures the boards of the
+        outcomes that need it. Every outcome is first measured from the statistics of the playfield and its drop row,
+        which is exact unless it clears a row, see batch_evaluator.measure_features_from_stats. Only the outcomes that
+        aren't exact are then measured by evaluate_placements, in a single batch. Return the FEATURE_DTYPE array of
+        outcomes, which is the same as that of evaluate_outcomes, their costs and the index of the lowest cost
+        outcome, which is the same outcome that evaluate_outcomes and get_outcome_costs would choose.
+        """
+        assert isinstance(playfield, Playfield)
+
+        if current_tetromino is None:
+            features = batch_evaluator.get_empty_features(False)
+            self.last_measured = 0
+            return features, self.get_outcome_costs(features), 0
+
+        hold_swap_options = [False]
+        if not self.ban_hold:
+            hold_swap_options += [True]
+
+        placement_ids = []
+        cols = []
+        hold_swaps = []
+        for hold_swap in hold_swap_options:
+            tetromino = held_tetromino if hold_swap else current_tetromino
+            if tetromino is not None:
+                candidate_ids, candidate_cols = batch_evaluator.get_candidates(
+                    tetromino.shape
+                )
+                placement_ids.append(candidate_ids)
+                cols.append(candidate_cols)
+                hold_swaps += [hold_swap] * len(candidate_cols)
+        placement_ids = np.concatenate(placement_ids)
+        cols = np.concatenate(cols)
+        hold_swaps = np.array(hold_swaps)
+        grids = playfield.grid[None]
+        bases = np.zeros(len(cols), np.int64)
+        rows = batch_evaluator.get_drop_rows(
+            playfield.column_tops[None], bases, placement_ids, cols
         )
-        return np.dot(score_vector, Solver.WEIGHTS_VECTOR)
 
-    def decide_outcome(self, game):
+        # The same features as evaluate_outcomes, i.e. the base features and the weighted features
+        feature_names = tuple(dict.fromkeys(BASE_FEATURES + self.feature_names))
+        values, exact = batch_evaluator.measure_features_from_stats(
+            grids, bases, placement_ids, cols, rows, feature_names
+        )
+        features = np.zeros(len(cols), dtype=batch_evaluator.FEATURE_DTYPE)
+        features["placement"] = placement_ids
+        features["hold_swap"] = hold_swaps
+        features["rotations"] = batch_evaluator.PLACEMENT_ROTATIONS[placement_ids]
+        features["col"] = cols
+        features["row"] = rows
+        for name, feature_values in values.items():
+            features[FEATURES[name].field] = feature_values
+        measure = ~exact
+        if measure.any():
+            measured = batch_evaluator.evaluate_placements(
+                grids,
+                bases[measure],
+                placement_ids[measure],
+                cols[measure],
+                feature_names=self.feature_names,
+                rows=rows[measure],
+            )
+            measured["hold_swap"] = hold_swaps[measure]
+            features[measure] = measured
+        self.last_measured = int(measure.sum())
+        # Swapping in an empty hold is always the last outcome
+        if True in hold_swap_options and held_tetromino is None:
+            features = np.concatenate(
+                [features, batch_evaluator.get_empty_features(True)]
+            )
+        costs = self.get_outcome_costs(features)
+        return features, costs, np.argmin(costs)
+
+    def evaluate_reachable_outcomes(self, playfield, current_tetromino, held_tetromino):
+        """
+        Evaluate the placements that each tetromino can reach from its spawn position, found by a
+        movegen.MoveGenerator, in a single batch. The placements that a hard drop from above reaches come first, in the
+        same order as evaluate_outcomes, followed by the placements that need a tuck or spin. Return the
+        batch_evaluator.FEATURE_DTYPE array of outcomes, and the move generators of the current and held tetrominoes,
+        keyed by hold_swap. If no placement is reachable, return the outcomes of evaluate_outcomes and no move
+        generators, so that the game can still play on.
+        """
+        assert isinstance(playfield, Playfield)
+
+        if current_tetromino is None:
+            return batch_evaluator.get_empty_features(False), {}
+
+        hold_swap_options = [False]
+        if not self.ban_hold:
+            hold_swap_options += [True]
+
+        grid = playfield.grid
+        blocked = movegen.get_blocked_cells(grid)
+        tops = batch_evaluator.get_column_tops(grid[None])
+        generators = {}
+        placement_ids = []
+        rows = []
+        cols = []
+        hold_swaps = []
+        for hold_swap in hold_swap_options:
+            tetromino = held_tetromino if hold_swap else current_tetromino
+            if tetromino is None:
+                continue
+            generator = movegen.MoveGenerator(grid, tetromino.shape, blocked)
+            generators[hold_swap] = generator
+            reachable = dict.fromkeys(generator.get_placements())
+            candidate_ids, candidate_cols = batch_evaluator.get_candidates(
+                tetromino.shape
+            )
+            drop_rows = batch_evaluator.get_drop_rows(
+                tops,
+                np.zeros(len(candidate_cols), np.int64),
+                candidate_ids,
+                candidate_cols,
+            )
+            hard_drops = []
+            for placement_id, row, col in zip(
+                candidate_ids.tolist(), drop_rows.tolist(), candidate_cols.tolist()
+            ):
+                placement = (batch_evaluator.PLACEMENT_KEYS[placement_id][1], row, col)
+                if placement in reachable:
+                    hard_drops.append(placement)
+                    del reachable[placement]
+            for rotations, row, col in hard_drops + sorted(reachable):
+                placement_ids.append(
+                    batch_evaluator.PLACEMENT_IDS[(tetromino.shape, rotations)]
+                )
+                rows.append(row)
+                cols.append(col)
+                hold_swaps.append(hold_swap)
+
+        if not placement_ids:
+            return (
+                self.evaluate_outcomes(playfield, current_tetromino, held_tetromino),
+                {},
+            )
+        features = batch_evaluator.evaluate_placements(
+            grid[None],
+            np.zeros(len(cols), np.int64),
+            placement_ids,
+            cols,
+            feature_names=self.feature_names,
+            rows=rows,
+        )
+        features["hold_swap"] = hold_swaps
+        # Swapping in an empty hold is always the last outcome
+        if True in hold_swap_options and held_tetromino is None:
+            features = np.concatenate(
+                [features, batch_evaluator.get_empty_features(True)]
+            )
+        return features, generators
+
+    def get_outcome_costs(self, features):
+        """
+        Get the cost of every outcome in a batch_evaluator.FEATURE_DTYPE array. This gives the same values as
+        get_outcome_cost.
+        """
+        score_vectors = np.empty((len(features), len(self.feature_fields)), np.int64)
+        for index, field in enumerate(self.feature_fields):
+            score_vectors[:, index] = features[field]
+        return np.dot(score_vectors, self.weights_vector)
+
+    def get_outcome(self, feature, parent, move_generator=None):
+        """
+        Convert a single evaluated outcome into an Outcome record. parent is the BoardSnapshot of the playfield that
+        the outcome starts from, and move_generator is the movegen.MoveGenerator that found the outcome, if any.
+        """
+        if feature["placement"] < 0:
+            shape = None
+        else:
+            shape = batch_evaluator.PLACEMENT_KEYS[feature["placement"]][0]
+        return Outcome(
+            parent,
+            shape,
+            int(feature["rotations"]),
+            int(feature["row"]),
+            int(feature["col"]),
+            bool(feature["hold_swap"]),
+            int(feature["gaps"]),
+            int(feature["gap_depth"]),
+            int(feature["wells"]),
+            move_generator=move_generator if shape is not None else None,
+        )
+
+    def get_book_outcome(self, game):
+        """
+        Return the Outcome of the book's move for the game's position, or None if the book has no move for it. Book
+        moves are hard drops, so the outcome's row is the drop row, and its features aren't measured.
+        """
+        held_tetromino = game.holder.held_tetromino
+        move = self.book.get_move(
+            game.playfield, game.current_tetromino, held_tetromino, self.ban_hold
+        )
+        if move is None:
+            return None
+        hold_swap, rotations, col = move
+        parent = BoardSnapshot.from_playfield(game.playfield)
+        tetromino = held_tetromino if hold_swap else game.current_tetromino
+        if tetromino is None:
+            # Swapping in an empty hold
+            return Outcome(parent, None, 0, 0, 0, True)
+        row = parent.get_drop_row(PLACEMENTS[(tetromino.shape, rotations)], col)
+        return Outcome(parent, tetromino.shape, rotations, row, col, hold_swap)
+
+    def decide_outcome(self, game, deadline=None):
         """
         Score and filter all potential outcomes to determine the best action
         to take. Return outcome that has lowest cost.
+
+        If deadline is given, as a time.perf_counter() time, the decision is anytime: the search starts from the
+        greedy outcome and deepens one tetromino at a time while time remains, returning the best outcome of the
+        deepest depth completed before the deadline, see BeamSearch.search. The greedy outcome is always found, so
+        the deadline is only missed if it is too short for that. Decisions made with a deadline are counted, see
+        get_deadline_stats.
+
+        If the solver has a book with a move for the position, the book's move is returned without any evaluation.
         """
-        outcomes = self.get_all_outcomes(
-            game.playfield, game.current_tetromino, game.holder.held_tetromino
-        )
-        for index, outcome in enumerate(outcomes):
-            outcomes[index]["cost"] = self.get_outcome_cost(outcome)
-        # Filter out any outcome that doesn't have the lowest cost
-        lowest_cost = min([outcome["cost"] for outcome in outcomes])
-        outcomes = list(
-            filter(lambda outcome: outcome["cost"] == lowest_cost, outcomes)
+        decide_start = PROFILER.start()
+        start = decide_start
+        if self.book is not None and game.current_tetromino is not None:
+            outcome = self.get_book_outcome(game)
+            if outcome is not None:
+                self.last_features = None
+                self.last_costs = None
+                self.last_index = None
+                self.ban_hold = outcome.shape is None
+                # A book move counts as a decision that searched to depth 0
+                self._count_deadline_(deadline, 0, False)
+                PROFILER.stop("solver.book", start)
+                return outcome
+        held_tetromino = game.holder.held_tetromino
+        generators = {}
+        depth = 1
+        cut_short = False
+        if (
+            self.search is not None
+            and game.current_tetromino is not None
+            and held_tetromino is not None
+        ):
+            features, costs, index = self.search.search(
+                self,
+                game.playfield,
+                game.current_tetromino,
+                held_tetromino,
+                game.tetromino_queue.queue,
+                deadline - self.DEADLINE_MARGIN if deadline is not None else None,
+            )
+            PROFILER.stop(
+                "solver.search",
+                start,
+                candidates=len(features),
+                depth=self.search.last_depth,
+                nodes=self.search.last_node_count,
+            )
+            depth = self.search.last_depth
+            cut_short = self.search.last_budget_hit
+            start = PROFILER.start()
+        elif self.prune and not self.reachability and self.cache is None:
+            # Pruning gives the same outcomes as evaluate_outcomes, but a cache is faster when it has a hit
+            features, costs, index = self.evaluate_pruned_outcomes(
+                game.playfield, game.current_tetromino, held_tetromino
+            )
+            PROFILER.stop(
+                "solver.generate",
+                start,
+                candidates=len(features),
+                measured=self.last_measured,
+            )
+            start = PROFILER.start()
+        else:
+            if self.reachability:
+                features, generators = self.evaluate_reachable_outcomes(
+                    game.playfield, game.current_tetromino, held_tetromino
+                )
+                costs = None
+            else:
+                features, costs = self._evaluate_outcomes_(
+                    game.playfield, game.current_tetromino, held_tetromino
+                )
+            PROFILER.stop("solver.generate", start, candidates=len(features))
+            start = PROFILER.start()
+            # A shared evaluator's workers have already scored the outcomes
+            if costs is None:
+                costs = self.get_outcome_costs(features)
+            # With multiple lowest cost outcomes, selection is only affected by
+            # number of keystrokes outcome requires. argmin returns the lowest
+            # cost outcome that is earliest in the list, which is more likely to
+            # not require swap and not require any rotations
+            index = np.argmin(costs)
+        outcome = self.get_outcome(
+            features[index],
+            BoardSnapshot.from_playfield(game.playfield),
+            generators.get(bool(features["hold_swap"][index])),
         )
+        outcome.cost = costs[index]
+        self.last_features = features
+        self.last_costs = costs
+        self.last_index = index
         # if None was swapped out, ban hold for next turn
-        self.ban_hold = outcomes[0]["tetromino"] is None
-        # With multiple lowest cost outcomes, selection is only affected by
-        # number of keystrokes outcome requires. The lowest outcome in the
-        # list is more likely to not require swap and not require any
-        # rotations
-        return outcomes[0]
+        self.ban_hold = outcome.shape is None
+        self._count_deadline_(deadline, depth, cut_short)
+        PROFILER.stop("solver.score", start)
+        if PROFILER.enabled:
+            cache_stats = self.cache.stats() if self.cache is not None else {}
+            PROFILER.stop(
+                "solver.decide_outcome",
+                decide_start,
+                candidates=len(features),
+                **cache_stats
+            )
+        return outcome
+
+    def _count_deadline_(self, deadline, depth, cut_short):
+        """Count a decision in the deadline counters, if it was made with a deadline"""
+        if deadline is None:
+            return
+        self.deadline_decisions += 1
+        self.deadline_cut_short += cut_short
+        self.deadline_missed += time.perf_counter() > deadline
+        self.deadline_depths[depth] = self.deadline_depths.get(depth, 0) + 1
+
+    def get_deadline_stats(self):
+        """
+        Return a dictionary of the number of decisions made with a deadline, how many of them the deadline cut
+        short, i.e. stopped the search before its full depth, how many missed the deadline, and the number of
+        decisions that searched to each depth
+        """
+        decisions = self.deadline_decisions
+        stats = {
+            "deadline_decisions": decisions,
+            "deadline_cut_short": self.deadline_cut_short,
+            "deadline_cut_short_rate": (
+                self.deadline_cut_short / decisions if decisions else 0.0
+            ),
+            "deadline_missed": self.deadline_missed,
+            "deadline_missed_rate": (
+                self.deadline_missed / decisions if decisions else 0.0
+            ),
+        }
+        for depth in sorted(self.deadline_depths):
+            stats["deadline_depth_{}".format(depth)] = self.deadline_depths[depth]
+        return stats
+
+
+def cross_check_outcomes(num_boards=100, seed=0):
+    """
+    Evaluate the outcomes of every shape, with a random held shape and hold banned or not, on num_boards random
+    boards, and check that evaluate_outcomes gives the same outcomes as get_reference_outcomes, with both Playfield
+    and BitboardPlayfield as the reference. Raise AssertionError on the first difference, and otherwise return the
+    number of outcomes checked.
+    """
+    rng = np.random.default_rng(seed)
+    solver = Solver()
+    num_checked = 0
+    for _ in range(num_boards):
+        board = kernel.make_random_board(rng)
+        for shape in Tetromino.SHAPES:
+            held_shape = rng.choice([None] + Tetromino.SHAPES)
+            held_tetromino = Tetromino(held_shape) if held_shape is not None else None
+            solver.ban_hold = bool(rng.integers(2))
+            fields = list(Solver.REFERENCE_FIELDS)
+            for playfield_class in (Playfield, BitboardPlayfield):
+                playfield = playfield_class(board)
+                expected = solver.get_reference_outcomes(
+                    playfield, Tetromino(shape), held_tetromino
+                )[fields]
+                actual = solver.evaluate_outcomes(
+                    playfield, Tetromino(shape), held_tetromino
+                )[fields]
+                if expected.shape != actual.shape or (expected != actual).any():
+                    raise AssertionError(
+                        "{} outcomes of {} with {} held differ on board\n{}\nexpected {}, got {}".format(
+                            playfield_class.__name__,
+                            shape,
+                            held_shape,
+                            board,
+                            expected,
+                            actual,
+                        )
+                    )
+                num_checked += len(expected)
+    return num_checked
+
+
+def load_weights(path):
+    """
+    Return the dictionary of weights stored in the JSON file, e.g. by save_weights, for use with Solver.
+    """
+    with open(path) as weights_file:
+        return json.load(weights_file)
+
+
+def save_weights(weights, path):
+    with open(path, "w") as weights_file:
+        json.dump(weights, weights_file, indent=2)
@@ -2,7 +2,37 @@
 # Model tetromino as numpy array
 
 import numpy as np
-import random
+from collections import namedtuple
+from types import MappingProxyType
+
+# Width of the playfield that the placement column ranges are computed for. Must match Playfield.MAIN_BOX_WIDTH.
+PLAYFIELD_WIDTH = 10
+
+# Precomputed data for a single (shape, rotations) pair:
+#   grid       - read-only tetromino grid
+#   width      - grid width
+#   height     - grid height
+#   elevations - number of empty spaces from the bottom to the lowest filled block in each column
+#   tops       - number of empty spaces from the top to the highest filled block in each column
+#   columns    - range of valid columns for the left side of the grid within the playfield
+#   masks      - (occupancy, colour bits) pair for each grid row, see BitboardPlayfield
+Placement = namedtuple(
+    "Placement",
+    [
+        "shape",
+        "rotations",
+        "grid",
+        "width",
+        "height",
+        "elevations",
+        "tops",
+        "columns",
+        "masks",
+    ],
+)
+
+# Number of bits used to store the colour (i.e. shape value) of a single cell in a row mask
+CELL_BITS = 3
 
 
 class Tetromino:
@@ -23,11 +53,9 @@ class Tetromino:
     SHAPE_MAX_WIDTH = max([len(x[0]) for x in SHAPE_GRID.values()])
 
     def __init__(self, shape, rotations=0):
-        if shape.upper() in self.SHAPES:
-            self.grid = np.array(self.SHAPE_GRID[shape.upper()], dtype=np.uint8)
-        else:
+        if shape.upper() not in self.SHAPES:
             raise ValueError("Type {} not recognised".format(shape))
-        self.shape = shape
+        self.shape = shape.upper()
         self.rotations = 0
         self.rotate(rotations)
 
@@ -38,17 +66,17 @@ class Tetromino:
         return self.grid[key]
 
     def height(self):
-        return self.grid.shape[0]
+        return self.placement.height
 
     def width(self):
-        return self.grid.shape[1]
+        return self.placement.width
 
     def rotate(self, rotations=1):
         """Perform 90 degrees clockwise rotations"""
         self.rotations = (self.rotations + rotations) % 4
-        # np.rot90 does anti-clockwise rotations so negative rotations are
-        # performed
-        self.grid = np.rot90(self.grid, -rotations)
+        # Look up the rotated grid in the placement table rather than rotating it
+        self.placement = PLACEMENTS[(self.shape, self.rotations)]
+        self.grid = self.placement.grid
         return self
 
     def reset_rotations(self):
@@ -80,8 +108,7 @@ class Tetromino:
         """
         if col < 0 or col >= self.width():
             raise ValueError("{} is not 0 <= col < width".format(col))
-        # get row of lowest filled block in column
-        return (np.flip(self.grid[:, col] != 0)).argmax()
+        return self.placement.elevations[col]
 
     def get_zero_padded_grid(self):
         """
@@ -105,11 +132,61 @@ class Tetromino:
         return print_str
 
 
-def get_random_tetromino():
+def _build_placement_(shape, rotations):
+    """
+    Return the Placement for the shape after the specified number of clockwise rotations.
+    """
+    # np.rot90 does anti-clockwise rotations so negative rotations are performed
+    grid = np.rot90(np.array(Tetromino.SHAPE_GRID[shape], dtype=np.uint8), -rotations)
+    grid = np.ascontiguousarray(grid)
+    grid.setflags(write=False)
+    height, width = grid.shape
+    filled = grid != 0
+    masks = []
+    for grid_row in grid:
+        occupancy = 0
+        colours = 0
+        for col, value in enumerate(grid_row):
+            if value != 0:
+                occupancy |= 1 << col
+                colours |= int(value) << (CELL_BITS * col)
+        masks.append((occupancy, colours))
+    return Placement(
+        shape=shape,
+        rotations=rotations,
+        grid=grid,
+        width=width,
+        height=height,
+        elevations=tuple(int(x) for x in np.flip(filled, axis=0).argmax(axis=0)),
+        tops=tuple(int(x) for x in filled.argmax(axis=0)),
+        columns=range(PLAYFIELD_WIDTH - width + 1),
+        masks=tuple(masks),
+    )
+
+
+def _build_placement_table_():
     """
-    Return a randomly selected tetromino
+    Return the placement table, containing a Placement for every (shape, rotations) pair, and the distinct
+    rotations of each shape, i.e. with any rotations that give an identical grid to a smaller rotation removed.
     """
-    return Tetromino(random.choice(Tetromino.SHAPES))
+    placements = {}
+    distinct_rotations = {}
+    for shape in Tetromino.SHAPES:
+        distinct_rotations[shape] = []
+        for rotations in range(4):
+            placement = _build_placement_(shape, rotations)
+            placements[(shape, rotations)] = placement
+            if not any(
+                np.array_equal(placement.grid, placements[(shape, n)].grid)
+                for n in distinct_rotations[shape]
+            ):
+                distinct_rotations[shape].append(rotations)
+        distinct_rotations[shape] = tuple(distinct_rotations[shape])
+    return MappingProxyType(placements), MappingProxyType(distinct_rotations)
+
+
+# Built once at import. Indexed by (shape, rotations) and shape respectively.
+PLACEMENTS, DISTINCT_ROTATIONS = _build_placement_table_()
 
 
 if __name__ == "__main__":
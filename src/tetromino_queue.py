@@ -1,7 +1,9 @@
 #!usr/bin/env python3
 # Manage the queue of tetrominoes
 
-from . import tetromino
+import random
+
+from .randomiser import get_randomiser
 from .tetromino import Tetromino
 
 
@@ -9,10 +11,21 @@ class TetrominoQueue:
 
     LENGTH = 3
 
-    def __init__(self):
+    def __init__(self, rng=None, seed=None, randomiser="uniform"):
+        """
+        rng is the random number generator used to generate the sequence of tetrominoes, e.g. random.Random. If it
+        isn't given, a new random.Random is created from the seed. randomiser is "uniform", "bag" or the path of a
+        sequence file, see randomiser.get_randomiser.
+        """
+        if rng is None:
+            rng = random.Random(seed)
+        self.randomiser = get_randomiser(randomiser, rng)
+        # Shapes are generated in chunks and dealt from the front of the chunk
+        self.shapes = []
+        self.shape_index = 0
         self.queue = []
         for _ in range(self.LENGTH):
-            self.queue.append(tetromino.get_random_tetromino())
+            self.queue.append(self._get_new_tetromino_())
 
     def __str__(self):
         print_str = []
@@ -27,19 +40,30 @@ class TetrominoQueue:
 
         return "\n".join(print_str)
 
+    def _get_new_tetromino_(self):
+        """
+        Return a new tetromino with the next shape in the sequence, generating a new chunk of shapes if required.
+        """
+        if self.shape_index == len(self.shapes):
+            self.shapes = self.randomiser.get_chunk()
+            self.shape_index = 0
+        shape = self.shapes[self.shape_index]
+        self.shape_index += 1
+        return Tetromino(shape)
+
     def get_next(self):
         """
         Pop the next tetromino out of the queue and fill that back of the queue with a new tetromino. Return the popped
         Tetromino
         """
         # Append a new tetromino to the back of the queue.
-        self.queue.append(tetromino.get_random_tetromino())
+        self.queue.append(self._get_new_tetromino_())
         # Pop and return the tetromino at the front of the queue.
         return self.queue.pop(0)
 
 
 if __name__ == "__main__":
-    tetromino_queue = TetrominoQueue()
+    tetromino_queue = TetrominoQueue(seed=0)
     print(tetromino_queue)
     tetromino = tetromino_queue.get_next()
     print(str(tetromino) + ", " + str(tetromino_queue))
@@ -0,0 +1,167 @@
+#!usr/bin/env python3
+# Export every decision of the solver as training data, in shards of columnar arrays
+
+import glob
+
+import numpy as np
+
+from . import batch_evaluator
+from .playfield import Playfield
+from .tetromino import Tetromino
+from .tetromino_queue import TetrominoQueue
+
+# Number of turns in each shard
+DEFAULT_SHARD_TURNS = 16384
+# Candidate outcomes allocated per turn: every hard drop of the current and held tetrominoes, and swapping in an empty
+# hold. Reachability can find more placements, in which case the candidate buffers grow
+MAX_CANDIDATES = (
+    2 * max(len(batch_evaluator.get_candidates(shape)[0]) for shape in Tetromino.SHAPES)
+    + 1
+)
+
+
+def get_shape_codes(tetrominoes):
+    """
+    Return the grid values of the tetrominoes' shapes, i.e. one more than their index in Tetromino.SHAPES, with 0 for
+    None.
+    """
+    return [
+        0 if tetromino is None else Tetromino.SHAPES.index(tetromino.shape) + 1
+        for tetromino in tetrominoes
+    ]
+
+
+class TrainingExporter:
+    """
+    Buffer the state of the game and the solver's candidate outcomes every turn, and write them to disk in shards
+    of shard_turns turns. Each shard is an uncompressed npz file named <path>.<shard number>.npz, containing:
+
+        boards     - (turns, height, width) playfield grids at the start of each turn
+        current    - (turns,) current shape, as in get_shape_codes
+        held       - (turns,) held shape
+        queue      - (turns, TetrominoQueue.LENGTH) queued shapes
+        offsets    - (turns + 1,) the candidates of turn i are candidates[offsets[i] : offsets[i + 1]]
+        candidates - batch_evaluator.FEATURE_DTYPE array of every turn's candidate outcomes
+        costs      - the solver's cost of each candidate
+        chosen     - (turns,) index of the chosen outcome within each turn's candidates
+
+    The buffers are allocated once per exporter, and the candidate buffers only grow if a shard has more candidates
+    than MAX_CANDIDATES per turn, so memory use is bounded by the shard size.
+    """
+
+    def __init__(self, path, shard_turns=DEFAULT_SHARD_TURNS):
+        self.path = path
+        self.shard_turns = shard_turns
+        self.num_shards = 0
+        self.num_turns = 0
+        self.boards = np.zeros(
+            (shard_turns, Playfield.MAIN_BOX_HEIGHT, Playfield.MAIN_BOX_WIDTH),
+            np.uint8,
+        )
+        self.current = np.zeros(shard_turns, np.uint8)
+        self.held = np.zeros(shard_turns, np.uint8)
+        self.queue = np.zeros((shard_turns, TetrominoQueue.LENGTH), np.uint8)
+        self.offsets = np.zeros(shard_turns + 1, np.int64)
+        self.chosen = np.zeros(shard_turns, np.int32)
+        self.candidates = np.zeros(
+            shard_turns * MAX_CANDIDATES, batch_evaluator.FEATURE_DTYPE
+        )
+        self.costs = np.zeros(shard_turns * MAX_CANDIDATES, np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, game, solver):
+        """
+        Record the current turn of the game, after the solver has decided its outcome but before the outcome is
+        executed.
+        """
+        turn = self.num_turns
+        start = self.offsets[turn]
+        end = start + len(solver.last_features)
+        if end > len(self.candidates):
+            size = max(end, 2 * len(self.candidates))
+            self.candidates = np.resize(self.candidates, size)
+            self.costs = np.resize(self.costs, size)
+        self.boards[turn] = game.playfield.grid
+        self.current[turn], self.held[turn] = get_shape_codes(
+            [game.current_tetromino, game.holder.held_tetromino]
+        )
+        self.queue[turn] = get_shape_codes(game.tetromino_queue.queue)
+        self.candidates[start:end] = solver.last_features
+        self.costs[start:end] = solver.last_costs
+        self.offsets[turn + 1] = end
+        self.chosen[turn] = solver.last_index
+        self.num_turns += 1
+        if self.num_turns == self.shard_turns:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered turns to a new shard"""
+        if self.num_turns == 0:
+            return
+        turns = self.num_turns
+        num_candidates = self.offsets[turns]
+        np.savez(
+            "{}.{:05d}.npz".format(self.path, self.num_shards),
+            boards=self.boards[:turns],
+            current=self.current[:turns],
+            held=self.held[:turns],
+            queue=self.queue[:turns],
+            offsets=self.offsets[: turns + 1],
+            candidates=self.candidates[:num_candidates],
+            costs=self.costs[:num_candidates],
+            chosen=self.chosen[:turns],
+        )
+        self.num_shards += 1
+        self.num_turns = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_shards(path):
+    """
+    Load every shard written by a TrainingExporter with the given path, and return a dictionary of the shards'
+    arrays concatenated in order, with the offsets adjusted to index the concatenated candidates.
+    """
+    shard_paths = sorted(
+        glob.glob(glob.escape(path) + ".[0-9][0-9][0-9][0-9][0-9].npz")
+    )
+    if not shard_paths:
+        raise FileNotFoundError("no training data shards found for {}".format(path))
+    arrays = {}
+    num_candidates = 0
+    for shard_path in shard_paths:
+        with np.load(shard_path) as shard:
+            for name in shard.files:
+                values = shard[name]
+                if name == "offsets":
+                    # Drop the final offset of every shard apart from the last
+                    values = values[:-1] + num_candidates
+                arrays.setdefault(name, []).append(values)
+            num_candidates += len(shard["candidates"])
+    arrays["offsets"].append(np.array([num_candidates], np.int64))
+    return {name: np.concatenate(values) for name, values in arrays.items()}
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    from .game import Game
+    from .solver import Solver
+
+    path = os.path.join(tempfile.mkdtemp(), "game")
+    solver = Solver()
+    game = Game(seed=0)
+    with TrainingExporter(path, shard_turns=64) as exporter:
+        while not game.is_over() and game.playfield.num_blocks_placed < 200:
+            outcome = solver.decide_outcome(game)
+            exporter.record(game, solver)
+            game.next_turn(outcome)
+    data = load_shards(path)
+    print({name: values.shape for name, values in data.items()})
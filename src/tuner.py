@@ -0,0 +1,216 @@
+#!usr/bin/env python3
+# Tune the solver's weights with the cross-entropy method, scoring candidates with seeded games spread across processes
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .runner import play_game
+from .solver import Solver
+
+# Most rows that a single tetromino can complete, i.e. the number of blocks in a tetromino over the playfield width.
+# Used to bound the score that a candidate can still reach.
+MAX_ROWS_PER_PIECE = 4 / 10
+
+
+def evaluate_weights(
+    weights, seeds, max_pieces, threshold=None, randomiser="uniform", **solver_options
+):
+    """
+    Play a game with each seed using the weights, and return the total number of rows cleared and the number of
+    games played. If threshold is given, stop as soon as the total can no longer reach it, even if every remaining
+    game cleared the most rows possible in max_pieces tetrominoes.
+    """
+    max_rows = int(max_pieces * MAX_ROWS_PER_PIECE)
+    total = 0
+    games_played = 0
+    for games_played, seed in enumerate(seeds, 1):
+        result = play_game(
+            seed, max_pieces, randomiser, weights=weights, **solver_options
+        )
+        total += result["rows_cleared"]
+        remaining = len(seeds) - games_played
+        if threshold is not None and total + remaining * max_rows < threshold:
+            break
+    return total, games_played
+
+
+class CrossEntropyTuner:
+    """
+    Search the weight space with the cross-entropy method. Each generation, population candidate weights are sampled
+    from a normal distribution and scored by the total rows cleared over a fixed set of seeded games, so every
+    candidate is compared on the same tetromino sequences. The distribution is then refitted to the elite candidates.
+    Candidates that can no longer score as well as the previous generation's worst elite are terminated early. The
+    state is saved to checkpoint_path after every generation, and tuning resumes from it if it exists. The search
+    starts from initial_weights, or Solver.WEIGHTS by default.
+    """
+
+    def __init__(
+        self,
+        seeds,
+        max_pieces=500,
+        population=16,
+        initial_weights=None,
+        elite_fraction=0.25,
+        initial_std=10.0,
+        min_std=1.0,
+        workers=None,
+        checkpoint_path=None,
+        rng_seed=0,
+        randomiser="uniform",
+        **solver_options
+    ):
+        self.seeds = list(seeds)
+        self.max_pieces = max_pieces
+        self.population = population
+        self.num_elite = max(1, int(population * elite_fraction))
+        self.min_std = min_std
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.checkpoint_path = checkpoint_path
+        self.randomiser = randomiser
+        self.solver_options = solver_options
+        if initial_weights is None:
+            initial_weights = Solver.WEIGHTS
+        # The features being tuned are the keys of the initial weights
+        self.names = list(initial_weights)
+
+        self.generation = 0
+        self.mean = np.array(
+            [initial_weights[name] for name in self.names], dtype=np.float64
+        )
+        self.std = np.full(len(self.names), initial_std)
+        self.rng = np.random.default_rng(rng_seed)
+        self.threshold = None
+        self.best_weights = dict(initial_weights)
+        self.best_score = None
+        self.history = []
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    def get_state(self):
+        """Return the tuner's state as a JSON serialisable dictionary"""
+        return {
+            "seeds": self.seeds,
+            "max_pieces": self.max_pieces,
+            "generation": self.generation,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "rng": self.rng.bit_generator.state,
+            "threshold": self.threshold,
+            "best_weights": self.best_weights,
+            "best_score": self.best_score,
+            "history": self.history,
+        }
+
+    def save_checkpoint(self):
+        # Write to a temporary file first so that an interrupted save never corrupts the checkpoint
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(self.get_state(), checkpoint_file, indent=2)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path) as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state["seeds"] != self.seeds or state["max_pieces"] != self.max_pieces:
+            raise ValueError(
+                "{} was made with different seeds or max pieces".format(
+                    self.checkpoint_path
+                )
+            )
+        self.generation = state["generation"]
+        self.mean = np.array(state["mean"])
+        self.std = np.array(state["std"])
+        self.rng.bit_generator.state = state["rng"]
+        self.threshold = state["threshold"]
+        self.best_weights = state["best_weights"]
+        self.best_score = state["best_score"]
+        self.history = state["history"]
+
+    def sample(self):
+        """Return a list of population candidate weight dictionaries, rounded to integers"""
+        samples = np.rint(
+            self.rng.normal(self.mean, self.std, (self.population, len(self.names)))
+        ).astype(np.int64)
+        return [dict(zip(self.names, sample.tolist())) for sample in samples]
+
+    def run_generation(self, executor=None):
+        """
+        Sample, score and select one generation of candidates, and return a dictionary of statistics about it.
+        """
+        start_time = time.perf_counter()
+        candidates = self.sample()
+        arguments = [
+            (weights, self.seeds, self.max_pieces, self.threshold, self.randomiser)
+            for weights in candidates
+        ]
+        if executor is None:
+            results = [
+                evaluate_weights(*args, **self.solver_options) for args in arguments
+            ]
+        else:
+            futures = [
+                executor.submit(evaluate_weights, *args, **self.solver_options)
+                for args in arguments
+            ]
+            results = [future.result() for future in futures]
+        scores = np.array([total for total, _ in results])
+        games_played = np.array([games for _, games in results])
+        # Terminated candidates have scores below the threshold, so they are never elite unless too few candidates
+        # finished, in which case they are ranked by their partial scores. The sort is stable so ties keep their
+        # sampled order.
+        elite = np.argsort(-scores, kind="stable")[: self.num_elite]
+        elite_weights = np.array(
+            [[candidates[index][name] for name in self.names] for index in elite],
+            dtype=np.float64,
+        )
+        self.mean = elite_weights.mean(axis=0)
+        self.std = np.maximum(elite_weights.std(axis=0), self.min_std)
+        if games_played[elite[-1]] == len(self.seeds):
+            self.threshold = int(scores[elite[-1]])
+        best = elite[0]
+        if games_played[best] == len(self.seeds) and (
+            self.best_score is None or scores[best] > self.best_score
+        ):
+            self.best_score = int(scores[best])
+            self.best_weights = candidates[best]
+        self.generation += 1
+        stats = {
+            "generation": self.generation,
+            "best_score": int(scores[best]),
+            "elite_mean_score": float(scores[elite].mean()),
+            "terminated": int((games_played < len(self.seeds)).sum()),
+            "games_played": int(games_played.sum()),
+            "mean": dict(zip(self.names, self.mean.round(2).tolist())),
+            "time": time.perf_counter() - start_time,
+        }
+        self.history.append(stats)
+        if self.checkpoint_path is not None:
+            self.save_checkpoint()
+        return stats
+
+    def run(self, generations, callback=None):
+        """
+        Run until generations generations have been run in total, including any from a resumed checkpoint. callback
+        is called with the statistics of every generation. Return the best weights found and their score.
+        """
+        if self.workers == 1:
+            while self.generation < generations:
+                stats = self.run_generation()
+                if callback is not None:
+                    callback(stats)
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                while self.generation < generations:
+                    stats = self.run_generation(executor)
+                    if callback is not None:
+                        callback(stats)
+        return self.best_weights, self.best_score
+
+
+if __name__ == "__main__":
+    tuner = CrossEntropyTuner(range(2), max_pieces=50, population=4, workers=1)
+    print(tuner.run(2, print))
@@ -1,22 +1,657 @@
 #!usr/bin/env python3
 # Plays tetris using by modelling, solving and displaying the game
 
-from src.game import Game
-from src.solver import Solver
-from src.display import update_display
+import argparse
+import asyncio
+import sys
+import time
 
+from src.game import PLAYFIELD_CLASSES, Game
+from src.display import TerminalRenderer, get_display_element_string
+from src.instrumentation import PROFILER
+from src.pipeline import RenderPipeline
+from src.replay import ReplayReader, ReplayWriter
+from src.solver import cross_check_outcomes, load_weights, save_weights
+from src.tuner import CrossEntropyTuner
+from src import benchmark, kernel, runner, service, soak
+from src.opening_book import DEFAULT_MIN_COUNT, BookBuilder
+
+
+def positive_int(value):
+    """Argument type for integers of at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not a positive integer".format(value))
+    return number
+
+
+def add_solver_arguments(parser):
+    """
+    Add the arguments used to configure the solver to the parser.
+    """
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        help="number of tetrominoes to look ahead through, including the current tetromino",
+    )
+    parser.add_argument(
+        "--beam-width", type=int, default=8, help="number of boards kept per depth"
+    )
+    parser.add_argument(
+        "--cache-bytes",
+        type=int,
+        default=0,
+        help="memory cap of the evaluation cache, or 0 to disable it",
+    )
+    parser.add_argument(
+        "--weights",
+        default=None,
+        help="JSON file of solver weights, e.g. from the tune command",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=kernel.BACKENDS,
+        default="auto",
+        help='placement backend, "check" compares the compiled kernel against numpy on every move',
+    )
+    parser.add_argument(
+        "--reachability",
+        action="store_true",
+        help="let the greedy solver tuck and spin tetrominoes under overhangs, using only reachable placements",
+    )
+    parser.add_argument(
+        "--eval-workers",
+        type=int,
+        default=0,
+        help="number of processes that evaluate large batches, e.g. of a deep search, through shared memory",
+    )
+    parser.add_argument(
+        "--book",
+        default=None,
+        help="opening book file, e.g. from batch --build-book, whose moves are played without searching",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="let the greedy solver build only the boards of outcomes that clear rows",
+    )
+
+
+def get_solver_options(args):
+    return {
+        "depth": args.depth,
+        "beam_width": args.beam_width,
+        "cache_bytes": args.cache_bytes,
+        "weights": load_weights(args.weights) if args.weights is not None else None,
+        "backend": args.backend,
+        "reachability": args.reachability,
+        "eval_workers": args.eval_workers,
+        "book_path": args.book,
+        "prune": args.prune,
+    }
+
+
+def add_randomiser_argument(parser):
+    parser.add_argument(
+        "--randomiser",
+        default="uniform",
+        help='tetromino randomiser, "uniform", "bag" or the path of a sequence file',
+    )
+
+
+def add_playfield_argument(parser):
+    parser.add_argument(
+        "--playfield",
+        choices=list(PLAYFIELD_CLASSES),
+        default="numpy",
+        help="playfield backend that the game is played on",
+    )
+
+
+def add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="write per-turn profiling events to this file as JSON lines",
+    )
 
-def main():
 
+def add_replay_argument(parser):
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="record the game to this replay file",
+    )
+
+
+def add_deadline_argument(parser):
+    parser.add_argument(
+        "--move-deadline-ms",
+        type=float,
+        default=None,
+        help="decide every move within this many milliseconds, searching as deep as time allows",
+    )
+
+
+def get_move_deadline(args):
+    """Return the move deadline in seconds, or None if there isn't one"""
+    if args.move_deadline_ms is None:
+        return None
+    return args.move_deadline_ms / 1000
+
+
+def play(args):
+    """
+    Play a single game, displaying every turn.
+    """
     # Initialise game objects
-    solver = Solver()
-    game = Game()
-
-    while not game.is_over():
-        chosen_outcome = solver.decide_outcome(game)
-        game.next_turn(chosen_outcome)
-        update_display(game)
-    print("GAME OVER")
+    solver = runner.make_solver(**get_solver_options(args))
+    recorder = ReplayWriter(args.replay) if args.replay is not None else None
+    game = Game(
+        PLAYFIELD_CLASSES[args.playfield],
+        seed=args.seed,
+        randomiser=args.randomiser,
+        recorder=recorder,
+    )
+    if args.profile is not None:
+        PROFILER.enable(open(args.profile, "w"))
+
+    try:
+        renderer = TerminalRenderer(args.max_fps)
+
+        if args.pipeline:
+            # Solve in a separate thread while rendering the latest frame
+            RenderPipeline(renderer).run(game, solver)
+        else:
+            while not game.is_over():
+                chosen_outcome = solver.decide_outcome(game)
+                game.next_turn(chosen_outcome)
+                renderer.draw(game)
+            # Always draw the final frame
+            renderer.draw(game, force=True)
+        print("GAME OVER")
+    finally:
+        # The replay is closed even if the game raises
+        if recorder is not None:
+            recorder.close()
+        if args.profile is not None:
+            sink = PROFILER.sink
+            PROFILER.disable()
+            sink.close()
+
+    if args.profile is not None:
+        print(PROFILER.format_summary())
+
+
+def batch(args):
+    """
+    Play many seeded games without a display and print summary statistics.
+    """
+    start_time = time.perf_counter()
+    results = runner.run_games(
+        args.games,
+        workers=args.workers,
+        max_pieces=args.max_pieces,
+        seed_start=args.seed_start,
+        randomiser=args.randomiser,
+        playfield=args.playfield,
+        profile_path=args.profile,
+        replay_path=args.replay,
+        export_path=args.export,
+        move_deadline=get_move_deadline(args),
+        build_book=args.build_book is not None,
+        **get_solver_options(args),
+    )
+    print(
+        runner.format_summary(
+            runner.summarise(results, time.perf_counter() - start_time)
+        )
+    )
+    if args.build_book is not None:
+        builder = BookBuilder(results[0]["book_settings"])
+        for result in results:
+            builder.update(result["book_counts"])
+        num_entries = builder.write(args.build_book, args.book_min_count)
+        print("wrote {} book entries to {}".format(num_entries, args.build_book))
+
+
+def tune(args):
+    """
+    Tune the solver's weights and save the best weights found.
+    """
+    solver_options = get_solver_options(args)
+    tuner = CrossEntropyTuner(
+        range(args.seed_start, args.seed_start + args.games),
+        max_pieces=args.max_pieces,
+        population=args.population,
+        initial_weights=solver_options.pop("weights"),
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        randomiser=args.randomiser,
+        **solver_options,
+    )
+
+    def print_generation(stats):
+        print(
+            "generation {generation}: best = {best_score}, elite mean = {elite_mean_score:.1f}, "
+            "terminated = {terminated}, time = {time:.1f} s, mean weights = {mean}".format(
+                **stats
+            )
+        )
+
+    weights, score = tuner.run(args.generations, print_generation)
+    print("best weights = {}, rows cleared = {}".format(weights, score))
+    save_weights(weights, args.output)
+
+
+def show_replay(args):
+    """
+    Print the playfield at the start of a turn of a recorded game, and the move made on that turn.
+    """
+    reader = ReplayReader(args.path)
+    turn = args.turn if args.turn is not None else len(reader)
+    playfield = reader.get_playfield(turn)
+    print(
+        "turn {} of {}, num blocks placed = {}, num rows cleared = {}".format(
+            turn, len(reader), playfield.num_blocks_placed, playfield.num_rows_cleared
+        )
+    )
+    print(get_display_element_string(playfield))
+    if turn < len(reader):
+        move = reader.get_move(turn)
+        print(
+            "current = {current}, held = {held}, hold swap = {hold_swap}, rotations = {rotations}, "
+            "col = {col}".format(**move)
+        )
+
+
+def crosscheck(args):
+    """
+    Check that the compiled kernel gives identical results to the reference Playfield implementation. Without numba,
+    the kernel is checked as plain Python. Then check the solver's batched outcomes against its per-outcome reference.
+    """
+    num_checked = kernel.cross_check(args.boards, args.seed, compiled=False)
+    print(
+        "{} placements identical to Playfield, backend = {}".format(
+            num_checked, kernel.get_backend()
+        )
+    )
+    num_checked = cross_check_outcomes(args.boards, args.seed)
+    print("{} outcomes identical to Solver.get_reference_outcomes".format(num_checked))
+
+
+def serve(args):
+    """
+    Serve move requests from other processes over a Unix socket until interrupted, then print the service's
+    statistics.
+    """
+    solver_service = service.SolverService(
+        args.socket, args.max_batch, **get_solver_options(args)
+    )
+    print("serving on {}".format(args.socket))
+    try:
+        asyncio.run(solver_service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    print(runner.format_summary(solver_service.get_stats()))
+
+
+def soak_test(args):
+    """
+    Play games back to back until the duration or number of games is reached, or until interrupted, printing a line
+    of rolling statistics every report interval. Exit with an error if memory use grows too much.
+    """
+    soak_runner = soak.SoakRunner(
+        max_pieces=args.max_pieces,
+        seed_start=args.seed_start,
+        randomiser=args.randomiser,
+        window=args.window,
+        report_interval=args.report_interval,
+        warmup_games=args.warmup_games,
+        max_growth=int(args.max_growth_mb * 1024 * 1024),
+        trace=args.trace,
+        move_deadline=get_move_deadline(args),
+        **get_solver_options(args),
+    )
+
+    def report(stats):
+        print(soak.format_report(stats), flush=True)
+
+    try:
+        stats = soak_runner.run(args.duration, args.games, report)
+    except soak.MemoryGrowthError as error:
+        print("MEMORY GROWTH: {}".format(error))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        stats = soak_runner.get_stats()
+    print(runner.format_summary(stats))
+    print("game lengths:\n" + soak_runner.format_histogram())
+
+
+def bench(args):
+    """
+    Run the benchmark suite, optionally comparing against and saving a baseline. Exit with an error if any
+    benchmark has regressed compared to the baseline.
+    """
+    results = benchmark.run_benchmarks(args.filter, args.min_time)
+    ratios = None
+    regressions = []
+    if args.baseline is not None:
+        ratios, regressions = benchmark.compare(
+            results, benchmark.load_baseline(args.baseline), args.tolerance
+        )
+    print(benchmark.format_results(results, ratios))
+    if args.book is not None:
+        print(
+            runner.format_summary(
+                benchmark.measure_book(
+                    args.book,
+                    args.book_games,
+                    args.book_max_pieces,
+                    depth=args.book_depth,
+                )
+            )
+        )
+    if args.save_baseline is not None:
+        benchmark.save_baseline(results, args.save_baseline)
+    if regressions:
+        print("REGRESSIONS:\n" + "\n".join(regressions))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Automated Tetris player.")
+    # Play a single game with the default solver if no command is given
+    parser.set_defaults(
+        func=play,
+        depth=1,
+        beam_width=8,
+        randomiser="uniform",
+        cache_bytes=0,
+        seed=None,
+        profile=None,
+        max_fps=None,
+        pipeline=False,
+        replay=None,
+        weights=None,
+        backend="auto",
+        reachability=False,
+        eval_workers=0,
+        book=None,
+        prune=False,
+    )
+    subparsers = parser.add_subparsers(title="commands")
+
+    play_parser = subparsers.add_parser(
+        "play", help="play a single game with a display (default)"
+    )
+    add_solver_arguments(play_parser)
+    add_randomiser_argument(play_parser)
+    add_playfield_argument(play_parser)
+    add_profile_argument(play_parser)
+    add_replay_argument(play_parser)
+    play_parser.add_argument(
+        "--seed", type=int, default=None, help="seed of the tetromino sequence"
+    )
+    play_parser.add_argument(
+        "--max-fps",
+        type=float,
+        default=None,
+        help="maximum number of frames drawn per second (default: draw every turn)",
+    )
+    play_parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="solve in a separate thread, dropping frames if the display falls behind",
+    )
+    play_parser.set_defaults(func=play)
+
+    batch_parser = subparsers.add_parser(
+        "batch", help="play many seeded games without a display"
+    )
+    add_solver_arguments(batch_parser)
+    add_randomiser_argument(batch_parser)
+    add_playfield_argument(batch_parser)
+    add_profile_argument(batch_parser)
+    add_replay_argument(batch_parser)
+    batch_parser.add_argument(
+        "--games", type=positive_int, default=100, help="number of games to play"
+    )
+    batch_parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=None,
+        help="number of processes (default: number of CPUs)",
+    )
+    batch_parser.add_argument(
+        "--max-pieces",
+        type=int,
+        default=None,
+        help="stop each game after this many tetrominoes",
+    )
+    batch_parser.add_argument(
+        "--seed-start",
+        type=int,
+        default=0,
+        help="seed of the first game, later games use consecutive seeds",
+    )
+    batch_parser.add_argument(
+        "--export",
+        default=None,
+        help="export every decision as training data to npz shards with this path prefix",
+    )
+    batch_parser.add_argument(
+        "--build-book",
+        default=None,
+        help="write an opening book of the moves played to this file",
+    )
+    batch_parser.add_argument(
+        "--book-min-count",
+        type=int,
+        default=DEFAULT_MIN_COUNT,
+        help="only write positions to the book that were seen at least this many times",
+    )
+    add_deadline_argument(batch_parser)
+    batch_parser.set_defaults(func=batch)
+
+    tune_parser = subparsers.add_parser(
+        "tune", help="tune the solver's weights with seeded games"
+    )
+    add_solver_arguments(tune_parser)
+    add_randomiser_argument(tune_parser)
+    tune_parser.add_argument(
+        "--generations", type=int, default=20, help="number of generations to run"
+    )
+    tune_parser.add_argument(
+        "--population",
+        type=int,
+        default=16,
+        help="number of candidate weights per generation",
+    )
+    tune_parser.add_argument(
+        "--games",
+        type=positive_int,
+        default=8,
+        help="number of games played per candidate",
+    )
+    tune_parser.add_argument(
+        "--max-pieces",
+        type=int,
+        default=500,
+        help="stop each game after this many tetrominoes",
+    )
+    tune_parser.add_argument(
+        "--seed-start",
+        type=int,
+        default=0,
+        help="seed of the first game, later games use consecutive seeds",
+    )
+    tune_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes (default: number of CPUs)",
+    )
+    tune_parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="save the tuner's state to this JSON file every generation, and resume from it if it exists",
+    )
+    tune_parser.add_argument(
+        "--output", default="weights.json", help="file to save the best weights to"
+    )
+    tune_parser.set_defaults(func=tune)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="show a turn of a recorded game"
+    )
+    replay_parser.add_argument("path", help="replay file")
+    replay_parser.add_argument(
+        "--turn",
+        type=int,
+        default=None,
+        help="turn to show, counting from 0 (default: the end of the game)",
+    )
+    replay_parser.set_defaults(func=show_replay)
+
+    crosscheck_parser = subparsers.add_parser(
+        "crosscheck", help="check the compiled kernel against the reference playfield"
+    )
+    crosscheck_parser.add_argument(
+        "--boards", type=int, default=100, help="number of random boards to check"
+    )
+    crosscheck_parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the random boards"
+    )
+    crosscheck_parser.set_defaults(func=crosscheck)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="serve moves to other processes over a Unix socket"
+    )
+    add_solver_arguments(serve_parser)
+    serve_parser.add_argument(
+        "--socket", default="tetris_bot.sock", help="path of the Unix socket"
+    )
+    serve_parser.add_argument(
+        "--max-batch",
+        type=int,
+        default=service.DEFAULT_MAX_BATCH,
+        help="most requests evaluated in a single batch",
+    )
+    serve_parser.set_defaults(func=serve)
+
+    soak_parser = subparsers.add_parser(
+        "soak",
+        help="play games back to back for a long time, checking that memory use stays bounded",
+    )
+    add_solver_arguments(soak_parser)
+    add_randomiser_argument(soak_parser)
+    soak_parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="seconds to run for (default: until interrupted)",
+    )
+    soak_parser.add_argument(
+        "--games",
+        type=int,
+        default=None,
+        help="number of games to play (default: until interrupted)",
+    )
+    soak_parser.add_argument(
+        "--max-pieces",
+        type=int,
+        default=None,
+        help="stop each game after this many tetrominoes",
+    )
+    soak_parser.add_argument(
+        "--seed-start",
+        type=int,
+        default=0,
+        help="seed of the first game, later games use consecutive seeds",
+    )
+    soak_parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=soak.DEFAULT_REPORT_INTERVAL,
+        help="seconds between reports",
+    )
+    soak_parser.add_argument(
+        "--window",
+        type=int,
+        default=soak.DEFAULT_WINDOW,
+        help="number of recent games in the game length percentiles",
+    )
+    soak_parser.add_argument(
+        "--warmup-games",
+        type=int,
+        default=soak.DEFAULT_WARMUP_GAMES,
+        help="games played before the memory baseline is taken",
+    )
+    soak_parser.add_argument(
+        "--max-growth-mb",
+        type=float,
+        default=soak.DEFAULT_MAX_GROWTH / (1024 * 1024),
+        help="fail if RSS or traced memory grows by more than this past the baseline",
+    )
+    soak_parser.add_argument(
+        "--no-trace",
+        dest="trace",
+        action="store_false",
+        help="don't trace allocations with tracemalloc, which makes the solver about three times slower",
+    )
+    add_deadline_argument(soak_parser)
+    soak_parser.set_defaults(func=soak_test)
+
+    bench_parser = subparsers.add_parser(
+        "bench", help="benchmark the playfield and solver hot paths"
+    )
+    bench_parser.add_argument(
+        "--filter", default=None, help="only run benchmarks containing this string"
+    )
+    bench_parser.add_argument(
+        "--min-time", type=float, default=0.2, help="time spent on each benchmark"
+    )
+    bench_parser.add_argument(
+        "--baseline", default=None, help="baseline JSON file to compare against"
+    )
+    bench_parser.add_argument(
+        "--save-baseline", default=None, help="save the results as a baseline JSON file"
+    )
+    bench_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=benchmark.DEFAULT_TOLERANCE,
+        help="relative drop in ops/sec that is reported as a regression",
+    )
+    bench_parser.add_argument(
+        "--book",
+        default=None,
+        help="also measure the hit rate and speedup of this opening book over seeded games",
+    )
+    bench_parser.add_argument(
+        "--book-games",
+        type=int,
+        default=4,
+        help="number of games played with and without the book",
+    )
+    bench_parser.add_argument(
+        "--book-max-pieces",
+        type=int,
+        default=200,
+        help="stop each book game after this many tetrominoes",
+    )
+    bench_parser.add_argument(
+        "--book-depth",
+        type=int,
+        default=1,
+        help="search depth of the solver the book is compared against",
+    )
+    bench_parser.set_defaults(func=bench)
+
+    args = parser.parse_args()
+    args.func(args)
 
 
 if __name__ == "__main__":